@@ -0,0 +1,113 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import asyncio
+import inspect
+import statistics
+import time
+import typing as t
+
+__all__ = ["benchmark", "skip", "run", "Skipped"]
+
+FactoryT = t.Callable[[], t.Any]
+
+_registry: t.Dict[str, FactoryT] = {}
+
+
+class Skipped(Exception):
+    pass
+
+
+def skip(reason: str) -> t.NoReturn:
+    raise Skipped(reason)
+
+
+def benchmark(name: str) -> t.Callable[[FactoryT], FactoryT]:
+    # The decorated factory performs any setup and returns the zero-argument callable (or coroutine
+    # function) to time. Raising Skipped from the factory skips the benchmark.
+    def decorate(factory: FactoryT) -> FactoryT:
+        _registry[name] = factory
+        return factory
+
+    return decorate
+
+
+def _calibrate(func: t.Callable[[int], float], budget: float) -> int:
+    number = 1
+    while True:
+        if func(number) >= budget or number >= 10_000_000:
+            return number
+        number *= 10
+
+
+def _time_sync(target: t.Callable[[], t.Any], repeat: int, budget: float) -> t.List[float]:
+    def loop(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            target()
+        return time.perf_counter() - start
+
+    number = _calibrate(loop, budget)
+    return [loop(number) / number for _ in range(repeat)]
+
+
+def _time_async(target: t.Callable[[], t.Awaitable[t.Any]], repeat: int, budget: float) -> t.List[float]:
+    async def loop(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await target()
+        return time.perf_counter() - start
+
+    loop_ = asyncio.new_event_loop()
+    try:
+        number = _calibrate(lambda n: loop_.run_until_complete(loop(n)), budget)
+        return [loop_.run_until_complete(loop(number)) / number for _ in range(repeat)]
+    finally:
+        loop_.close()
+
+
+def run(
+    pattern: t.Optional[str] = None, repeat: int = 5, budget: float = 0.2, out: t.Callable[[str], None] = print
+) -> t.Dict[str, t.Dict[str, float]]:
+    from benchmarks import bench_cacheable  # noqa: F401
+    from benchmarks import bench_memory  # noqa: F401
+    from benchmarks import bench_redis  # noqa: F401
+    from benchmarks import bench_serde  # noqa: F401
+
+    results: t.Dict[str, t.Dict[str, float]] = {}
+    for name, factory in _registry.items():
+        if pattern is not None and pattern not in name:
+            continue
+
+        try:
+            target = factory()
+        except Skipped as e:
+            out(f"{name:<56}skipped ({e})")
+            continue
+
+        timings = (
+            _time_async(target, repeat, budget)
+            if inspect.iscoroutinefunction(target)
+            else _time_sync(target, repeat, budget)
+        )
+        results[name] = {"min_ns": min(timings) * 1e9, "median_ns": statistics.median(timings) * 1e9}
+        out(f"{name:<56}{results[name]['min_ns']:>14.1f} ns{results[name]['median_ns']:>14.1f} ns (median)")
+    return results
@@ -0,0 +1,75 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# Runs the benchmark suite, optionally saving the results or comparing them against a saved run.
+#
+#   python -m benchmarks --save baseline
+#   python -m benchmarks --compare baseline --threshold 0.1
+import argparse
+import json
+import pathlib
+import sys
+
+import benchmarks
+
+RESULTS_DIR = pathlib.Path(__file__).parent / "results"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> int:
+    regressions = 0
+    print(f"\n{'benchmark':<56}{'baseline':>14}{'current':>14}{'change':>10}")
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+
+        before, after = baseline[name]["min_ns"], result["min_ns"]
+        change = after / before - 1
+        flag = ""
+        if change > threshold:
+            flag, regressions = "  REGRESSION", regressions + 1
+        print(f"{name:<56}{before:>11.1f} ns{after:>11.1f} ns{change:>+10.1%}{flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-k", "--filter", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repetitions per benchmark")
+    parser.add_argument("--budget", type=float, default=0.2, help="minimum seconds per repetition")
+    parser.add_argument("--save", metavar="NAME", help="save results to benchmarks/results/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare against benchmarks/results/NAME.json")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown treated as a regression")
+    args = parser.parse_args()
+
+    results = benchmarks.run(args.filter, args.repeat, args.budget)
+
+    if args.save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        (RESULTS_DIR / f"{args.save}.json").write_text(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare:
+        baseline = json.loads((RESULTS_DIR / f"{args.compare}.json").read_text())
+        if regressions := compare(results, baseline, args.threshold):
+            print(f"\n{regressions} benchmark(s) regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import typing as t
+
+import cache
+from benchmarks import benchmark
+
+
+def _setup() -> None:
+    cache.setup()
+
+
+@benchmark("cacheable.direct_call")
+def direct_call() -> t.Callable[[], t.Any]:
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    return lambda: func(1, 2)
+
+
+@benchmark("cacheable.hit.constant_key")
+def hit_constant_key() -> t.Callable[[], t.Any]:
+    _setup()
+
+    @cache.enable("bench", "constant")
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    func(1, 2)
+    return lambda: func(1, 2)
+
+
+@benchmark("cacheable.hit.expression_key")
+def hit_expression_key() -> t.Callable[[], t.Any]:
+    _setup()
+
+    @cache.enable("bench", cache.Ex("str(a)"))
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    func(1, 2)
+    return lambda: func(1, 2)
+
+
+@benchmark("cacheable.hit.expression_key_and_at")
+def hit_expression_key_and_at() -> t.Callable[[], t.Any]:
+    _setup()
+
+    @cache.enable(cache.Ex("str(a)"), cache.Ex("str(b)"))
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    func(1, 2)
+    return lambda: func(1, 2)
+
+
+@benchmark("cacheable.hit.many_arguments")
+def hit_many_arguments() -> t.Callable[[], t.Any]:
+    _setup()
+
+    @cache.enable("bench", cache.Ex("str(a)"))
+    def func(a: int, b: int, c: int, d: int, e: int, *args: int, f: int = 0, **kwargs: int) -> int:
+        return a
+
+    func(1, 2, 3, 4, 5, 6, 7, f=1, g=2)
+    return lambda: func(1, 2, 3, 4, 5, 6, 7, f=1, g=2)
+
+
+@benchmark("cacheable.miss.constant_key")
+def miss_constant_key() -> t.Callable[[], t.Any]:
+    instance = cache.setup()
+
+    @cache.enable("bench", "constant", unless=cache.Ex("a > 0"))
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    def call() -> t.Any:
+        instance.evict("bench", "constant")
+        return func(1, 2)
+
+    return call
+
+
+@benchmark("cacheable.miss.expression_options")
+def miss_expression_options() -> t.Callable[[], t.Any]:
+    instance = cache.setup()
+
+    @cache.enable("bench", cache.Ex("str(a)"), when=cache.Ex("a > 0"), ttl=cache.Ex("b * 60"))
+    def func(a: int, b: int) -> int:
+        return a + b
+
+    def call() -> t.Any:
+        instance.evict("bench", "1")
+        return func(1, 2)
+
+    return call
+
+
+@benchmark("cacheable.async.direct_call")
+def async_direct_call() -> t.Callable[[], t.Awaitable[t.Any]]:
+    async def func(a: int, b: int) -> int:
+        return a + b
+
+    async def call() -> t.Any:
+        return await func(1, 2)
+
+    return call
+
+
+@benchmark("cacheable.async.hit.expression_key")
+def async_hit_expression_key() -> t.Callable[[], t.Awaitable[t.Any]]:
+    _setup()
+
+    @cache.enable("bench", cache.Ex("str(a)"))
+    async def func(a: int, b: int) -> int:
+        return a + b
+
+    async def call() -> t.Any:
+        return await func(1, 2)
+
+    return call
+
+
+@benchmark("cacheable.key_expression.evaluate")
+def key_expression_evaluate() -> t.Callable[[], t.Any]:
+    expression = cache.Ex("str(a) + ':' + str(b)")
+    expression.evaluate({"a": 1, "b": 2})
+    return lambda: expression.evaluate({"a": 1, "b": 2})
@@ -0,0 +1,139 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import atexit
+import itertools
+import os
+import random
+import tempfile
+import typing as t
+
+from benchmarks import benchmark
+from cache import abc
+from cache.implementations import memory
+
+SIZES = (1_000, 100_000, 1_000_000)
+
+
+def _filled(size: int, **options: t.Any) -> memory.InMemoryCacheImpl:
+    instance = memory.InMemoryCacheImpl(**options)
+    instance.put_many([(str(i % 100), str(i), i, None) for i in range(size)])
+    return instance
+
+
+def _register() -> None:
+    for size in SIZES:
+
+        def get_hit(size: int = size) -> t.Callable[[], t.Any]:
+            instance, keys = _filled(size), itertools.cycle([(str(i % 100), str(i)) for i in range(0, size, 97)])
+            return lambda: instance.get(*next(keys))
+
+        def get_miss(size: int = size) -> t.Callable[[], t.Any]:
+            instance = _filled(size)
+            return lambda: instance.get("missing", "missing")
+
+        def put(size: int = size) -> t.Callable[[], t.Any]:
+            instance, counter = _filled(size), itertools.count()
+            return lambda: instance.put("bench", str(next(counter) % size), 1, None)
+
+        def put_ttl(size: int = size) -> t.Callable[[], t.Any]:
+            instance, counter = _filled(size), itertools.count()
+            return lambda: instance.put("bench", str(next(counter) % size), 1, 3600)
+
+        benchmark(f"memory.get_hit.{size}")(get_hit)
+        benchmark(f"memory.get_miss.{size}")(get_miss)
+        benchmark(f"memory.put.{size}")(put)
+        benchmark(f"memory.put_ttl.{size}")(put_ttl)
+
+    for policy in ("lru", "lfu", "tinylfu"):
+
+        def bounded(policy: str = policy) -> t.Callable[[], t.Any]:
+            # Zipf-like key distribution over a keyspace ten times larger than the cache
+            instance = memory.InMemoryCacheImpl(max_entries=10_000, eviction_policy=policy)
+            rng = random.Random(0)
+            keys = itertools.cycle([str(int(rng.paretovariate(1.0)) % 100_000) for _ in range(100_000)])
+
+            def call() -> t.Any:
+                key = next(keys)
+                if instance.get("bench", key) is abc._EMPTY:
+                    instance.put("bench", key, 1, None)
+
+            return call
+
+        benchmark(f"memory.bounded_get_or_put.{policy}")(bounded)
+
+    @benchmark("memory.sharded.get_hit.100000")
+    def sharded_get_hit() -> t.Callable[[], t.Any]:
+        instance = memory.ShardedInMemoryCacheImpl(16)
+        instance.put_many([(str(i % 100), str(i), i, None) for i in range(100_000)])
+        keys = itertools.cycle([(str(i % 100), str(i)) for i in range(0, 100_000, 97)])
+        return lambda: instance.get(*next(keys))
+
+    @benchmark("memory.snapshot.dump.10000")
+    def snapshot_dump() -> t.Callable[[], t.Any]:
+        instance, path = _filled(10_000), os.path.join(tempfile.mkdtemp(prefix="pycaching-bench-"), "snapshot")
+        return lambda: instance.dump(path)
+
+    @benchmark("memory.snapshot.load.10000")
+    def snapshot_load() -> t.Callable[[], t.Any]:
+        path = os.path.join(tempfile.mkdtemp(prefix="pycaching-bench-"), "snapshot")
+        _filled(10_000).dump(path)
+        return lambda: memory.InMemoryCacheImpl().load(path)
+
+
+_register()
+
+
+@benchmark("shm.get_hit")
+def shm_get_hit() -> t.Callable[[], t.Any]:
+    from cache.implementations import shm
+
+    instance = shm.SharedMemoryCacheImpl(f"bench-{os.getpid()}", size="64MB")
+    atexit.register(instance.unlink)
+    instance.put_many([("bench", str(i), {"id": i}, None) for i in range(10_000)])
+    keys = itertools.cycle([("bench", str(i)) for i in range(0, 10_000, 7)])
+    return lambda: instance.get(*next(keys))
+
+
+@benchmark("shm.put")
+def shm_put() -> t.Callable[[], t.Any]:
+    from cache.implementations import shm
+
+    instance = shm.SharedMemoryCacheImpl(f"bench-{os.getpid()}", size="64MB")
+    atexit.register(instance.unlink)
+    counter = itertools.count()
+    return lambda: instance.put("bench", str(next(counter) % 10_000), {"id": 1}, None)
+
+
+@benchmark("sqlite.get_hit")
+def sqlite_get_hit() -> t.Callable[[], t.Any]:
+    from cache.implementations import sqlite
+
+    instance = sqlite.SQLiteCacheImpl(tempfile.mkdtemp(prefix="pycaching-bench-"))
+    instance.put_many([("bench", str(i), {"id": i}, None) for i in range(10_000)])
+    keys = itertools.cycle([("bench", str(i)) for i in range(0, 10_000, 7)])
+    return lambda: instance.get(*next(keys))
+
+
+@benchmark("sqlite.put")
+def sqlite_put() -> t.Callable[[], t.Any]:
+    from cache.implementations import sqlite
+
+    instance, counter = sqlite.SQLiteCacheImpl(tempfile.mkdtemp(prefix="pycaching-bench-")), itertools.count()
+    return lambda: instance.put("bench", str(next(counter) % 10_000), {"id": 1}, None)
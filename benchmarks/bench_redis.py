@@ -0,0 +1,184 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import atexit
+import itertools
+import os
+import shutil
+import socket
+import subprocess
+import time
+import typing as t
+
+from benchmarks import benchmark
+from benchmarks import skip
+
+_urls: t.List[str] = []
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _spawn() -> str:
+    if (executable := shutil.which("redis-server")) is None:
+        skip("set REDIS_URL or put redis-server on PATH")
+
+    port = _free_port()
+    process = subprocess.Popen(
+        [executable, "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    atexit.register(process.terminate)
+
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    else:
+        skip("redis-server did not start")
+    return f"redis://127.0.0.1:{port}"
+
+
+def _redis_urls(n: int) -> t.List[str]:
+    # Uses the comma separated REDIS_URL when set, otherwise spawns throwaway redis-servers for the
+    # lifetime of the run
+    if not _urls and (urls := os.environ.get("REDIS_URL")) is not None:
+        _urls.extend(urls.split(","))
+    if len(_urls) < n and os.environ.get("REDIS_URL") is not None:
+        skip(f"needs {n} comma separated urls in REDIS_URL")
+
+    while len(_urls) < n:
+        _urls.append(_spawn())
+    return _urls[:n]
+
+
+def _redis_url() -> str:
+    return _redis_urls(1)[0]
+
+
+def _instance(**options: t.Any) -> t.Any:
+    url = _redis_url()
+    try:
+        from cache.implementations import redis
+    except ImportError as e:
+        skip(str(e))
+
+    instance = redis.RedisCacheImpl(url, **options)
+    instance.flush()
+    return instance
+
+
+def _register() -> None:
+    for layout in ("flat", "indexed"):
+
+        def get_hit(layout: str = layout) -> t.Callable[[], t.Any]:
+            instance = _instance(layout=layout)
+            instance.put("bench", "hit", {"id": 1, "name": "pycaching"}, None)
+            return lambda: instance.get("bench", "hit")
+
+        def put(layout: str = layout) -> t.Callable[[], t.Any]:
+            instance, counter = _instance(layout=layout), itertools.count()
+            return lambda: instance.put("bench", str(next(counter) % 1000), {"id": 1, "name": "pycaching"}, 60)
+
+        def get_many(layout: str = layout) -> t.Callable[[], t.Any]:
+            instance = _instance(layout=layout)
+            items = [("bench", str(i)) for i in range(100)]
+            instance.put_many([(key, at, i, None) for i, (key, at) in enumerate(items)])
+            return lambda: instance.get_many(items)
+
+        def aget_hit(layout: str = layout) -> t.Callable[[], t.Awaitable[t.Any]]:
+            instance = _instance(layout=layout)
+            instance.put("bench", "hit", {"id": 1, "name": "pycaching"}, None)
+
+            async def call() -> t.Any:
+                return await instance.aget("bench", "hit")
+
+            return call
+
+        benchmark(f"redis.{layout}.get_hit")(get_hit)
+        benchmark(f"redis.{layout}.put")(put)
+        benchmark(f"redis.{layout}.get_many.100")(get_many)
+        benchmark(f"redis.{layout}.aget_hit")(aget_hit)
+
+    @benchmark("redis.auto_batch.aget_hit")
+    def auto_batch_aget_hit() -> t.Callable[[], t.Awaitable[t.Any]]:
+        instance = _instance(auto_batch=True)
+        instance.put("bench", "hit", {"id": 1, "name": "pycaching"}, None)
+
+        async def call() -> t.Any:
+            return await instance.aget("bench", "hit")
+
+        return call
+
+    for scoped in (False, True):
+
+        def cacheable_hit(scoped: bool = scoped) -> t.Callable[[], t.Any]:
+            import contextvars
+
+            import cache
+
+            cache.Cache.set_instance(_instance())
+
+            @cache.enable("bench", cache.Ex("str(a)"))
+            def func(a: int) -> t.Dict[str, t.Any]:
+                return {"id": a, "name": "pycaching"}
+
+            # The memo is set in a copy of the context, the same way WSGIMiddleware does, so it never
+            # leaks into other benchmarks
+            context = contextvars.copy_context()
+            if scoped:
+                context.run(cache.scope._memo.set, {})
+            func(1)
+            return lambda: context.run(func, 1)
+
+        benchmark(f"redis.{'request_scope.' if scoped else ''}cacheable_hit")(cacheable_hit)
+
+    @benchmark("redis.write_behind.put")
+    def write_behind_put() -> t.Callable[[], t.Any]:
+        from cache.implementations import write_behind
+
+        instance, counter = write_behind.WriteBehindCacheImpl(_instance()), itertools.count()
+        return lambda: instance.put("bench", str(next(counter) % 1000), {"id": 1, "name": "pycaching"}, 60)
+
+    for route_on in ("key_at", "key"):
+
+        def sharded_get_many(route_on: str = route_on) -> t.Callable[[], t.Any]:
+            urls = _redis_urls(3)
+            try:
+                from cache.implementations import sharded_redis
+            except ImportError as e:
+                skip(str(e))
+
+            instance = sharded_redis.ShardedRedisCacheImpl(urls, route_on=route_on)
+            instance.flush()
+            items = [(f"bench{i % 10}", str(i)) for i in range(100)]
+            instance.put_many([(key, at, i, None) for i, (key, at) in enumerate(items)])
+            return lambda: instance.get_many(items)
+
+        benchmark(f"redis.sharded.{route_on}.get_many.100")(sharded_get_many)
+
+
+_register()
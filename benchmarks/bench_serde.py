@@ -0,0 +1,66 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import random
+import string
+import typing as t
+
+from benchmarks import benchmark
+from cache import serde
+
+
+class _Custom:
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+
+def _payloads() -> t.Dict[str, t.Any]:
+    rng = random.Random(0)
+    records = [
+        {"id": i, "name": "".join(rng.choices(string.ascii_lowercase, k=12)), "score": rng.random()}
+        for i in range(10_000)
+    ]
+    return {
+        "int": 12345,
+        "small_dict": {"id": 1, "name": "pycaching", "tags": ["a", "b"]},
+        "records_10k": records,
+        # Where the custom objects sit decides how much of the payload serialize has to walk
+        "records_10k_with_custom": [*records[:-10], *(_Custom(i) for i in range(10))],
+        "records_10k_with_custom_first": [*(_Custom(i) for i in range(10)), *records[10:]],
+        "bytes_1mb": bytes(1_000_000),
+    }
+
+
+def _register() -> None:
+    formats = {"json": serde.Serde("json"), "binary": serde.Serde("binary")}
+    for payload_name, payload in _payloads().items():
+        for format_name, instance in formats.items():
+            raw = instance.serialize(payload)
+
+            def serialize(instance: serde.Serde = instance, payload: t.Any = payload) -> t.Callable[[], t.Any]:
+                return lambda: instance.serialize(payload)
+
+            def deserialize(instance: serde.Serde = instance, raw: bytes = raw) -> t.Callable[[], t.Any]:
+                return lambda: instance.deserialize(raw)
+
+            benchmark(f"serde.{format_name}.serialize.{payload_name}")(serialize)
+            benchmark(f"serde.{format_name}.deserialize.{payload_name}")(deserialize)
+
+
+_register()
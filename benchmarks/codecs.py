@@ -0,0 +1,73 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# Compares payload size and CPU cost of each registered compression codec.
+#
+#   python -m benchmarks.codecs
+import random
+import string
+import time
+import typing as t
+
+from cache import serde
+
+
+def _payloads() -> t.Dict[str, t.Any]:
+    rng = random.Random(0)
+    return {
+        "small dict": {"id": 1, "name": "pycaching", "tags": ["a", "b"]},
+        "json document (~1MB)": [
+            {"id": i, "name": "".join(rng.choices(string.ascii_lowercase, k=16)), "score": rng.random()}
+            for i in range(15_000)
+        ],
+        "repetitive text (~1MB)": "lorem ipsum dolor sit amet " * 40_000,
+        "random bytes (1MB)": rng.randbytes(1_000_000) if hasattr(rng, "randbytes") else bytes(1_000_000),
+    }
+
+
+def _time(func: t.Callable[[], t.Any], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    codecs = [None, *serde._codecs]
+    print(f"{'payload':<24}{'codec':<8}{'bytes':>12}{'ratio':>8}{'encode ms':>12}{'decode ms':>12}")
+
+    for name, payload in _payloads().items():
+        baseline = None
+        for codec in codecs:
+            s = serde.Serde(codec=codec, compress_threshold=0)
+            raw = s.serialize(payload)
+            baseline = baseline or len(raw)
+
+            encode = _time(lambda: s.serialize(payload))
+            decode = _time(lambda: s.deserialize(raw))
+            print(
+                f"{name:<24}{codec or '-':<8}{len(raw):>12}{len(raw) / baseline:>8.2f}"
+                f"{encode * 1000:>12.2f}{decode * 1000:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
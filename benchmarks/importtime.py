@@ -0,0 +1,73 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# Checks that `import cache` stays within an import-time budget and doesn't load the heavier
+# dependencies that are only needed by the decorators or serializing backends. Exits non-zero on
+# failure so it can gate CI.
+#
+#   python -m benchmarks.importtime --budget-ms 50
+import argparse
+import os
+import re
+import subprocess
+import sys
+import typing as t
+
+BUDGET_MS = 50.0
+DEFERRED = ("asyncio", "inspect", "orjson", "pysel", "typing_extensions", "cache.cacheable", "cache.serde")
+
+_SCRIPT = f"import cache, sys; print(','.join(m for m in {DEFERRED!r} if m in sys.modules))"
+
+
+def measure(repeat: int) -> t.Tuple[float, t.List[str]]:
+    # -X importtime reports cumulative microseconds per module on stderr, keep the best of several runs
+    best, loaded = float("inf"), []
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _SCRIPT], capture_output=True, text=True, env=env, check=True
+        )
+        match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| cache$", process.stderr, re.MULTILINE)
+        assert match is not None
+        best = min(best, int(match.group(1)) / 1000)
+        loaded = [module for module in process.stdout.strip().split(",") if module]
+    return best, loaded
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="maximum cumulative import time of cache")
+    parser.add_argument("--repeat", type=int, default=5, help="number of fresh interpreters to measure")
+    args = parser.parse_args()
+
+    elapsed, loaded = measure(args.repeat)
+    print(f"import cache: {elapsed:.1f} ms (budget {args.budget_ms:.1f} ms)")
+
+    failed = False
+    if elapsed > args.budget_ms:
+        print("import time budget exceeded")
+        failed = True
+    if loaded:
+        print(f"imported eagerly but should be deferred: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
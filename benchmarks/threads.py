@@ -0,0 +1,103 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# Multi-threaded stress test and throughput benchmark for the in-memory backends. Every thread runs a
+# mix of reads, writes, evictions and the occasional flush against a shared cache and checks that it
+# only ever reads back values that were written for that entry. Exits non-zero if any thread fails.
+# Throughput can only scale with threads on free-threaded builds, and no run on one has been recorded
+# yet. With the GIL the numbers mostly show the cost of locking and, for the sharded cache, of
+# picking a shard, which usually makes it the slower of the two. tests/test_memory.py runs a shorter
+# correctness check as part of the test suite.
+#
+#   python -m benchmarks.threads --threads 1 2 4 8 --seconds 2
+import argparse
+import random
+import sys
+import threading
+import time
+import typing as t
+
+from cache import abc
+from cache.implementations import memory
+
+_IMPLEMENTATIONS: t.Dict[str, t.Callable[[], abc.Cache]] = {
+    "InMemoryCacheImpl": lambda: memory.InMemoryCacheImpl(max_entries=50_000),
+    "ShardedInMemoryCacheImpl(16)": lambda: memory.ShardedInMemoryCacheImpl(16, max_entries=50_000),
+}
+
+
+def _worker(
+    instance: abc.Cache, seed: int, stop: threading.Event, counts: t.List[int], errors: t.List[BaseException]
+) -> None:
+    rng, ops = random.Random(seed), 0
+    try:
+        while not stop.is_set():
+            for _ in range(256):
+                key, at, roll = f"k{rng.randrange(64)}", str(rng.randrange(2048)), rng.random()
+                if roll < 0.8:
+                    value = instance.get(key, at)
+                    if value is not abc._EMPTY and value != (key, at):
+                        raise AssertionError(f"read {value!r} for {(key, at)!r}")
+                elif roll < 0.95:
+                    instance.put(key, at, (key, at), rng.choice((None, 1)))
+                elif roll < 0.999:
+                    instance.evict(key, at, all=roll > 0.99)
+                else:
+                    instance.flush()
+                ops += 1
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        counts[seed] = ops
+
+
+def run(factory: t.Callable[[], abc.Cache], threads: int, seconds: float) -> t.Tuple[float, t.List[BaseException]]:
+    instance, stop = factory(), threading.Event()
+    counts, errors = [0] * threads, []
+    workers = [
+        threading.Thread(target=_worker, args=(instance, i, stop, counts, errors), daemon=True) for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    instance.close()
+    return sum(counts) / seconds, errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.threads")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'implementation':<32}{'threads':>8}{'ops/s':>14}")
+    for name, factory in _IMPLEMENTATIONS.items():
+        for threads in args.threads:
+            throughput, errors = run(factory, threads, args.seconds)
+            print(f"{name:<32}{threads:>8}{throughput:>14,.0f}{'  FAILED: ' + repr(errors[0]) if errors else ''}")
+            failed = failed or bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,23 +17,39 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import pysel
+from __future__ import annotations
+
+import importlib
+import typing as t
 
 from cache import abc
-from cache import cacheable
-from cache import decorators
 from cache import errors
-from cache import manual
-from cache import serde
 from cache._setup import *
 from cache.abc import *
-from cache.cacheable import *
-from cache.decorators import *
 from cache.errors import *
-from cache.serde import *
+
+if t.TYPE_CHECKING:
+    import pysel
+
+    from cache import cacheable
+    from cache import decorators
+    from cache import eviction
+    from cache import manual
+    from cache import metrics
+    from cache import scope
+    from cache import serde
+    from cache import sizing
+    from cache.cacheable import *
+    from cache.decorators import *
+    from cache.metrics import stats
+    from cache.scope import request_scope
+    from cache.serde import *
+
+    Ex = pysel.Expression
 
 __all__ = [
     "Cache",
+    "CacheConfigurationError",
     "CacheNotSetUpError",
     "Cacheable",
     "Ex",
@@ -45,12 +61,49 @@ __all__ = [
     "decorators",
     "errors",
     "evict",
+    "eviction",
     "manual",
+    "metrics",
+    "request_scope",
+    "scope",
     "serde",
     "setup",
+    "sizing",
+    "stats",
 ]
 
 
 __version__ = "0.0.1"
 
-Ex = pysel.Expression
+# Submodules and names that pull in heavier dependencies (pysel, orjson, asyncio, inspect) are only
+# imported on first attribute access, so that `import cache` stays cheap for callers that never use
+# the decorators or a serializing backend.
+_LAZY_MODULES = frozenset(("cacheable", "decorators", "eviction", "manual", "metrics", "scope", "serde", "sizing"))
+_LAZY_ATTRIBUTES: t.Dict[str, t.Tuple[str, str]] = {
+    "Ex": ("pysel", "Expression"),
+    "Cacheable": ("cache.cacheable", "Cacheable"),
+    "enable": ("cache.decorators", "enable"),
+    "evict": ("cache.decorators", "evict"),
+    "stats": ("cache.metrics", "stats"),
+    "request_scope": ("cache.scope", "request_scope"),
+    "Serde": ("cache.serde", "Serde"),
+    "Codec": ("cache.serde", "Codec"),
+    "register_codec": ("cache.serde", "register_codec"),
+}
+
+
+def __getattr__(name: str) -> t.Any:
+    if name in _LAZY_MODULES:
+        value = importlib.import_module(f"cache.{name}")
+    elif name in _LAZY_ATTRIBUTES:
+        module, attribute = _LAZY_ATTRIBUTES[name]
+        value = getattr(importlib.import_module(module), attribute)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> t.List[str]:
+    return sorted({*globals(), *_LAZY_MODULES, *_LAZY_ATTRIBUTES})
@@ -26,20 +26,82 @@ from cache import abc
 __all__ = ["setup"]
 
 
-def _in_memory_setup() -> abc.Cache:
+def _in_memory_setup(shards: t.Optional[int] = None, **options: t.Any) -> abc.Cache:
     from cache.implementations import memory
 
-    return abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    if shards is not None:
+        return abc.Cache.set_instance(memory.ShardedInMemoryCacheImpl(shards, **options))
+    return abc.Cache.set_instance(memory.InMemoryCacheImpl(**options))
 
 
-def _redis_setup(url: str) -> abc.Cache:
+def _redis_setup(url: str, near_cache: t.Union[bool, t.Dict[str, t.Any]] = False, **options: t.Any) -> abc.Cache:
     from cache.implementations import redis
 
-    return abc.Cache.set_instance(redis.RedisCacheImpl(url))
+    impl = redis.RedisCacheImpl(url, **options)
+    if not near_cache:
+        return abc.Cache.set_instance(impl)
 
+    from cache.implementations import tiered
 
-def setup(url: t.Optional[str] = None) -> abc.Cache:
-    if url is None:
-        return _in_memory_setup()
+    return abc.Cache.set_instance(tiered.TieredCacheImpl(impl, **(near_cache if isinstance(near_cache, dict) else {})))
+
+
+def _sharded_redis_setup(urls: t.Sequence[str], **options: t.Any) -> abc.Cache:
+    from cache.implementations import sharded_redis
+
+    return abc.Cache.set_instance(sharded_redis.ShardedRedisCacheImpl(urls, **options))
+
+
+def _shm_setup(url: str, **options: t.Any) -> abc.Cache:
+    import urllib.parse
+
+    from cache.implementations import shm
+
+    # shm://name?size=1GB&stripes=64 - query parameters are merged under any keyword options
+    parsed = urllib.parse.urlsplit(url)
+    query: t.Dict[str, t.Any] = dict(urllib.parse.parse_qsl(parsed.query))
+    for option in ("buckets", "stripes", "compress_threshold"):
+        if option in query:
+            query[option] = int(query[option])
+    return abc.Cache.set_instance(shm.SharedMemoryCacheImpl(parsed.netloc or parsed.path, **{**query, **options}))
+
+
+def _sqlite_setup(url: str, **options: t.Any) -> abc.Cache:
+    import urllib.parse
+
+    from cache.implementations import sqlite
+
+    # file:///var/cache/app - the path is the directory holding the database
+    return abc.Cache.set_instance(
+        sqlite.SQLiteCacheImpl(urllib.parse.unquote(urllib.parse.urlsplit(url).path), **options)
+    )
+
+
+def setup(
+    url: t.Union[str, t.Sequence[str], None] = None,
+    write_behind: t.Union[bool, t.Dict[str, t.Any]] = False,
+    **options: t.Any,
+) -> abc.Cache:
+    impl = _create(url, **options)
+    if not write_behind:
+        return impl
+
+    from cache.implementations import write_behind as write_behind_impl
+
+    return abc.Cache.set_instance(
+        write_behind_impl.WriteBehindCacheImpl(impl, **(write_behind if isinstance(write_behind, dict) else {}))
+    )
+
+
+def _create(url: t.Union[str, t.Sequence[str], None], **options: t.Any) -> abc.Cache:
+    if url is not None and not isinstance(url, str):
+        return _sharded_redis_setup(url, **options)
+    if url is None or url.startswith("memory"):
+        return _in_memory_setup(**options)
     if url.startswith("redis"):
-        return _redis_setup(url)
+        return _redis_setup(url, **options)
+    if url.startswith("shm"):
+        return _shm_setup(url, **options)
+    if url.startswith("file"):
+        return _sqlite_setup(url, **options)
+    raise ValueError(f"Unsupported cache url {url!r}")
@@ -20,20 +20,33 @@
 from __future__ import annotations
 
 import abc
+import contextlib
 import typing as t
 
-from typing_extensions import TypeAlias
+if t.TYPE_CHECKING:
+    from typing_extensions import TypeAlias
 
 __all__ = ["Cache", "Serializable"]
 
 _EMPTY = type("_EMPTY")
+# Functions using stale-while-revalidate store [_STALE_MARKER, value, fresh_until, compute_time]. The
+# marker tells the envelope apart from cached values that happen to be lists.
+_STALE_MARKER = "__pyc_stale_0__"
 
 SerializableT = t.TypeVar("SerializableT", bound="Serializable")
 JsonT: TypeAlias = t.Union[t.Dict[str, "JsonT"], t.List["JsonT"], str, int, float, bool, None]
 
 
+def _unwrap_stale(cached: t.Any) -> t.Any:
+    if type(cached) is list and len(cached) == 4 and cached[0] == _STALE_MARKER:
+        return cached[1]
+    return cached
+
+
 class Cache(abc.ABC):
     _instance: t.Optional[Cache] = None
+    # Set by backends that implement tag and evict_tags, so that misconfiguration is caught up front
+    supports_tags: bool = False
 
     @abc.abstractmethod
     def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
@@ -63,6 +76,68 @@ class Cache(abc.ABC):
     async def aflush(self) -> None:
         return self.flush()
 
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        return [self.get(key, at) for key, at in items]
+
+    async def aget_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        return self.get_many(items)
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        for key, at, value, ttl in items:
+            self.put(key, at, value, ttl)
+
+    async def aput_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        self.put_many(items)
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        for key, at in items:
+            self.evict(key, at)
+
+    async def aevict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        self.evict_many(items)
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        # Associates an existing entry with tags so that evict_tags can invalidate it. Backends that
+        # support tags keep a reverse index from each tag to its entries.
+        raise NotImplementedError(f"{type(self).__name__} does not support tags")
+
+    async def atag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        self.tag(key, at, tags)
+
+    def put_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        # Stores an entry and tags it. Backends that can do both in a single round trip override this.
+        self.put(key, at, value, ttl)
+        self.tag(key, at, tags)
+
+    async def aput_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        await self.aput(key, at, value, ttl)
+        await self.atag(key, at, tags)
+
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        raise NotImplementedError(f"{type(self).__name__} does not support tags")
+
+    async def aevict_tags(self, tags: t.Sequence[str]) -> None:
+        self.evict_tags(tags)
+
+    @contextlib.contextmanager
+    def lock(self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0) -> t.Iterator[bool]:
+        # Backends shared between processes override this to provide mutual exclusion across them. The
+        # lock is released after `lease` seconds even if its holder never does, and callers wait at
+        # most `timeout` seconds to acquire it, defaulting to one lease.
+        yield True
+
+    @contextlib.asynccontextmanager
+    async def alock(
+        self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0
+    ) -> t.AsyncIterator[bool]:
+        yield True
+
+    def close(self) -> None:
+        return None
+
+    async def aclose(self) -> None:
+        self.close()
+
     @classmethod
     def get_instance(cls) -> t.Optional[Cache]:
         return Cache._instance
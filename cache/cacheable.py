@@ -19,32 +19,170 @@
 # SOFTWARE.
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
 import inspect
+import logging
+import math
+import random
+import threading
+import time
 import typing as t
 
 import pysel
 
 from cache import abc
 from cache import errors
+from cache import metrics
+from cache import scope
 
 __all__ = ["Cacheable"]
 
+CoalesceT = t.Union[bool, t.Literal["distributed"]]
 
-def create_context_dict(
-    argument_order: t.Dict[str, t.Tuple[t.Any, t.Any]], args: t.Sequence[t.Any], kwargs: t.Mapping[str, t.Any]
-) -> t.Dict[str, t.Any]:
-    values = {}
+_LOGGER = logging.getLogger("cache")
+
+_refresh_pool: t.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_refresh_pool_lock = threading.Lock()
+
+
+def _get_refresh_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _refresh_pool
+
+    if _refresh_pool is None:
+        with _refresh_pool_lock:
+            if _refresh_pool is None:
+                _refresh_pool = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="pycaching-refresh")
+    return _refresh_pool
+
+
+BinderT = t.Callable[[t.Sequence[t.Any], t.Mapping[str, t.Any]], t.Dict[str, t.Any]]
+LocatorT = t.Callable[[t.Sequence[t.Any], t.Mapping[str, t.Any]], t.Tuple[str, str, t.Dict[str, t.Any]]]
+StoreOptionsT = t.Callable[[t.Dict[str, t.Any]], t.Tuple[bool, t.Optional[int]]]
+TagsT = t.Union[str, t.Sequence[str], pysel.Expression[t.Any]]
+TaggerT = t.Callable[[t.Dict[str, t.Any]], t.List[str]]
+
+# Shared by every call whose key, at and store options are all constants - never written to
+_EMPTY_CONTEXT: t.Dict[str, t.Any] = {}
+
+
+def compile_binder(argument_order: t.Dict[str, t.Tuple[t.Any, t.Any]]) -> BinderT:
+    positional: t.List[t.Tuple[str, t.Any]] = []
+    keyword_only: t.List[t.Tuple[str, t.Any]] = []
+    var_positional: t.Optional[t.Tuple[str, t.Any]] = None
+    var_keyword: t.Optional[t.Tuple[str, t.Any]] = None
 
-    mutable_args, mutable_kwargs = list(args), dict(kwargs)
     for name, (default_value, kind) in argument_order.items():
         if kind is inspect.Parameter.VAR_POSITIONAL:
-            values[name] = mutable_args or default_value
+            var_positional = name, default_value
         elif kind is inspect.Parameter.VAR_KEYWORD:
-            values[name] = mutable_kwargs.copy() or default_value
+            var_keyword = name, default_value
+        elif kind is inspect.Parameter.KEYWORD_ONLY:
+            keyword_only.append((name, default_value))
         else:
-            values[name] = mutable_args.pop(0) if args else mutable_kwargs.pop(name, default_value)
+            positional.append((name, default_value))
+
+    names = tuple(name for name, _ in positional)
+    n_positional = len(positional)
+
+    if var_positional is None and var_keyword is None and not keyword_only:
+
+        def bind_positional(args: t.Sequence[t.Any], kwargs: t.Mapping[str, t.Any]) -> t.Dict[str, t.Any]:
+            values = dict(zip(names, args))
+            if len(args) < n_positional:
+                for name, default_value in positional[len(args) :]:
+                    values[name] = kwargs.get(name, default_value)
+            return values
+
+        return bind_positional
+
+    named = frozenset(names).union(name for name, _ in keyword_only)
+
+    def bind(args: t.Sequence[t.Any], kwargs: t.Mapping[str, t.Any]) -> t.Dict[str, t.Any]:
+        values = dict(zip(names, args))
+        if len(args) < n_positional:
+            for name, default_value in positional[len(args) :]:
+                values[name] = kwargs.get(name, default_value)
+
+        if var_positional is not None:
+            values[var_positional[0]] = list(args[n_positional:]) or var_positional[1]
+        for name, default_value in keyword_only:
+            values[name] = kwargs.get(name, default_value)
+        if var_keyword is not None:
+            values[var_keyword[0]] = {k: v for k, v in kwargs.items() if k not in named} or var_keyword[1]
+
+        return values
+
+    return bind
+
+
+def create_context_dict(
+    argument_order: t.Dict[str, t.Tuple[t.Any, t.Any]], args: t.Sequence[t.Any], kwargs: t.Mapping[str, t.Any]
+) -> t.Dict[str, t.Any]:
+    return compile_binder(argument_order)(args, kwargs)
+
+
+def compile_locator(
+    binder: BinderT,
+    key_exp: t.Union[str, pysel.Expression[t.Any]],
+    at_exp: t.Union[str, pysel.Expression[t.Any]],
+    needs_context: bool,
+) -> LocatorT:
+    if isinstance(key_exp, str) and isinstance(at_exp, str):
+        if not needs_context:
+            return lambda args, kwargs: (key_exp, at_exp, _EMPTY_CONTEXT)
+
+        def locate_constant(args: t.Sequence[t.Any], kwargs: t.Mapping[str, t.Any]) -> t.Tuple[str, str, t.Any]:
+            return key_exp, at_exp, binder(args, kwargs)
+
+        return locate_constant
+
+    def locate(args: t.Sequence[t.Any], kwargs: t.Mapping[str, t.Any]) -> t.Tuple[str, str, t.Dict[str, t.Any]]:
+        ctx = binder(args, kwargs)
+        return (
+            key_exp if isinstance(key_exp, str) else str(key_exp.evaluate(ctx)),
+            at_exp if isinstance(at_exp, str) else str(at_exp.evaluate(ctx)),
+            ctx,
+        )
+
+    return locate
+
+
+def compile_store_options(
+    when_exp: t.Optional[pysel.Expression[t.Any]],
+    unless_exp: t.Optional[pysel.Expression[t.Any]],
+    ttl: t.Optional[t.Union[int, pysel.Expression[int]]],
+) -> StoreOptionsT:
+    if when_exp is None and unless_exp is None and not isinstance(ttl, pysel.Expression):
+        constant = True, ttl
+        return lambda ctx: constant
+
+    def store_options(ctx: t.Dict[str, t.Any]) -> t.Tuple[bool, t.Optional[int]]:
+        if when_exp is not None and not when_exp.evaluate(ctx):
+            return False, None
+        if unless_exp is not None and unless_exp.evaluate(ctx):
+            return False, None
+        return True, int(ttl.evaluate(ctx)) if isinstance(ttl, pysel.Expression) else ttl
+
+    return store_options
+
+
+def compile_tags(tags: t.Optional[TagsT]) -> t.Optional[TaggerT]:
+    if tags is None:
+        return None
+    if isinstance(tags, str):
+        constant = [tags]
+        return lambda ctx: constant
+    if not isinstance(tags, pysel.Expression):
+        constant = list(tags)
+        return lambda ctx: constant
+
+    # An expression may produce a single tag or any iterable of them
+    def evaluate(ctx: t.Dict[str, t.Any]) -> t.List[str]:
+        value = tags.evaluate(ctx)  # type: ignore[union-attr]
+        return [value] if isinstance(value, str) else [str(tag) for tag in value]
 
-    return values
+    return evaluate
 
 
 class Cacheable:
@@ -56,6 +194,13 @@ class Cacheable:
         when_exp: t.Optional[pysel.Expression[t.Any]] = None,
         unless_exp: t.Optional[pysel.Expression[t.Any]] = None,
         ttl: t.Optional[t.Union[int, pysel.Expression[int]]] = None,
+        *,
+        coalesce: CoalesceT = False,
+        lock_timeout: t.Optional[float] = None,
+        lock_lease: float = 30.0,
+        stale_ttl: t.Optional[int] = None,
+        refresh_ahead: t.Optional[float] = None,
+        tags: t.Optional[TagsT] = None,
     ) -> None:
         self._cache: t.Optional[abc.Cache] = None
         self._callback = callback
@@ -64,74 +209,309 @@ class Cacheable:
         self._when_exp = when_exp
         self._unless_exp = unless_exp
         self._ttl_exp = ttl
+        self._coalesce = coalesce
+        self._lock_timeout = lock_timeout
+        self._lock_lease = lock_lease
+        self._stale_ttl = stale_ttl
+        self._refresh_ahead = refresh_ahead
+        # Entries are stored in an envelope recording when they go stale so that they can still be served
+        self._stale_aware = stale_ttl is not None or refresh_ahead is not None
+
+        self._flights_lock = threading.Lock()
+        self._flights: t.Dict[t.Tuple[str, str], _Flight] = {}
+        self._aflights: t.Dict[t.Tuple[str, str], asyncio.Future[t.Any]] = {}
+        self._refreshing: t.Set[t.Tuple[str, str]] = set()
+        self._refresh_tasks: t.Set[asyncio.Task[None]] = set()
 
         self.argument_order = {}
         for name, param in inspect.signature(callback).parameters.items():
             self.argument_order[name] = param.default, param.kind
 
+        # Everything that can be worked out from the decorator arguments alone is resolved here
+        # so that each call only binds its arguments and evaluates the expressions it needs.
+        self._is_coroutine = inspect.iscoroutinefunction(callback)
+        self._locate = compile_locator(
+            compile_binder(self.argument_order),
+            key_exp,
+            at_exp,
+            any(isinstance(exp, pysel.Expression) for exp in (key_exp, at_exp, when_exp, unless_exp, ttl, tags)),
+        )
+        self._store_options = compile_store_options(when_exp, unless_exp, ttl)
+        self._tags = compile_tags(tags)
+        self._metrics_key = key_exp if isinstance(key_exp, str) else key_exp.raw
+
+        if (instance := abc.Cache.get_instance()) is not None:
+            self._check_support(instance)
+
+    def _check_support(self, cache: abc.Cache) -> None:
+        # Raised before the first lookup, rather than after every miss has already run the callback
+        if self._tags is not None and not cache.supports_tags:
+            raise errors.CacheConfigurationError(f"{type(cache).__name__} does not support tags")
+
     @property
     def cache(self) -> abc.Cache:
         if self._cache is None:
-            self._cache = abc.Cache.get_instance()
-
-        if self._cache is None:
-            raise errors.CacheNotSetUpError("Cache has not been initialised")
+            if (instance := abc.Cache.get_instance()) is None:
+                raise errors.CacheNotSetUpError("Cache has not been initialised")
+            self._check_support(instance)
+            self._cache = instance
 
         return self._cache
 
-    def _key(self, ctx: t.Dict[str, t.Any]) -> str:
-        if isinstance(self._key_exp, str):
-            return self._key_exp
-        return str(self._key_exp.evaluate(ctx))
+    def _wrap(self, result: t.Any, ttl: t.Optional[int], compute_time: float) -> t.Tuple[t.Any, t.Optional[int]]:
+        if not self._stale_aware:
+            return result, ttl
+
+        if ttl is None:
+            return [abc._STALE_MARKER, result, None, compute_time], None
+        return [abc._STALE_MARKER, result, time.time() + ttl, compute_time], ttl + (self._stale_ttl or 0)
+
+    def _unwrap(self, cached: t.Any) -> t.Tuple[t.Any, bool]:
+        if not (type(cached) is list and len(cached) == 4 and cached[0] == abc._STALE_MARKER):
+            return cached, False
 
-    def _at(self, ctx: t.Dict[str, t.Any]) -> str:
-        if isinstance(self._at_exp, str):
-            return self._at_exp
-        return str(self._at_exp.evaluate(ctx))
+        _, value, fresh_until, compute_time = cached
+        if not self._stale_aware or fresh_until is None:
+            return value, False
+        remaining = fresh_until - time.time()
+        if remaining <= 0:
+            return value, True
+        if self._refresh_ahead is not None:
+            # Probabilistic early expiration - the closer to expiry and the more expensive the
+            # callback, the more likely a caller is to trigger a refresh ahead of time.
+            return value, compute_time * self._refresh_ahead * -math.log(1.0 - random.random()) >= remaining
+        return value, False
+
+    def _put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], ctx: t.Dict[str, t.Any]) -> None:
+        # Tags are written along with the entry so that backends can do both in one round trip
+        if self._tags is not None and (tags := self._tags(ctx)):
+            self.cache.put_tagged(key, at, value, ttl, tags)
+        else:
+            self.cache.put(key, at, value, ttl)
 
-    def _when(self, ctx: t.Dict[str, t.Any]) -> bool:
-        if self._when_exp is None:
-            return True
-        return bool(self._when_exp.evaluate(ctx))
+    def _compute(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> t.Any:
+        start = time.perf_counter()
+        result = self._callback(*args, **kwargs)
 
-    def _unless(self, ctx: t.Dict[str, t.Any]) -> bool:
-        if self._unless_exp is None:
-            return False
-        return bool(self._unless_exp.evaluate(ctx))
+        store, ttl = self._store_options(ctx)
+        if store:
+            value, ttl = self._wrap(result, ttl, time.perf_counter() - start)
+            if metrics.ENABLED:
+                start = time.perf_counter()
+                self._put(key, at, value, ttl, ctx)
+                metrics.record_put(self._metrics_key, type(self.cache).__name__, time.perf_counter() - start)
+            else:
+                self._put(key, at, value, ttl, ctx)
 
-    def _ttl(self, ctx: t.Dict[str, t.Any]) -> t.Optional[int]:
-        if self._ttl_exp is None:
-            return None
-        return int(self._ttl_exp.evaluate(ctx))
+            if (memo := scope.current()) is not None:
+                memo[(key, at)] = value
+
+        return result
+
+    def _refresh(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> None:
+        try:
+            self._compute(key, at, ctx, args, kwargs)
+        except Exception:
+            _LOGGER.exception("Background refresh of %r:%r failed", key, at)
+        finally:
+            with self._flights_lock:
+                self._refreshing.discard((key, at))
+
+    def _schedule_refresh(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> None:
+        with self._flights_lock:
+            if (key, at) in self._refreshing:
+                return
+            self._refreshing.add((key, at))
+        _get_refresh_pool().submit(self._refresh, key, at, ctx, args, kwargs)
+
+    def _compute_locked(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> t.Any:
+        if self._coalesce != "distributed":
+            return self._compute(key, at, ctx, args, kwargs)
+
+        with self.cache.lock(key, at, self._lock_timeout, self._lock_lease):
+            # Another process may have filled the entry while we were waiting for the lock
+            cached = self.cache.get(key, at)
+            if cached is abc._EMPTY:
+                return self._compute(key, at, ctx, args, kwargs)
+            return self._unwrap(cached)[0]
+
+    def _compute_coalesced(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> t.Any:
+        with self._flights_lock:
+            flight = self._flights.get((key, at))
+            if leader := flight is None:
+                flight = self._flights[(key, at)] = _Flight()
+        assert flight is not None
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._compute_locked(key, at, ctx, args, kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[(key, at)]
+            flight.done.set()
 
     def __call__(self, *args: t.Any, **kwargs: t.Any) -> t.Any:
-        if inspect.iscoroutinefunction(self._callback):
+        if self._is_coroutine:
             return self.__acall__(*args, **kwargs)
 
-        ctx = create_context_dict(self.argument_order, args, kwargs)
-        key, at = self._key(ctx), self._at(ctx)
+        key, at, ctx = self._locate(args, kwargs)
+
+        memo = scope.current()
+        if memo is None or (cached := memo.get((key, at), abc._EMPTY)) is abc._EMPTY:
+            if metrics.ENABLED:
+                start = time.perf_counter()
+                cached = self.cache.get(key, at)
+                metrics.record_get(
+                    self._metrics_key, type(self.cache).__name__, cached is not abc._EMPTY, time.perf_counter() - start
+                )
+            else:
+                cached = self.cache.get(key, at)
+
+            if memo is not None and cached is not abc._EMPTY:
+                memo[(key, at)] = cached
 
-        cached = self.cache.get(key, at)
         if cached is abc._EMPTY:
-            result = self._callback(*args, **kwargs)
+            if self._coalesce:
+                return self._compute_coalesced(key, at, ctx, args, kwargs)
+            return self._compute(key, at, ctx, args, kwargs)
+
+        if self._stale_aware:
+            value, refresh = self._unwrap(cached)
+            if refresh:
+                self._schedule_refresh(key, at, ctx, args, kwargs)
+            return value
+        # Entries written while stale_ttl was set are still in the envelope
+        return abc._unwrap_stale(cached)
+
+    async def _aput(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], ctx: t.Dict[str, t.Any]) -> None:
+        if self._tags is not None and (tags := self._tags(ctx)):
+            await self.cache.aput_tagged(key, at, value, ttl, tags)
+        else:
+            await self.cache.aput(key, at, value, ttl)
+
+    async def _acompute(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> t.Any:
+        start = time.perf_counter()
+        result = await self._callback(*args, **kwargs)
+
+        store, ttl = self._store_options(ctx)
+        if store:
+            value, ttl = self._wrap(result, ttl, time.perf_counter() - start)
+            if metrics.ENABLED:
+                start = time.perf_counter()
+                await self._aput(key, at, value, ttl, ctx)
+                metrics.record_put(self._metrics_key, type(self.cache).__name__, time.perf_counter() - start)
+            else:
+                await self._aput(key, at, value, ttl, ctx)
+
+            if (memo := scope.current()) is not None:
+                memo[(key, at)] = value
+
+        return result
+
+    async def _arefresh(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> None:
+        try:
+            await self._acompute(key, at, ctx, args, kwargs)
+        except Exception:
+            _LOGGER.exception("Background refresh of %r:%r failed", key, at)
+        finally:
+            with self._flights_lock:
+                self._refreshing.discard((key, at))
+
+    def _aschedule_refresh(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> None:
+        with self._flights_lock:
+            if (key, at) in self._refreshing:
+                return
+            self._refreshing.add((key, at))
 
-            if self._when(ctx) and not self._unless(ctx):
-                self._cache.put(key, at, result, self._ttl(ctx))
+        # Keep a reference to the task so that it isn't garbage collected before it completes
+        task = asyncio.get_running_loop().create_task(self._arefresh(key, at, ctx, args, kwargs))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
 
+    async def _acompute_locked(self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any) -> t.Any:
+        if self._coalesce != "distributed":
+            return await self._acompute(key, at, ctx, args, kwargs)
+
+        async with self.cache.alock(key, at, self._lock_timeout, self._lock_lease):
+            cached = await self.cache.aget(key, at)
+            if cached is abc._EMPTY:
+                return await self._acompute(key, at, ctx, args, kwargs)
+            return self._unwrap(cached)[0]
+
+    async def _acompute_coalesced(
+        self, key: str, at: str, ctx: t.Dict[str, t.Any], args: t.Any, kwargs: t.Any
+    ) -> t.Any:
+        loop = asyncio.get_running_loop()
+
+        while (fut := self._aflights.get((key, at))) is not None and fut.get_loop() is loop:
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # The leader was cancelled rather than us - take over the computation
+                if not fut.cancelled():
+                    raise
+
+        fut = self._aflights[(key, at)] = loop.create_future()
+        try:
+            result = await self._acompute_locked(key, at, ctx, args, kwargs)
+            fut.set_result(result)
             return result
-        return cached
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            # Mark the exception as retrieved in case there were no followers waiting on it
+            fut.exception()
+            raise
+        finally:
+            if self._aflights.get((key, at)) is fut:
+                del self._aflights[(key, at)]
 
     async def __acall__(self, *args: t.Any, **kwargs: t.Any) -> t.Any:
         # Process caching async
-        ctx = create_context_dict(self.argument_order, args, kwargs)
-        key, at = self._key(ctx), self._at(ctx)
+        key, at, ctx = self._locate(args, kwargs)
+
+        memo = scope.current()
+        if memo is None or (cached := memo.get((key, at), abc._EMPTY)) is abc._EMPTY:
+            if metrics.ENABLED:
+                start = time.perf_counter()
+                cached = await self.cache.aget(key, at)
+                metrics.record_get(
+                    self._metrics_key, type(self.cache).__name__, cached is not abc._EMPTY, time.perf_counter() - start
+                )
+            else:
+                cached = await self.cache.aget(key, at)
+
+            if memo is not None and cached is not abc._EMPTY:
+                memo[(key, at)] = cached
 
-        cached = await self.cache.aget(key, at)
         if cached is abc._EMPTY:
-            result = await self._callback(*args, **kwargs)
+            if self._coalesce:
+                return await self._acompute_coalesced(key, at, ctx, args, kwargs)
+            return await self._acompute(key, at, ctx, args, kwargs)
 
-            if self._when(ctx) and not self._unless(ctx):
-                await self._cache.aput(key, at, result, self._ttl(ctx))
+        if self._stale_aware:
+            value, refresh = self._unwrap(cached)
+            if refresh:
+                self._aschedule_refresh(key, at, ctx, args, kwargs)
+            return value
+        return abc._unwrap_stale(cached)
 
-            return result
-        return cached
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: t.Any = None
+        self.error: t.Optional[BaseException] = None
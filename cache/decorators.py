@@ -27,6 +27,8 @@ from typing_extensions import TypeAlias
 
 from cache import abc
 from cache import cacheable
+from cache import metrics
+from cache import scope
 
 __all__ = ["enable", "evict"]
 
@@ -42,52 +44,111 @@ def enable(
     when: t.Optional[pysel.Expression[t.Any]] = None,
     unless: t.Optional[pysel.Expression[t.Any]] = None,
     ttl: t.Optional[t.Union[int, pysel.Expression[int]]] = None,
+    coalesce: cacheable.CoalesceT = False,
+    lock_timeout: t.Optional[float] = None,
+    lock_lease: float = 30.0,
+    stale_ttl: t.Optional[int] = None,
+    refresh_ahead: t.Optional[float] = None,
+    tags: t.Optional[cacheable.TagsT] = None,
 ) -> t.Callable[[CallbackT], CallbackT]:
     def decorate(func: CallbackT) -> CallbackT:
-        return cacheable.Cacheable(func, key, at, when, unless, ttl)
+        return cacheable.Cacheable(
+            func,
+            key,
+            at,
+            when,
+            unless,
+            ttl,
+            coalesce=coalesce,
+            lock_timeout=lock_timeout,
+            lock_lease=lock_lease,
+            stale_ttl=stale_ttl,
+            refresh_ahead=refresh_ahead,
+            tags=tags,
+        )
 
     return decorate
 
 
 @t.overload
 def evict(
-    key: t.Union[str, pysel.Expression[t.Any]], at: t.Union[str, pysel.Expression[t.Any]]
+    key: t.Union[str, pysel.Expression[t.Any]],
+    at: t.Union[str, pysel.Expression[t.Any]],
+    *,
+    tags: t.Optional[cacheable.TagsT] = None,
 ) -> t.Callable[[CallbackT], CallbackT]:
     ...
 
 
 @t.overload
-def evict(key: t.Union[str, pysel.Expression[t.Any]], *, all: t.Literal[True]) -> t.Callable[[CallbackT], CallbackT]:
+def evict(
+    key: t.Union[str, pysel.Expression[t.Any]],
+    *,
+    all: t.Literal[True],
+    tags: t.Optional[cacheable.TagsT] = None,
+) -> t.Callable[[CallbackT], CallbackT]:
+    ...
+
+
+@t.overload
+def evict(*, tags: cacheable.TagsT) -> t.Callable[[CallbackT], CallbackT]:
     ...
 
 
 def evict(
-    key: t.Union[str, pysel.Expression[t.Any]], at: t.Union[str, pysel.Expression[t.Any], None], *, all: bool = False
+    key: t.Union[str, pysel.Expression[t.Any], None] = None,
+    at: t.Union[str, pysel.Expression[t.Any], None] = None,
+    *,
+    all: bool = False,
+    tags: t.Optional[cacheable.TagsT] = None,
 ) -> t.Callable[[CallbackT], CallbackT]:
+    if key is None and tags is None:
+        raise TypeError("evict requires a key, tags or both")
+    get_tags = cacheable.compile_tags(tags)
+
     def decorate(func: CallbackT) -> CallbackT:
 
         argument_order = {}
         for name, param in inspect.signature(func).parameters.items():
             argument_order[name] = param.default, param.kind
+        bind = cacheable.compile_binder(argument_order)
 
         @functools.wraps(func)
         def _wrapper(
             *args: P.args, __async: bool = False, __arg_info: t.Dict[str, t.Tuple[t.Any, t.Any]], **kwargs: P.kwargs
         ) -> T:
-            method = getattr(abc.Cache.get_instance(), f"{'a' if __async else ''}evict")
+            instance = abc.Cache.get_instance()
+            prefix = "a" if __async else ""
+            method = getattr(instance, f"{prefix}evict")
+            tags_method = getattr(instance, f"{prefix}evict_tags")
 
-            ctx = cacheable.create_context_dict(argument_order, args, kwargs)
-            key_ = key if isinstance(key, str) else str(key.evaluate(ctx))
+            ctx = bind(args, kwargs)
+            key_ = key if key is None or isinstance(key, str) else str(key.evaluate(ctx))
             at_ = at if at is None or isinstance(at, str) else str(at.evaluate(ctx))
+            tags_ = get_tags(ctx) if get_tags is not None else None
+
+            if metrics.ENABLED and key is not None:
+                metrics.record_evict(key if isinstance(key, str) else key.raw, type(instance).__name__)
+
+            if tags_:
+                scope.clear()
+            if key_ is not None:
+                scope.forget(key_, at_, all)
 
             async def __wrapper() -> t.Any:
-                await method(key_, at, all)
+                if tags_:
+                    await tags_method(tags_)
+                if key_ is not None:
+                    await method(key_, at_, all)
                 return await func(*args, **kwargs)
 
             if __async:
                 return __wrapper()
 
-            method(key_, at_, all)
+            if tags_:
+                tags_method(tags_)
+            if key_ is not None:
+                method(key_, at_, all)
             return func(*args, **kwargs)
 
         return functools.partial(_wrapper, __async=inspect.iscoroutinefunction(func), __arg_info=argument_order)
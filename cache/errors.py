@@ -17,8 +17,12 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-__all__ = ["CacheNotSetUpError"]
+__all__ = ["CacheNotSetUpError", "CacheConfigurationError"]
 
 
 class CacheNotSetUpError(Exception):
     pass
+
+
+class CacheConfigurationError(Exception):
+    pass
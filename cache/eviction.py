@@ -0,0 +1,316 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import abc
+import collections
+import typing as t
+
+__all__ = ["EvictionPolicy", "LRUPolicy", "LFUPolicy", "TinyLFUPolicy", "POLICIES", "create_policy"]
+
+ItemT = t.Hashable
+PolicyFactoryT = t.Callable[[int], "EvictionPolicy"]
+
+
+class EvictionPolicy(abc.ABC):
+    __slots__ = ("max_entries",)
+
+    def __init__(self, max_entries: int) -> None:
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+
+    @abc.abstractmethod
+    def access(self, item: ItemT) -> None:
+        ...
+
+    @abc.abstractmethod
+    def add(self, item: ItemT) -> t.List[ItemT]:
+        ...
+
+    @abc.abstractmethod
+    def remove(self, item: ItemT) -> None:
+        ...
+
+    @abc.abstractmethod
+    def pop_victim(self) -> t.Optional[ItemT]:
+        # Removes and returns the item that would be evicted next, used when something other than the
+        # entry count (such as a byte limit) forces an eviction
+        ...
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        ...
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class LRUPolicy(EvictionPolicy):
+    __slots__ = ("_order",)
+
+    def __init__(self, max_entries: int) -> None:
+        super().__init__(max_entries)
+        self._order: t.OrderedDict[ItemT, None] = collections.OrderedDict()
+
+    def access(self, item: ItemT) -> None:
+        if item in self._order:
+            self._order.move_to_end(item)
+
+    def add(self, item: ItemT) -> t.List[ItemT]:
+        self._order[item] = None
+        self._order.move_to_end(item)
+
+        evicted = []
+        while len(self._order) > self.max_entries:
+            evicted.append(self._order.popitem(last=False)[0])
+        return evicted
+
+    def remove(self, item: ItemT) -> None:
+        self._order.pop(item, None)
+
+    def pop_victim(self) -> t.Optional[ItemT]:
+        return self._order.popitem(last=False)[0] if self._order else None
+
+    def clear(self) -> None:
+        self._order.clear()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+
+class LFUPolicy(EvictionPolicy):
+    __slots__ = ("_freqs", "_buckets", "_min_freq")
+
+    def __init__(self, max_entries: int) -> None:
+        super().__init__(max_entries)
+        self._freqs: t.Dict[ItemT, int] = {}
+        # Each bucket is kept in LRU order so that ties are broken by recency
+        self._buckets: t.Dict[int, t.OrderedDict[ItemT, None]] = {}
+        self._min_freq = 0
+
+    def _unlink(self, item: ItemT, freq: int) -> None:
+        bucket = self._buckets[freq]
+        del bucket[item]
+        if not bucket:
+            del self._buckets[freq]
+
+    def access(self, item: ItemT) -> None:
+        if (freq := self._freqs.get(item)) is None:
+            return
+
+        self._unlink(item, freq)
+        if self._min_freq == freq and freq not in self._buckets:
+            self._min_freq = freq + 1
+
+        self._freqs[item] = freq + 1
+        self._buckets.setdefault(freq + 1, collections.OrderedDict())[item] = None
+
+    def add(self, item: ItemT) -> t.List[ItemT]:
+        if item in self._freqs:
+            self.access(item)
+            return []
+
+        evicted = []
+        if len(self._freqs) >= self.max_entries:
+            evicted.append(self.pop_victim())
+
+        self._freqs[item] = 1
+        self._buckets.setdefault(1, collections.OrderedDict())[item] = None
+        self._min_freq = 1
+        return evicted
+
+    def remove(self, item: ItemT) -> None:
+        if (freq := self._freqs.pop(item, None)) is not None:
+            self._unlink(item, freq)
+
+    def pop_victim(self) -> t.Optional[ItemT]:
+        if not self._freqs:
+            return None
+        if self._min_freq not in self._buckets:
+            # Only reachable after an explicit remove() emptied the lowest bucket
+            self._min_freq = min(self._buckets)
+
+        victim, _ = self._buckets[self._min_freq].popitem(last=False)
+        if not self._buckets[self._min_freq]:
+            del self._buckets[self._min_freq]
+        del self._freqs[victim]
+        return victim
+
+    def clear(self) -> None:
+        self._freqs.clear()
+        self._buckets.clear()
+        self._min_freq = 0
+
+    def __len__(self) -> int:
+        return len(self._freqs)
+
+
+class _FrequencySketch:
+    # Count-min sketch with 4-bit saturating counters and periodic halving ("aging"),
+    # as used by the TinyLFU admission filter. Each counter takes a byte of a bytearray row, so the
+    # widest sketch costs 4MB, and halving is a single translate() per row.
+    __slots__ = ("_table", "_mask", "_additions", "_sample_size")
+
+    _SEEDS = (0x97CB3127, 0xB6B9C2FD, 0xCB2F8F83, 0xE8B5A5B3)
+    _MAX_WIDTH = 1 << 20
+    _HALVE = bytes(count >> 1 for count in range(256))
+
+    def __init__(self, max_entries: int) -> None:
+        width = 16
+        while width < max_entries and width < self._MAX_WIDTH:
+            width <<= 1
+
+        self._table = [bytearray(width) for _ in self._SEEDS]
+        self._mask = width - 1
+        self._additions = 0
+        self._sample_size = 10 * width
+
+    def _indexes(self, item: ItemT) -> t.Iterator[int]:
+        h = hash(item)
+        for seed in self._SEEDS:
+            h2 = (h ^ seed) * 0x9E3779B1
+            yield (h2 ^ (h2 >> 16)) & self._mask
+
+    def increment(self, item: ItemT) -> None:
+        for row, index in zip(self._table, self._indexes(item)):
+            if row[index] < 15:
+                row[index] += 1
+
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def frequency(self, item: ItemT) -> int:
+        return min(row[index] for row, index in zip(self._table, self._indexes(item)))
+
+    def _reset(self) -> None:
+        for row in self._table:
+            row[:] = row.translate(self._HALVE)
+        self._additions //= 2
+
+    def clear(self) -> None:
+        for row in self._table:
+            row[:] = bytes(len(row))
+        self._additions = 0
+
+
+class TinyLFUPolicy(EvictionPolicy):
+    # W-TinyLFU: a small LRU admission window in front of a segmented LRU main region. Items leaving
+    # the window only displace an item from the main region if the sketch estimates they are used
+    # more often, which stops one-off scans from flushing the hot working set.
+    __slots__ = (
+        "_sketch",
+        "_window",
+        "_probation",
+        "_protected",
+        "_window_max",
+        "_main_max",
+        "_protected_max",
+    )
+
+    def __init__(self, max_entries: int, window_ratio: float = 0.01, protected_ratio: float = 0.8) -> None:
+        super().__init__(max_entries)
+        self._window_max = max(1, int(max_entries * window_ratio))
+        self._main_max = max_entries - self._window_max
+        self._protected_max = int(self._main_max * protected_ratio)
+
+        self._sketch = _FrequencySketch(max_entries)
+        self._window: t.OrderedDict[ItemT, None] = collections.OrderedDict()
+        self._probation: t.OrderedDict[ItemT, None] = collections.OrderedDict()
+        self._protected: t.OrderedDict[ItemT, None] = collections.OrderedDict()
+
+    def access(self, item: ItemT) -> None:
+        self._sketch.increment(item)
+
+        if item in self._window:
+            self._window.move_to_end(item)
+        elif item in self._protected:
+            self._protected.move_to_end(item)
+        elif item in self._probation:
+            del self._probation[item]
+            self._protected[item] = None
+            if len(self._protected) > self._protected_max:
+                demoted, _ = self._protected.popitem(last=False)
+                self._probation[demoted] = None
+
+    def add(self, item: ItemT) -> t.List[ItemT]:
+        if item in self._window or item in self._probation or item in self._protected:
+            self.access(item)
+            return []
+
+        self._sketch.increment(item)
+        self._window[item] = None
+        if len(self._window) <= self._window_max:
+            return []
+
+        candidate, _ = self._window.popitem(last=False)
+        if len(self._probation) + len(self._protected) < self._main_max:
+            self._probation[candidate] = None
+            return []
+
+        if not self._probation:
+            return [candidate]
+
+        victim = next(iter(self._probation))
+        if self._sketch.frequency(candidate) > self._sketch.frequency(victim):
+            del self._probation[victim]
+            self._probation[candidate] = None
+            return [victim]
+        return [candidate]
+
+    def remove(self, item: ItemT) -> None:
+        for segment in (self._window, self._probation, self._protected):
+            if item in segment:
+                del segment[item]
+                return
+
+    def pop_victim(self) -> t.Optional[ItemT]:
+        # Probation holds the main region's least valuable items, the window and protected segment
+        # are only drained once it is empty
+        for segment in (self._probation, self._window, self._protected):
+            if segment:
+                return segment.popitem(last=False)[0]
+        return None
+
+    def clear(self) -> None:
+        self._window.clear()
+        self._probation.clear()
+        self._protected.clear()
+        self._sketch.clear()
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+
+POLICIES: t.Dict[str, PolicyFactoryT] = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "tinylfu": TinyLFUPolicy,
+}
+
+
+def create_policy(policy: t.Union[str, PolicyFactoryT], max_entries: int) -> EvictionPolicy:
+    if isinstance(policy, str):
+        if (factory := POLICIES.get(policy.lower())) is None:
+            raise ValueError(f"Unknown eviction policy {policy!r}. Expected one of {', '.join(POLICIES)}")
+        return factory(max_entries)
+    return policy(max_entries)
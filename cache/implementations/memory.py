@@ -17,21 +17,43 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import collections
+from __future__ import annotations
+
+import contextlib
+import heapq
+import itertools
+import os
+import pickle
+import struct
+import sys
+import threading
 import time
 import typing as t
+import weakref
 
 from cache import abc
+from cache import eviction
+from cache import sizing
+
+__all__ = ["InMemoryCacheImpl", "ShardedInMemoryCacheImpl"]
 
-__all__ = ["InMemoryCacheImpl"]
+# (expires, tiebreaker, object) - the object is compared by identity when popped so that entries
+# which were overwritten or evicted since being pushed are skipped.
+_ExpiryEntryT = t.Tuple[float, int, "CachedObject"]
+# (key, at, value, monotonic expiry or None, tags or None), copied from an entry under the cache's lock
+_SnapshotEntryT = t.Tuple[str, str, t.Any, t.Optional[float], t.Optional[t.Tuple[str, ...]]]
 
 
 class CachedObject:
-    __slots__ = ("value", "expires")
+    __slots__ = ("key", "at", "value", "expires", "size", "tags")
 
-    def __init__(self, value: t.Any, ttl: t.Optional[int]) -> None:
+    def __init__(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], size: int = 0) -> None:
+        self.key = key
+        self.at = at
         self.value = value
         self.expires = (time.monotonic() + ttl) if ttl is not None else None
+        self.size = size
+        self.tags: t.Optional[t.Set[str]] = None
 
     @property
     def expired(self) -> bool:
@@ -40,33 +62,530 @@ class CachedObject:
         return time.monotonic() >= self.expires
 
 
+# Charged to every entry on top of the sizer's estimate of the value, so that max_bytes also bounds
+# the number of entries holding tiny values
+_ENTRY_OVERHEAD = sys.getsizeof(CachedObject("", "", None, None)) + 2 * sys.getsizeof(("", ""))
+
+# Snapshots are the header (magic, format version, wall clock time written) followed by one pickle
+# frame per entry holding (key, at, value, wall clock deadline or None, tags or None), and a final
+# None frame so that a truncated file can be told apart from a complete one. Snapshots are pickles
+# and must only be loaded from trusted paths.
+_SNAPSHOT_MAGIC = b"PYCSNAP\x00"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<8sBd")
+_SNAPSHOT_BATCH = 1024
+
+
+def _write_snapshot(path: str, entries: t.Iterable[_SnapshotEntryT]) -> int:
+    # Entries are pickled one at a time straight to the file, so at most one entry is held in memory
+    # twice. It is written next to the destination and renamed over it once complete.
+    written, tmp = 0, f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb", buffering=1 << 20) as file:
+            wall, now = time.time(), time.monotonic()
+            file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, wall))
+            for key, at, value, expires, tags in entries:
+                if expires is not None and expires <= now:
+                    continue
+                deadline = wall + (expires - now) if expires is not None else None
+                try:
+                    frame = pickle.dumps((key, at, value, deadline, tags), pickle.HIGHEST_PROTOCOL)
+                except (pickle.PicklingError, TypeError, AttributeError):
+                    # Values such as locks or lambdas can't be restored anyway, leave them out
+                    continue
+                file.write(frame)
+                written += 1
+            file.write(pickle.dumps(None))
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    return written
+
+
+def _load_snapshot(cache: abc.Cache, path: str, timeout: t.Optional[float]) -> int:
+    # Stops early once timeout seconds have passed so that a large snapshot can't hold up startup.
+    # Entries are added in batches through put_many, so the cache's own limits still apply.
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    loaded = 0
+    with open(path, "rb", buffering=1 << 20) as file:
+        header = file.read(_SNAPSHOT_HEADER.size)
+        if len(header) < _SNAPSHOT_HEADER.size or header[:8] != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{path!r} is not a cache snapshot")
+        if (version := header[8]) != _SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot version mismatch. Expected {_SNAPSHOT_VERSION!r}, actual {version!r}")
+
+        unpickler = pickle.Unpickler(file)
+        batch: t.List[t.Tuple[str, str, t.Any, t.Optional[int]]] = []
+        tagged: t.List[t.Tuple[str, str, t.Sequence[str]]] = []
+        done = False
+        while not done:
+            try:
+                record = unpickler.load()
+            except (EOFError, pickle.UnpicklingError):
+                # Truncated, keep whatever was read intact
+                record = None
+            done = record is None or (deadline is not None and time.monotonic() >= deadline)
+
+            if record is not None:
+                key, at, value, expires, tags = record
+                # Rounded down so that a restored entry never outlives its original deadline
+                ttl = int(expires - time.time()) if expires is not None else None
+                if ttl is None or ttl > 0:
+                    batch.append((key, at, value, ttl))
+                    if tags:
+                        tagged.append((key, at, tags))
+
+            if batch and (done or len(batch) >= _SNAPSHOT_BATCH):
+                cache.put_many(batch)
+                for key, at, tags in tagged:
+                    cache.tag(key, at, tags)
+                loaded += len(batch)
+                batch.clear()
+                tagged.clear()
+    return loaded
+
+
+def _sweep(
+    ref: weakref.ReferenceType[t.Union[InMemoryCacheImpl, ShardedInMemoryCacheImpl]],
+    interval: float,
+    stop: threading.Event,
+) -> None:
+    while not stop.wait(interval):
+        if (cache := ref()) is None:
+            return
+        cache.reclaim()
+        del cache
+
+
+def _start_sweeper(
+    cache: t.Union[InMemoryCacheImpl, ShardedInMemoryCacheImpl], interval: float, stop: threading.Event
+) -> threading.Thread:
+    sweeper = threading.Thread(
+        target=_sweep, args=(weakref.ref(cache), interval, stop), name="pycaching-sweeper", daemon=True
+    )
+    sweeper.start()
+    return sweeper
+
+
+def _stop_sweeper(sweeper: t.Optional[threading.Thread], stop: threading.Event) -> None:
+    stop.set()
+    if sweeper is not None and sweeper is not threading.current_thread():
+        sweeper.join()
+
+
 class InMemoryCacheImpl(abc.Cache):
-    def __init__(self):
-        self._store: t.Dict[str, t.Dict[str, CachedObject]] = collections.defaultdict(collections.defaultdict)
+    # Without a byte limit entries are never sized. With max_bytes, the eviction policy picks victims
+    # until the total fits again. Quotas cap the bytes held under individual keys, evicting that key's
+    # least recently used entries first.
+    supports_tags = True
+    _RECLAIM_BATCH = 16
+
+    def __init__(
+        self,
+        max_entries: t.Optional[int] = None,
+        eviction_policy: t.Union[str, eviction.PolicyFactoryT] = "lru",
+        sweep_interval: t.Optional[float] = None,
+        max_bytes: t.Optional[int] = None,
+        quotas: t.Optional[t.Mapping[str, int]] = None,
+        sizer: t.Union[str, sizing.SizerT] = "deep",
+    ) -> None:
+        self._store: t.Dict[str, t.Dict[str, CachedObject]] = {}
+        if max_entries is None and max_bytes is not None:
+            # Every entry costs at least the fixed overhead, so this never limits below max_bytes
+            max_entries = max(1, max_bytes // _ENTRY_OVERHEAD)
+        self._policy: t.Optional[eviction.EvictionPolicy] = (
+            eviction.create_policy(eviction_policy, max_entries) if max_entries is not None else None
+        )
+        self._lock = threading.RLock()
+        self._expiry: t.List[_ExpiryEntryT] = []
+        self._expiry_counter = itertools.count()
+        self._stale_expiry_entries = 0
+
+        self._max_bytes = max_bytes
+        self._quotas: t.Dict[str, int] = dict(quotas or {})
+        self._sizer = sizing.create_sizer(sizer) if max_bytes is not None or self._quotas else None
+        self._bytes = 0
+        self._key_bytes: t.Dict[str, int] = {}
+        # tag -> entries carrying it, each entry also records its own tags so removal stays O(tags)
+        self._tags: t.Dict[str, t.Set[t.Tuple[str, str]]] = {}
+
+        self._sweeper_stop = threading.Event()
+        self._sweeper: t.Optional[threading.Thread] = None
+        if sweep_interval is not None:
+            self._sweeper = _start_sweeper(self, sweep_interval, self._sweeper_stop)
+
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+
+    def key_bytes_used(self, key: str) -> int:
+        return self._key_bytes.get(key, 0)
+
+    def set_quota(self, key: str, max_bytes: t.Optional[int]) -> None:
+        with self._lock:
+            if max_bytes is None:
+                self._quotas.pop(key, None)
+                return
+
+            if self._sizer is None:
+                raise ValueError("Quotas can't be added to a cache created without max_bytes or quotas")
+            self._quotas[key] = max_bytes
+            self._enforce_quota(key, max_bytes)
+
+    def _unlink(self, obj: CachedObject) -> None:
+        inner = self._store[obj.key]
+        del inner[obj.at]
+        if not inner:
+            del self._store[obj.key]
+        self._discard(obj)
+
+    def _discard(self, obj: CachedObject) -> None:
+        if obj.tags:
+            for tag in obj.tags:
+                entries = self._tags[tag]
+                entries.discard((obj.key, obj.at))
+                if not entries:
+                    del self._tags[tag]
+        if obj.expires is not None:
+            self._stale_expiry_entries += 1
+        if obj.size:
+            self._bytes -= obj.size
+            if (remaining := self._key_bytes[obj.key] - obj.size) > 0:
+                self._key_bytes[obj.key] = remaining
+            else:
+                del self._key_bytes[obj.key]
+
+    def _remove(self, key: str, at: str) -> None:
+        if (inner := self._store.get(key)) is None or (obj := inner.get(at)) is None:
+            return
+        self._unlink(obj)
+        if self._policy is not None:
+            self._policy.remove((key, at))
+
+    def _enforce_quota(self, key: str, quota: int) -> None:
+        inner = self._store.get(key)
+        while inner and self._key_bytes.get(key, 0) > quota:
+            self._remove(key, next(iter(inner)))
+
+    def _enforce_max_bytes(self, max_bytes: int) -> None:
+        assert self._policy is not None
+        while self._bytes > max_bytes and (victim := self._policy.pop_victim()) is not None:
+            if (inner := self._store.get(victim[0])) is not None and (obj := inner.get(victim[1])) is not None:
+                self._unlink(obj)
+
+    # Used by ShardedInMemoryCacheImpl, whose limits are shared by every shard
+    def _shed_bytes(self, excess: int) -> int:
+        with self._lock:
+            before = self._bytes
+            self._enforce_max_bytes(max(0, before - excess))
+            return before - self._bytes
+
+    def _shed_key_bytes(self, key: str, excess: int) -> int:
+        with self._lock:
+            before = self._key_bytes.get(key, 0)
+            self._enforce_quota(key, max(0, before - excess))
+            return before - self._key_bytes.get(key, 0)
+
+    def _reclaim(self, now: float, limit: t.Optional[int]) -> int:
+        reclaimed, heap = 0, self._expiry
+        while heap and heap[0][0] <= now and (limit is None or reclaimed < limit):
+            obj = heapq.heappop(heap)[2]
+            if (inner := self._store.get(obj.key)) is not None and inner.get(obj.at) is obj:
+                self._remove(obj.key, obj.at)
+            self._stale_expiry_entries -= 1
+            reclaimed += 1
+
+        # Entries that were overwritten or evicted early linger in the heap until their deadline;
+        # rebuild once they make up half of it so the heap stays proportional to the live store.
+        if self._stale_expiry_entries > 64 and self._stale_expiry_entries * 2 > len(heap):
+            self._expiry = [
+                e for e in heap if (inner := self._store.get(e[2].key)) is not None and inner.get(e[2].at) is e[2]
+            ]
+            heapq.heapify(self._expiry)
+            self._stale_expiry_entries = 0
+        return reclaimed
+
+    def reclaim(self) -> int:
+        now, total = time.monotonic(), 0
+        while True:
+            # Release the lock between batches so that a large backlog doesn't stall other callers
+            with self._lock:
+                reclaimed = self._reclaim(now, 1024)
+            total += reclaimed
+            if reclaimed < 1024:
+                return total
+
+    def _entries(self) -> t.List[_SnapshotEntryT]:
+        # tag() mutates an entry's tag set in place, so the tags are copied while the lock is held
+        with self._lock:
+            return [
+                (obj.key, obj.at, obj.value, obj.expires, tuple(obj.tags) if obj.tags else None)
+                for inner in self._store.values()
+                for obj in inner.values()
+            ]
+
+    def dump(self, path: str) -> int:
+        return _write_snapshot(path, self._entries())
+
+    def load(self, path: str, timeout: t.Optional[float] = None) -> int:
+        return _load_snapshot(self, path, timeout)
+
+    def close(self) -> None:
+        _stop_sweeper(self._sweeper, self._sweeper_stop)
+        self._sweeper = None
 
     def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
-        self._store[key][at] = CachedObject(value, ttl)
+        size = self._sizer(value) + _ENTRY_OVERHEAD if self._sizer is not None else 0
+        obj = CachedObject(key, at, value, ttl, size)
+
+        with self._lock:
+            self._reclaim(time.monotonic(), self._RECLAIM_BATCH)
+
+            quota = self._quotas.get(key)
+            if size and (
+                (self._max_bytes is not None and size > self._max_bytes) or (quota is not None and size > quota)
+            ):
+                # Can never fit, but an older value must not keep being served
+                return self._remove(key, at)
+
+            if (inner := self._store.get(key)) is None:
+                inner = self._store[key] = {}
+            elif (old := inner.get(at)) is not None:
+                self._discard(old)
+                if key in self._quotas:
+                    del inner[at]
+            inner[at] = obj
+
+            if obj.expires is not None:
+                heapq.heappush(self._expiry, (obj.expires, next(self._expiry_counter), obj))
+
+            if size:
+                self._bytes += size
+                self._key_bytes[key] = self._key_bytes.get(key, 0) + size
+
+            if self._policy is not None:
+                for victim_key, victim_at in self._policy.add((key, at)):
+                    self._remove(victim_key, victim_at)
+
+            if quota is not None:
+                self._enforce_quota(key, quota)
+            if self._max_bytes is not None:
+                self._enforce_max_bytes(self._max_bytes)
 
     def get(self, key: str, at: str) -> t.Any:
-        if key not in self._store:
-            return abc._EMPTY
+        with self._lock:
+            if self._expiry:
+                self._reclaim(time.monotonic(), self._RECLAIM_BATCH)
+
+            if (inner := self._store.get(key)) is None or (obj := inner.get(at)) is None:
+                return abc._EMPTY
 
-        obj = self._store[key].get(at, abc._EMPTY)
-        if obj is not abc._EMPTY:
             if obj.expired:
-                self.evict(key, at)
+                self._remove(key, at)
                 return abc._EMPTY
+            if self._policy is not None:
+                self._policy.access((key, at))
+            if key in self._quotas:
+                # Keeps each quota-limited key in LRU order for _enforce_quota
+                inner[at] = inner.pop(at)
             return obj.value
-        return abc._EMPTY
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        with self._lock:
+            return [self.get(key, at) for key, at in items]
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        with self._lock:
+            for key, at, value, ttl in items:
+                self.put(key, at, value, ttl)
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        with self._lock:
+            for key, at in items:
+                self._remove(key, at)
 
     def evict(self, key: str, at: str, all: bool = False) -> t.Any:
-        if key not in self._store:
-            return
+        with self._lock:
+            if key not in self._store:
+                return
+
+            if not all:
+                self._remove(key, at)
+                return
+
+            for at_ in list(self._store[key]):
+                self._remove(key, at_)
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        with self._lock:
+            if (inner := self._store.get(key)) is None or (obj := inner.get(at)) is None:
+                return
+
+            if obj.tags is None:
+                obj.tags = set()
+            for tag in tags:
+                obj.tags.add(tag)
+                self._tags.setdefault(tag, set()).add((key, at))
+
+    def put_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        with self._lock:
+            self.put(key, at, value, ttl)
+            self.tag(key, at, tags)
+
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                for key, at in list(self._tags.get(tag, ())):
+                    self._remove(key, at)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._store.clear()
+            self._expiry.clear()
+            self._stale_expiry_entries = 0
+            self._bytes = 0
+            self._key_bytes.clear()
+            self._tags.clear()
+            if self._policy is not None:
+                self._policy.clear()
+
+
+class ShardedInMemoryCacheImpl(abc.Cache):
+    # Spreads entries over independent InMemoryCacheImpl shards by hash of (key, at), each with its own
+    # lock, so concurrent threads touching different entries rarely contend. This is aimed at
+    # free-threaded builds, where a single lock would serialize every read, but no speedup has been
+    # measured on one yet. With the GIL, benchmarks/threads.py shows it no faster and often slower
+    # than InMemoryCacheImpl, as threads are serialized anyway and picking a shard costs a hash.
+    # max_entries is split evenly between the shards. max_bytes and quotas apply to the whole cache:
+    # when a write takes the total over a limit, entries are shed from whichever shard holds the
+    # most of the excess.
+    supports_tags = True
+
+    def __init__(
+        self,
+        shards: int = 16,
+        max_entries: t.Optional[int] = None,
+        eviction_policy: t.Union[str, eviction.PolicyFactoryT] = "lru",
+        sweep_interval: t.Optional[float] = None,
+        max_bytes: t.Optional[int] = None,
+        quotas: t.Optional[t.Mapping[str, int]] = None,
+        sizer: t.Union[str, sizing.SizerT] = "deep",
+    ) -> None:
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+
+        self._max_bytes = max_bytes
+        self._quotas: t.Dict[str, int] = dict(quotas or {})
+        # Each shard is also given the full byte limits, which makes it reject values that could never
+        # fit and keeps it sizing its entries
+        self._shards = [
+            InMemoryCacheImpl(
+                -(-max_entries // shards) if max_entries is not None else None,
+                eviction_policy,
+                None,
+                max_bytes,
+                self._quotas,
+                sizer,
+            )
+            for _ in range(shards)
+        ]
 
+        # A single sweeper walks every shard rather than each shard running its own thread
+        self._sweeper_stop = threading.Event()
+        self._sweeper: t.Optional[threading.Thread] = None
+        if sweep_interval is not None:
+            self._sweeper = _start_sweeper(self, sweep_interval, self._sweeper_stop)
+
+    @property
+    def bytes_used(self) -> int:
+        return sum(shard.bytes_used for shard in self._shards)
+
+    def key_bytes_used(self, key: str) -> int:
+        return sum(shard.key_bytes_used(key) for shard in self._shards)
+
+    def _enforce_limits(self, keys: t.Iterable[str], written: t.Optional[InMemoryCacheImpl] = None) -> None:
+        # Sheds from the shard holding the most bytes, leaving the shard that was just written to for
+        # last so that a fresh entry isn't the first to go
+        def pick(used: t.Callable[[InMemoryCacheImpl], int]) -> InMemoryCacheImpl:
+            return max(self._shards, key=lambda shard: (shard is not written and used(shard) > 0, used(shard)))
+
+        if self._max_bytes is not None:
+            while (excess := self.bytes_used - self._max_bytes) > 0:
+                if not pick(lambda shard: shard.bytes_used)._shed_bytes(excess):
+                    break
+
+        for key in keys:
+            if (quota := self._quotas.get(key)) is None:
+                continue
+            while (excess := self.key_bytes_used(key) - quota) > 0:
+                if not pick(lambda shard: shard.key_bytes_used(key))._shed_key_bytes(key, excess):
+                    break
+
+    def _shard(self, key: str, at: str) -> InMemoryCacheImpl:
+        return self._shards[hash((key, at)) % len(self._shards)]
+
+    def _group(self, items: t.Sequence[t.Sequence[t.Any]]) -> t.Dict[int, t.List[int]]:
+        groups: t.Dict[int, t.List[int]] = {}
+        for i, item in enumerate(items):
+            groups.setdefault(hash((item[0], item[1])) % len(self._shards), []).append(i)
+        return groups
+
+    def reclaim(self) -> int:
+        return sum(shard.reclaim() for shard in self._shards)
+
+    def dump(self, path: str) -> int:
+        return _write_snapshot(path, (entry for shard in self._shards for entry in shard._entries()))
+
+    def load(self, path: str, timeout: t.Optional[float] = None) -> int:
+        return _load_snapshot(self, path, timeout)
+
+    def close(self) -> None:
+        _stop_sweeper(self._sweeper, self._sweeper_stop)
+        self._sweeper = None
+        for shard in self._shards:
+            shard.close()
+
+    def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        shard = self._shard(key, at)
+        shard.put(key, at, value, ttl)
+        if self._max_bytes is not None or key in self._quotas:
+            self._enforce_limits((key,), shard)
+
+    def get(self, key: str, at: str) -> t.Any:
+        return self._shard(key, at).get(key, at)
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        results: t.List[t.Any] = [abc._EMPTY] * len(items)
+        for shard, indexes in self._group(items).items():
+            for i, value in zip(indexes, self._shards[shard].get_many([items[i] for i in indexes])):
+                results[i] = value
+        return results
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        for shard, indexes in self._group(items).items():
+            self._shards[shard].put_many([items[i] for i in indexes])
+        if self._max_bytes is not None or self._quotas:
+            self._enforce_limits({item[0] for item in items})
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        for shard, indexes in self._group(items).items():
+            self._shards[shard].evict_many([items[i] for i in indexes])
+
+    def evict(self, key: str, at: str, all: bool = False) -> None:
         if not all:
-            self._store[key].pop(at, None)
-        else:
-            self._store[key].clear()
+            return self._shard(key, at).evict(key, at)
+        for shard in self._shards:
+            shard.evict(key, at, True)
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        self._shard(key, at).tag(key, at, tags)
+
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        for shard in self._shards:
+            shard.evict_tags(tags)
 
     def flush(self) -> None:
-        self._store.clear()
+        for shard in self._shards:
+            shard.flush()
@@ -17,9 +17,16 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import asyncio
+import contextlib
+import re
+import threading
+import time
 import typing as t
+import uuid
 
 import aioredis
+import orjson
 import redis
 
 from cache import abc
@@ -27,72 +34,727 @@ from cache import serde
 
 __all__ = ["RedisCacheImpl"]
 
+LayoutT = t.Literal["flat", "indexed"]
+CommandT = t.Tuple[str, t.Tuple[t.Any, ...], t.Dict[str, t.Any]]
+
+
+# Tags an entry, run as a script so the tag sets' expiry can follow their members. KEYS are the entry,
+# the set of every tag and then each tag's set. ARGV is the member, the client's clock and the tag names.
+# Members are scored by when their entry expires, and each set expires along with its last member.
+_TAG_SCRIPT = """
+local pttl = redis.call("PTTL", KEYS[1])
+if pttl == -2 then
+    return 0
+end
+local now = tonumber(ARGV[2])
+local expires = "+inf"
+if pttl >= 0 then
+    expires = string.format("%.3f", now + pttl / 1000)
+end
+
+for i = 3, #ARGV do
+    redis.call("SADD", KEYS[2], ARGV[i])
+end
+for i = 3, #KEYS do
+    redis.call("ZADD", KEYS[i], expires, ARGV[1])
+    redis.call("ZREMRANGEBYSCORE", KEYS[i], "-inf", "(" .. ARGV[2])
+    local last = redis.call("ZRANGE", KEYS[i], -1, -1, "WITHSCORES")[2]
+    if last == "inf" or last == "+inf" then
+        redis.call("PERSIST", KEYS[i])
+    else
+        redis.call("PEXPIRE", KEYS[i], math.ceil((tonumber(last) - now) * 1000) + 1)
+    end
+end
+return 1
+"""
+
+
+def _escape_glob(value: str) -> str:
+    return re.sub(r"([*?\[\]\\])", r"\\\1", value)
+
+
+class _AsyncBatcher:
+    # Collects commands issued by concurrent coroutines on one event loop and sends them as a single
+    # pipeline once `window` seconds have passed (0 means the next loop iteration) or `max_size`
+    # commands are queued. Each submission resolves to the results of its own commands. The batcher
+    # holds no reference to its loop, so it never keeps the loop alive.
+    __slots__ = ("_connection", "_window", "_max_size", "_pending", "_n_commands", "_handle", "_tasks")
+
+    def __init__(self, connection: aioredis.Redis, window: float, max_size: int) -> None:
+        self._connection = connection
+        self._window = window
+        self._max_size = max_size
+        self._pending: t.List[t.Tuple[t.List[CommandT], asyncio.Future[t.List[t.Any]]]] = []
+        self._n_commands = 0
+        self._handle: t.Optional[asyncio.Handle] = None
+        self._tasks: t.Set[asyncio.Task[None]] = set()
+
+    def submit(self, commands: t.List[CommandT]) -> asyncio.Future[t.List[t.Any]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((commands, future))
+        self._n_commands += len(commands)
+
+        if self._n_commands >= self._max_size:
+            self._flush()
+        elif self._handle is None:
+            self._handle = loop.call_later(self._window, self._flush) if self._window else loop.call_soon(self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        batch, self._pending, self._n_commands = self._pending, [], 0
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._execute(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, batch: t.List[t.Tuple[t.List[CommandT], asyncio.Future[t.List[t.Any]]]]) -> None:
+        pipe = self._connection.pipeline(transaction=False)
+        for commands, _ in batch:
+            for command, args, options in commands:
+                getattr(pipe, command)(*args, **options)
+
+        try:
+            results = await pipe.execute(raise_on_error=False)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for commands, future in batch:
+            own, offset = results[offset : offset + len(commands)], offset + len(commands)
+            # The caller may have been cancelled while the batch was in flight
+            if future.done():
+                continue
+
+            if errors := [result for result in own if isinstance(result, Exception)]:
+                future.set_exception(errors[0])
+            else:
+                future.set_result(own)
+
 
 class RedisCacheImpl(abc.Cache):
+    # Entries are always stored as plain strings at "pyc_0:{key}:{at}". The "indexed" layout also
+    # maintains a set of `at` values per key plus a set of all keys so that evict(all=True) and
+    # flush touch only the relevant entries instead of scanning the keyspace. Each key's index is a
+    # sorted set scored by the entries' expiry time (taken from this client's clock), and every write
+    # to a key drops the members of its index that have expired. Entry names are the
+    # same in both layouts, so switching an existing deployment over is done by moving writers to
+    # the indexed layout and then running migrate_to_indexed() to backfill the indexes.
+    supports_tags = True
     _VERSION = "0"
+    _BATCH_SIZE = 500
+
+    def __init__(
+        self,
+        url: str,
+        layout: LayoutT = "flat",
+        serde_format: serde.FormatT = "json",
+        codec: t.Optional[str] = None,
+        compress_threshold: int = 1024,
+        max_connections: t.Optional[int] = None,
+        socket_timeout: t.Optional[float] = None,
+        socket_connect_timeout: t.Optional[float] = None,
+        socket_keepalive: t.Optional[bool] = None,
+        health_check_interval: int = 0,
+        auto_batch: bool = False,
+        batch_window: float = 0.0,
+        max_batch_size: int = 128,
+    ) -> None:
+        if layout not in ("flat", "indexed"):
+            raise ValueError(f"Unknown redis layout {layout!r}. Expected 'flat' or 'indexed'")
 
-    def __init__(self, url: str) -> None:
         self._url = url
+        self._layout = layout
+        self._prefix = f"pyc_{self._VERSION}"
+        self._keys_index = f"pyc_{self._VERSION}_idx"
+        self._tags_index = f"pyc_{self._VERSION}_tags"
+        self._pool_options: t.Dict[str, t.Any] = {
+            "max_connections": max_connections,
+            "socket_timeout": socket_timeout,
+            "socket_connect_timeout": socket_connect_timeout,
+            "socket_keepalive": socket_keepalive,
+            "health_check_interval": health_check_interval,
+        }
+        self._auto_batch = auto_batch
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+        self.__batchers: t.Dict[asyncio.AbstractEventLoop, _AsyncBatcher] = {}
+        self.__sync_lock = threading.Lock()
         self.__sync_connection: t.Optional[redis.Redis] = None
-        self.__async_connection: t.Optional[aioredis.Redis] = None
-        self._class_cache: t.Dict[str, t.Type[abc.Serializable]] = {}
+        # asyncio connections can only be used from the loop that created them, so each loop gets its
+        # own client and pool. A client's connections reference its loop, so entries are held strongly
+        # and those whose loop has been closed are dropped whenever a new loop is seen. Call aclose()
+        # from a loop before closing it to release its connections straight away.
+        self.__async_connections: t.Dict[asyncio.AbstractEventLoop, aioredis.Redis] = {}
+        # Threads running their own loops share the per-loop maps, every access goes through this lock
+        self.__loops_lock = threading.Lock()
+        self._serde = (
+            serde.default_serde
+            if serde_format == "json" and codec is None
+            else serde.Serde(serde_format, codec, compress_threshold)
+        )
 
     def _sync_connection(self) -> redis.Redis:
         if self.__sync_connection is None:
-            self.__sync_connection = redis.from_url(self._url)
+            with self.__sync_lock:
+                if self.__sync_connection is None:
+                    self.__sync_connection = redis.from_url(self._url, **self._pool_options)
         return self.__sync_connection
 
     async def _async_connection(self) -> aioredis.Redis:
-        if self.__async_connection is None:
-            self.__async_connection = aioredis.from_url(self._url)
-        return self.__async_connection
+        loop = asyncio.get_running_loop()
+        with self.__loops_lock:
+            if (connection := self.__async_connections.get(loop)) is None:
+                self._prune_closed_loops()
+                connection = self.__async_connections[loop] = aioredis.from_url(self._url, **self._pool_options)
+        return connection
+
+    def _prune_closed_loops(self) -> None:
+        # Must be called with __loops_lock held
+        for loop in [loop for loop in self.__async_connections if loop.is_closed()]:
+            del self.__async_connections[loop]
+        for loop in [loop for loop in self.__batchers if loop.is_closed()]:
+            del self.__batchers[loop]
+
+    async def _abatched(self, commands: t.List[CommandT]) -> t.List[t.Any]:
+        loop = asyncio.get_running_loop()
+        with self.__loops_lock:
+            batcher = self.__batchers.get(loop)
+        if batcher is None:
+            connection = await self._async_connection()
+            with self.__loops_lock:
+                if (batcher := self.__batchers.get(loop)) is None:
+                    batcher = self.__batchers[loop] = _AsyncBatcher(
+                        connection, self._batch_window, self._max_batch_size
+                    )
+        return await batcher.submit(commands)
+
+    def close(self) -> None:
+        with self.__sync_lock:
+            connection, self.__sync_connection = self.__sync_connection, None
+        if connection is not None:
+            connection.close()
+            connection.connection_pool.disconnect()
+
+        # Clients belonging to other loops can't be awaited from here, dropping them lets their
+        # connections be closed on garbage collection.
+        with self.__loops_lock:
+            self.__async_connections.clear()
+            self.__batchers.clear()
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self.__loops_lock:
+            connection = self.__async_connections.pop(loop, None)
+        if connection is not None:
+            await connection.close()
+            await connection.connection_pool.disconnect()
+        self.close()
+
+    def _name(self, key: str, at: str) -> str:
+        return f"{self._prefix}:{key}:{at}"
+
+    def _index(self, key: str) -> str:
+        return f"{self._keys_index}:{key}"
+
+    def _index_commands(self, key: str, at: str, ttl: t.Optional[float]) -> t.List[CommandT]:
+        index, now = self._index(key), time.time()
+        return [
+            ("zadd", (index, {at: now + ttl if ttl is not None else "+inf"}), {}),
+            ("zremrangebyscore", (index, "-inf", f"({now}"), {}),
+            ("sadd", (self._keys_index, key), {}),
+        ]
+
+    def _add_to_index(self, pipe: t.Any, key: str, at: str, ttl: t.Optional[float]) -> None:
+        for command, args, options in self._index_commands(key, at, ttl):
+            getattr(pipe, command)(*args, **options)
+
+    def _pending_index(self) -> str:
+        return f"{self._keys_index}_evicting:{uuid.uuid4().hex}"
+
+    def _tag(self, tag: str) -> str:
+        return f"pyc_{self._VERSION}_tag:{tag}"
+
+    def _pending_tag(self) -> str:
+        return f"pyc_{self._VERSION}_tag_evicting:{uuid.uuid4().hex}"
 
     def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
-        self._sync_connection().set(f"pyc_{self._VERSION}:{key}:{at}", serde.serialize(value), ex=ttl)
+        if self._layout == "flat":
+            self._sync_connection().set(self._name(key, at), self._serde.serialize(value), ex=ttl)
+            return
+
+        pipe = self._sync_connection().pipeline(transaction=False)
+        pipe.set(self._name(key, at), self._serde.serialize(value), ex=ttl)
+        self._add_to_index(pipe, key, at, ttl)
+        pipe.execute()
 
     async def aput(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
-        await (await self._async_connection()).set(f"pyc_{self._VERSION}:{key}:{at}", serde.serialize(value), ex=ttl)
+        if self._auto_batch:
+            commands: t.List[CommandT] = [("set", (self._name(key, at), self._serde.serialize(value)), {"ex": ttl})]
+            if self._layout == "indexed":
+                commands.extend(self._index_commands(key, at, ttl))
+            await self._abatched(commands)
+            return
+
+        if self._layout == "flat":
+            await (await self._async_connection()).set(self._name(key, at), self._serde.serialize(value), ex=ttl)
+            return
+
+        pipe = (await self._async_connection()).pipeline(transaction=False)
+        pipe.set(self._name(key, at), self._serde.serialize(value), ex=ttl)
+        self._add_to_index(pipe, key, at, ttl)
+        await pipe.execute()
 
     def get(self, key: str, at: str) -> t.Any:
-        value: t.Optional[bytes] = self._sync_connection().get(f"pyc_{self._VERSION}:{key}:{at}")
-        return serde.deserialize(value)
+        value: t.Optional[bytes] = self._sync_connection().get(self._name(key, at))
+        if value is None:
+            return abc._EMPTY
+        return self._serde.deserialize(value)
 
     async def aget(self, key: str, at: str) -> t.Any:
-        value: t.Optional[bytes] = await (await self._async_connection()).get(f"pyc_{self._VERSION}:{key}:{at}")
-        return serde.deserialize(value)
+        value: t.Optional[bytes]
+        if self._auto_batch:
+            (value,) = await self._abatched([("get", (self._name(key, at),), {})])
+        else:
+            value = await (await self._async_connection()).get(self._name(key, at))
+        if value is None:
+            return abc._EMPTY
+        return self._serde.deserialize(value)
 
-    def evict(self, key: str, at: t.Optional[str] = None, all: bool = False) -> None:
-        conn = self._sync_connection()
-        if not all:
-            conn.delete(f"pyc_{self._VERSION}:{key}:{at}")
+    def get_with_ttl(self, key: str, at: str) -> t.Tuple[t.Any, t.Optional[float]]:
+        name = self._name(key, at)
+        value, pttl = self._sync_connection().pipeline(transaction=False).get(name).pttl(name).execute()
+        if value is None:
+            return abc._EMPTY, None
+        return self._serde.deserialize(value), (pttl / 1000 if pttl >= 0 else None)
+
+    async def aget_with_ttl(self, key: str, at: str) -> t.Tuple[t.Any, t.Optional[float]]:
+        name = self._name(key, at)
+        value, pttl = await (await self._async_connection()).pipeline(transaction=False).get(name).pttl(name).execute()
+        if value is None:
+            return abc._EMPTY, None
+        return self._serde.deserialize(value), (pttl / 1000 if pttl >= 0 else None)
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        if not items:
+            return []
+        values = self._sync_connection().mget([self._name(key, at) for key, at in items])
+        return [abc._EMPTY if value is None else self._serde.deserialize(value) for value in values]
+
+    async def aget_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        if not items:
+            return []
+        values = await (await self._async_connection()).mget([self._name(key, at) for key, at in items])
+        return [abc._EMPTY if value is None else self._serde.deserialize(value) for value in values]
+
+    def get_many_with_ttl(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Tuple[t.Any, t.Optional[float]]]:
+        pipe = self._sync_connection().pipeline(transaction=False)
+        for key, at in items:
+            pipe.get(self._name(key, at)).pttl(self._name(key, at))
+        results = pipe.execute()
+
+        return [
+            (abc._EMPTY, None)
+            if value is None
+            else (self._serde.deserialize(value), pttl / 1000 if pttl >= 0 else None)
+            for value, pttl in zip(results[::2], results[1::2])
+        ]
+
+    async def aget_many_with_ttl(
+        self, items: t.Sequence[t.Tuple[str, str]]
+    ) -> t.List[t.Tuple[t.Any, t.Optional[float]]]:
+        pipe = (await self._async_connection()).pipeline(transaction=False)
+        for key, at in items:
+            pipe.get(self._name(key, at)).pttl(self._name(key, at))
+        results = await pipe.execute()
+
+        return [
+            (abc._EMPTY, None)
+            if value is None
+            else (self._serde.deserialize(value), pttl / 1000 if pttl >= 0 else None)
+            for value, pttl in zip(results[::2], results[1::2])
+        ]
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        pipe = self._sync_connection().pipeline(transaction=False)
+        for key, at, value, ttl in items:
+            pipe.set(self._name(key, at), self._serde.serialize(value), ex=ttl)
+            if self._layout == "indexed":
+                self._add_to_index(pipe, key, at, ttl)
+        pipe.execute()
+
+    async def aput_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        pipe = (await self._async_connection()).pipeline(transaction=False)
+        for key, at, value, ttl in items:
+            pipe.set(self._name(key, at), self._serde.serialize(value), ex=ttl)
+            if self._layout == "indexed":
+                self._add_to_index(pipe, key, at, ttl)
+        await pipe.execute()
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        if not items:
+            return
+
+        pipe = self._sync_connection().pipeline(transaction=False)
+        pipe.delete(*(self._name(key, at) for key, at in items))
+        if self._layout == "indexed":
+            for key, at in items:
+                pipe.zrem(self._index(key), at)
+        pipe.execute()
+
+    async def aevict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        if not items:
             return
 
-        keys = conn.keys(f"pyc_{self._VERSION}:{key}:*")
-        if not keys:
+        pipe = (await self._async_connection()).pipeline(transaction=False)
+        pipe.delete(*(self._name(key, at) for key, at in items))
+        if self._layout == "indexed":
+            for key, at in items:
+                pipe.zrem(self._index(key), at)
+        await pipe.execute()
+
+    def _unlink_namespace(self, conn: redis.Redis, key: str) -> None:
+        batch: t.List[str] = []
+
+        if self._layout == "flat":
+            for name in conn.scan_iter(match=f"{self._prefix}:{_escape_glob(key)}:*", count=self._BATCH_SIZE):
+                batch.append(name)
+                if len(batch) >= self._BATCH_SIZE:
+                    conn.unlink(*batch)
+                    batch.clear()
+            if batch:
+                conn.unlink(*batch)
             return
-        conn.delete(*keys)
+
+        # The index is renamed before it is read, so entries written meanwhile land in a fresh index
+        # If there is no index there is nothing to rename, but the key may still need forgetting below
+        index, pending = self._index(key), self._pending_index()
+        with contextlib.suppress(redis.exceptions.ResponseError):
+            conn.rename(index, pending)
+        # Left behind if this process dies part way through, expire it rather than leak it
+        conn.expire(pending, 3600)
+
+        for at, _ in conn.zscan_iter(pending, count=self._BATCH_SIZE):
+            batch.append(self._name(key, at.decode("UTF-8")))
+            if len(batch) >= self._BATCH_SIZE:
+                conn.unlink(*batch)
+                batch.clear()
+        conn.unlink(*batch, pending)
+
+        # Only forget the key if no write has recreated its index in the meantime
+        with conn.pipeline() as pipe:
+            with contextlib.suppress(redis.exceptions.WatchError):
+                pipe.watch(index)
+                if not pipe.exists(index):
+                    pipe.multi()
+                    pipe.srem(self._keys_index, key)
+                    pipe.execute()
+
+    async def _aunlink_namespace(self, conn: aioredis.Redis, key: str) -> None:
+        batch: t.List[str] = []
+
+        if self._layout == "flat":
+            async for name in conn.scan_iter(match=f"{self._prefix}:{_escape_glob(key)}:*", count=self._BATCH_SIZE):
+                batch.append(name)
+                if len(batch) >= self._BATCH_SIZE:
+                    await conn.unlink(*batch)
+                    batch.clear()
+            if batch:
+                await conn.unlink(*batch)
+            return
+
+        index, pending = self._index(key), self._pending_index()
+        with contextlib.suppress(aioredis.exceptions.ResponseError):
+            await conn.rename(index, pending)
+        await conn.expire(pending, 3600)
+
+        async for at, _ in conn.zscan_iter(pending, count=self._BATCH_SIZE):
+            batch.append(self._name(key, at.decode("UTF-8")))
+            if len(batch) >= self._BATCH_SIZE:
+                await conn.unlink(*batch)
+                batch.clear()
+        await conn.unlink(*batch, pending)
+
+        async with conn.pipeline() as pipe:
+            with contextlib.suppress(aioredis.exceptions.WatchError):
+                await pipe.watch(index)
+                if not await pipe.exists(index):
+                    pipe.multi()
+                    pipe.srem(self._keys_index, key)
+                    await pipe.execute()
+
+    def evict(self, key: str, at: t.Optional[str] = None, all: bool = False) -> None:
+        conn = self._sync_connection()
+        if all:
+            self._unlink_namespace(conn, key)
+        elif self._layout == "indexed":
+            conn.pipeline(transaction=False).delete(self._name(key, at)).zrem(self._index(key), at).execute()
+        else:
+            conn.delete(self._name(key, at))
 
     async def aevict(self, key: str, at: str, all: bool = False) -> None:
+        if self._auto_batch and not all:
+            commands: t.List[CommandT] = [("delete", (self._name(key, at),), {})]
+            if self._layout == "indexed":
+                commands.append(("zrem", (self._index(key), at), {}))
+            await self._abatched(commands)
+            return
+
         conn = await self._async_connection()
-        if not all:
-            await conn.delete(f"pyc_{self._VERSION}:{key}:{at}")
+        if all:
+            await self._aunlink_namespace(conn, key)
+        elif self._layout == "indexed":
+            await conn.pipeline(transaction=False).delete(self._name(key, at)).zrem(self._index(key), at).execute()
+        else:
+            await conn.delete(self._name(key, at))
+
+    # Each tag is a sorted set of JSON encoded [key, at] members scored by their entry's expiry, plus
+    # a set of every tag for flush. Tagging an entry drops the set's expired members and has the set
+    # expire with its last member (see _TAG_SCRIPT). Overwritten entries stay listed until their tag
+    # is invalidated - evicting those again is harmless. A tag set is renamed before it is read so that
+    # entries tagged during the invalidation land in a fresh set.
+    def _tag_args(self, key: str, at: str, tags: t.Sequence[str]) -> t.Tuple[t.Any, ...]:
+        names = [self._name(key, at), self._tags_index, *(self._tag(tag) for tag in tags)]
+        return (_TAG_SCRIPT, len(names), *names, orjson.dumps([key, at]), time.time(), *tags)
+
+    def _put_commands(
+        self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]
+    ) -> t.List[CommandT]:
+        commands: t.List[CommandT] = [("set", (self._name(key, at), self._serde.serialize(value)), {"ex": ttl})]
+        if self._layout == "indexed":
+            commands.extend(self._index_commands(key, at, ttl))
+        if tags:
+            commands.append(("eval", self._tag_args(key, at, tags), {}))
+        return commands
+
+    @staticmethod
+    def _queue(pipe: t.Any, commands: t.List[CommandT]) -> t.Any:
+        for command, args, options in commands:
+            getattr(pipe, command)(*args, **options)
+        return pipe
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        if tags:
+            self._sync_connection().eval(*self._tag_args(key, at, tags))
+
+    async def atag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        if not tags:
             return
+        if self._auto_batch:
+            await self._abatched([("eval", self._tag_args(key, at, tags), {})])
+        else:
+            await (await self._async_connection()).eval(*self._tag_args(key, at, tags))
 
-        keys = await conn.keys(f"pyc_{self._VERSION}:{key}:*")
-        if not keys:
+    def put_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        self._queue(
+            self._sync_connection().pipeline(transaction=False), self._put_commands(key, at, value, ttl, tags)
+        ).execute()
+
+    async def aput_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        commands = self._put_commands(key, at, value, ttl, tags)
+        if self._auto_batch:
+            await self._abatched(commands)
             return
-        await conn.delete(*keys)
+        await self._queue((await self._async_connection()).pipeline(transaction=False), commands).execute()
+
+    def _unlink_tagged(self, pipe: t.Any, members: t.List[bytes]) -> t.List[t.Tuple[str, str]]:
+        entries = [tuple(orjson.loads(member)) for member in members]
+        pipe.unlink(*(self._name(key, at) for key, at in entries))
+        if self._layout == "indexed":
+            for key, at in entries:
+                pipe.zrem(self._index(key), at)
+        return entries  # type: ignore[return-value]
+
+    # on_evicted is called with each batch of entries as it is removed, which lets wrappers holding
+    # copies of entries (such as a near cache) drop them too without knowing their tags
+    def evict_tags(
+        self,
+        tags: t.Sequence[str],
+        on_evicted: t.Optional[t.Callable[[t.List[t.Tuple[str, str]]], None]] = None,
+    ) -> None:
+        conn = self._sync_connection()
+        for tag in tags:
+            pending = self._pending_tag()
+            # Forgotten before the rename, so a tag added back by a concurrent write stays listed
+            conn.srem(self._tags_index, tag)
+            try:
+                conn.rename(self._tag(tag), pending)
+            except redis.exceptions.ResponseError:
+                # Nothing carries this tag
+                continue
+            # Left behind if this process dies part way through, expire it rather than leak it
+            conn.expire(pending, 3600)
+
+            batch: t.List[bytes] = []
+            for member, _ in conn.zscan_iter(pending, count=self._BATCH_SIZE):
+                batch.append(member)
+                if len(batch) >= self._BATCH_SIZE:
+                    pipe = conn.pipeline(transaction=False)
+                    entries = self._unlink_tagged(pipe, batch)
+                    pipe.execute()
+                    batch.clear()
+                    if on_evicted is not None:
+                        on_evicted(entries)
+
+            pipe, entries = conn.pipeline(transaction=False), []
+            if batch:
+                entries = self._unlink_tagged(pipe, batch)
+            pipe.unlink(pending).execute()
+            if on_evicted is not None and entries:
+                on_evicted(entries)
+
+    async def aevict_tags(
+        self,
+        tags: t.Sequence[str],
+        on_evicted: t.Optional[t.Callable[[t.List[t.Tuple[str, str]]], t.Awaitable[None]]] = None,
+    ) -> None:
+        conn = await self._async_connection()
+        for tag in tags:
+            pending = self._pending_tag()
+            await conn.srem(self._tags_index, tag)
+            try:
+                await conn.rename(self._tag(tag), pending)
+            except aioredis.exceptions.ResponseError:
+                continue
+            await conn.expire(pending, 3600)
+
+            batch: t.List[bytes] = []
+            async for member, _ in conn.zscan_iter(pending, count=self._BATCH_SIZE):
+                batch.append(member)
+                if len(batch) >= self._BATCH_SIZE:
+                    pipe = conn.pipeline(transaction=False)
+                    entries = self._unlink_tagged(pipe, batch)
+                    await pipe.execute()
+                    batch.clear()
+                    if on_evicted is not None:
+                        await on_evicted(entries)
+
+            pipe, entries = conn.pipeline(transaction=False), []
+            if batch:
+                entries = self._unlink_tagged(pipe, batch)
+            await pipe.unlink(pending).execute()
+            if on_evicted is not None and entries:
+                await on_evicted(entries)
+
+    def _unlink_tags(self, conn: redis.Redis) -> None:
+        batch: t.List[str] = []
+        for tag in conn.sscan_iter(self._tags_index, count=self._BATCH_SIZE):
+            batch.append(self._tag(tag.decode("UTF-8")))
+            if len(batch) >= self._BATCH_SIZE:
+                conn.unlink(*batch)
+                batch.clear()
+        conn.unlink(*batch, self._tags_index)
+
+    async def _aunlink_tags(self, conn: aioredis.Redis) -> None:
+        batch: t.List[str] = []
+        async for tag in conn.sscan_iter(self._tags_index, count=self._BATCH_SIZE):
+            batch.append(self._tag(tag.decode("UTF-8")))
+            if len(batch) >= self._BATCH_SIZE:
+                await conn.unlink(*batch)
+                batch.clear()
+        await conn.unlink(*batch, self._tags_index)
+
+    @contextlib.contextmanager
+    def lock(self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0) -> t.Iterator[bool]:
+        # The lock expires after `lease` so a crashed holder cannot block other processes forever
+        lock = self._sync_connection().lock(
+            f"pyc_{self._VERSION}_lock:{key}:{at}",
+            timeout=lease,
+            blocking_timeout=timeout if timeout is not None else lease,
+        )
+        acquired = lock.acquire()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with contextlib.suppress(redis.exceptions.LockError):
+                    lock.release()
+
+    @contextlib.asynccontextmanager
+    async def alock(
+        self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0
+    ) -> t.AsyncIterator[bool]:
+        lock = (await self._async_connection()).lock(
+            f"pyc_{self._VERSION}_lock:{key}:{at}",
+            timeout=lease,
+            blocking_timeout=timeout if timeout is not None else lease,
+        )
+        acquired = await lock.acquire()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with contextlib.suppress(aioredis.exceptions.LockError):
+                    await lock.release()
 
     def flush(self) -> None:
         conn = self._sync_connection()
-        keys = conn.keys(f"pyc_{self._VERSION}:*")
-        if not keys:
+        self._unlink_tags(conn)
+        if self._layout == "flat":
+            batch: t.List[str] = []
+            for name in conn.scan_iter(match=f"{self._prefix}:*", count=self._BATCH_SIZE):
+                batch.append(name)
+                if len(batch) >= self._BATCH_SIZE:
+                    conn.unlink(*batch)
+                    batch.clear()
+            if batch:
+                conn.unlink(*batch)
             return
-        conn.delete(*keys)
+
+        for key in conn.sscan_iter(self._keys_index, count=self._BATCH_SIZE):
+            self._unlink_namespace(conn, key.decode("UTF-8"))
 
     async def aflush(self) -> None:
         conn = await self._async_connection()
-        keys = await conn.keys(f"pyc_{self._VERSION}:*")
-        if not keys:
+        await self._aunlink_tags(conn)
+        if self._layout == "flat":
+            batch: t.List[str] = []
+            async for name in conn.scan_iter(match=f"{self._prefix}:*", count=self._BATCH_SIZE):
+                batch.append(name)
+                if len(batch) >= self._BATCH_SIZE:
+                    await conn.unlink(*batch)
+                    batch.clear()
+            if batch:
+                await conn.unlink(*batch)
             return
-        await conn.delete(*keys)
+
+        async for key in conn.sscan_iter(self._keys_index, count=self._BATCH_SIZE):
+            await self._aunlink_namespace(conn, key.decode("UTF-8"))
+
+    def migrate_to_indexed(self) -> None:
+        # Backfills the indexed layout's sets from existing entries. Entry names are split at the
+        # first ':' after the prefix, so keys which themselves contain ':' cannot be migrated.
+        conn = self._sync_connection()
+
+        def backfill(names: t.List[bytes]) -> None:
+            lookup = conn.pipeline(transaction=False)
+            for name in names:
+                lookup.pttl(name)
+            pipe = conn.pipeline(transaction=False)
+            for name, pttl in zip(names, lookup.execute()):
+                if pttl == -2:
+                    # Expired since it was scanned
+                    continue
+                key, _, at = name.decode("UTF-8")[len(self._prefix) + 1 :].partition(":")
+                self._add_to_index(pipe, key, at, pttl / 1000 if pttl >= 0 else None)
+            pipe.execute()
+
+        batch: t.List[bytes] = []
+        for name in conn.scan_iter(match=f"{self._prefix}:*", count=self._BATCH_SIZE):
+            batch.append(name)
+            if len(batch) >= self._BATCH_SIZE:
+                backfill(batch)
+                batch.clear()
+        if batch:
+            backfill(batch)
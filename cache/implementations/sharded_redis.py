@@ -0,0 +1,229 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import hashlib
+import threading
+import typing as t
+
+from cache import abc
+from cache.implementations import redis as redis_impl
+
+__all__ = ["ShardedRedisCacheImpl", "HashRing"]
+
+T = t.TypeVar("T")
+RouteOnT = t.Literal["key", "key_at"]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # Consistent hashing with `replicas` virtual nodes per node. Virtual node positions depend only on
+    # the node's name, so adding or removing a node only moves the keys on the arcs it gains or loses.
+    __slots__ = ("_positions", "_nodes")
+
+    def __init__(self, nodes: t.Sequence[str], replicas: int = 160) -> None:
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node")
+
+        points = sorted((_hash(f"{node}#{i}"), index) for index, node in enumerate(nodes) for i in range(replicas))
+        self._positions = [position for position, _ in points]
+        self._nodes = [index for _, index in points]
+
+    def node(self, value: str) -> int:
+        i = bisect.bisect(self._positions, _hash(value))
+        return self._nodes[i if i < len(self._nodes) else 0]
+
+
+class ShardedRedisCacheImpl(abc.Cache):
+    # Spreads entries over several independent redis nodes. Entries are routed by (key, at), or by key
+    # alone with route_on="key" so that evict(all=True) only has to visit one node. Batch operations
+    # are grouped per node and the groups are sent concurrently.
+    supports_tags = True
+
+    def __init__(
+        self, urls: t.Sequence[str], route_on: RouteOnT = "key_at", replicas: int = 160, **options: t.Any
+    ) -> None:
+        if route_on not in ("key", "key_at"):
+            raise ValueError(f"Unknown route_on {route_on!r}. Expected 'key' or 'key_at'")
+        if len(set(urls)) != len(urls):
+            raise ValueError("Shard urls must be unique")
+
+        self._shards = [redis_impl.RedisCacheImpl(url, **options) for url in urls]
+        self._ring = HashRing(urls, replicas)
+        self._route_on = route_on
+        self._executor: t.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def shards(self) -> t.Sequence[redis_impl.RedisCacheImpl]:
+        return self._shards
+
+    def shard_for(self, key: str, at: str) -> redis_impl.RedisCacheImpl:
+        return self._shards[self._ring.node(key if self._route_on == "key" else f"{key}\x00{at}")]
+
+    def _group(self, items: t.Sequence[t.Sequence[t.Any]]) -> t.Dict[int, t.List[int]]:
+        groups: t.Dict[int, t.List[int]] = {}
+        for i, item in enumerate(items):
+            route = item[0] if self._route_on == "key" else f"{item[0]}\x00{item[1]}"
+            groups.setdefault(self._ring.node(route), []).append(i)
+        return groups
+
+    def _parallel(self, calls: t.Sequence[t.Callable[[], T]]) -> t.List[T]:
+        if len(calls) == 1:
+            return [calls[0]()]
+
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        len(self._shards), thread_name_prefix="pycaching-shard"
+                    )
+        return list(self._executor.map(lambda call: call(), calls))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for shard in self._shards:
+            shard.close()
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(shard.aclose() for shard in self._shards))
+        self.close()
+
+    def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        self.shard_for(key, at).put(key, at, value, ttl)
+
+    async def aput(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        await self.shard_for(key, at).aput(key, at, value, ttl)
+
+    def get(self, key: str, at: str) -> t.Any:
+        return self.shard_for(key, at).get(key, at)
+
+    async def aget(self, key: str, at: str) -> t.Any:
+        return await self.shard_for(key, at).aget(key, at)
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        results: t.List[t.Any] = [abc._EMPTY] * len(items)
+        groups = self._group(items)
+        calls = [
+            lambda shard=shard, indexes=indexes: self._shards[shard].get_many([items[i] for i in indexes])
+            for shard, indexes in groups.items()
+        ]
+        for indexes, values in zip(groups.values(), self._parallel(calls)):
+            for i, value in zip(indexes, values):
+                results[i] = value
+        return results
+
+    async def aget_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        results: t.List[t.Any] = [abc._EMPTY] * len(items)
+        groups = self._group(items)
+        responses = await asyncio.gather(
+            *(self._shards[shard].aget_many([items[i] for i in indexes]) for shard, indexes in groups.items())
+        )
+        for indexes, values in zip(groups.values(), responses):
+            for i, value in zip(indexes, values):
+                results[i] = value
+        return results
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        self._parallel(
+            [
+                lambda shard=shard, indexes=indexes: self._shards[shard].put_many([items[i] for i in indexes])
+                for shard, indexes in self._group(items).items()
+            ]
+        )
+
+    async def aput_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        await asyncio.gather(
+            *(
+                self._shards[shard].aput_many([items[i] for i in indexes])
+                for shard, indexes in self._group(items).items()
+            )
+        )
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        self._parallel(
+            [
+                lambda shard=shard, indexes=indexes: self._shards[shard].evict_many([items[i] for i in indexes])
+                for shard, indexes in self._group(items).items()
+            ]
+        )
+
+    async def aevict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        await asyncio.gather(
+            *(
+                self._shards[shard].aevict_many([items[i] for i in indexes])
+                for shard, indexes in self._group(items).items()
+            )
+        )
+
+    def evict(self, key: str, at: t.Optional[str] = None, all: bool = False) -> None:
+        if not all or self._route_on == "key":
+            return self.shard_for(key, at or "").evict(key, at, all)
+        self._parallel([lambda shard=shard: shard.evict(key, at, True) for shard in self._shards])
+
+    async def aevict(self, key: str, at: str, all: bool = False) -> None:
+        if not all or self._route_on == "key":
+            return await self.shard_for(key, at or "").aevict(key, at, all)
+        await asyncio.gather(*(shard.aevict(key, at, True) for shard in self._shards))
+
+    @contextlib.contextmanager
+    def lock(self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0) -> t.Iterator[bool]:
+        with self.shard_for(key, at).lock(key, at, timeout, lease) as acquired:
+            yield acquired
+
+    @contextlib.asynccontextmanager
+    async def alock(
+        self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0
+    ) -> t.AsyncIterator[bool]:
+        async with self.shard_for(key, at).alock(key, at, timeout, lease) as acquired:
+            yield acquired
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        self.shard_for(key, at).tag(key, at, tags)
+
+    async def atag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        await self.shard_for(key, at).atag(key, at, tags)
+
+    def put_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        self.shard_for(key, at).put_tagged(key, at, value, ttl, tags)
+
+    async def aput_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        await self.shard_for(key, at).aput_tagged(key, at, value, ttl, tags)
+
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        self._parallel([lambda shard=shard: shard.evict_tags(tags) for shard in self._shards])
+
+    async def aevict_tags(self, tags: t.Sequence[str]) -> None:
+        await asyncio.gather(*(shard.aevict_tags(tags) for shard in self._shards))
+
+    def flush(self) -> None:
+        self._parallel([shard.flush for shard in self._shards])
+
+    async def aflush(self) -> None:
+        await asyncio.gather(*(shard.aflush() for shard in self._shards))
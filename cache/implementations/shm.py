@@ -0,0 +1,603 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import typing as t
+import zlib
+
+from cache import abc
+from cache import serde
+
+__all__ = ["SharedMemoryCacheImpl", "parse_size"]
+
+# A single file under /dev/shm mapped by every process on the host:
+#
+#   header   magic and layout, then allocator state: flush generation, eviction clock hand, next
+#            unassigned page and page clock hand, then (free list head, bump pointer, bump end,
+#            evictions) per size class
+#   table    fixed-size open addressing hash table split into stripes. Entries probe at most
+#            _MAX_PROBE slots from their home slot, wrapping around within their stripe.
+#   pages    one byte per page holding the size class it belongs to plus one, 0 when unassigned
+#   arena    fixed-size pages, each handed out to one power-of-two size class. An entry is a
+#            (key length, at length) header followed by the key, the at and the serialized value.
+#
+# A class that runs out of chunks takes a whole page from the class holding the most pages while it
+# holds less than an even share of them, and otherwise evicts its own entries, still taking a page
+# every _REBALANCE_EVERY eviction rounds, so that memory follows the sizes actually being written
+# rather than the ones written first.
+#
+# Writers take the stripe lock, then the allocator lock when they need to allocate or free chunks.
+# Locks are an in-process mutex plus an fcntl byte-range lock on the file, since fcntl locks do not
+# exclude threads of the same process. Readers take no locks: every slot carries a sequence number
+# that writers make odd while they modify the slot or its chunk, and flush bumps the generation, so
+# a reader that sees either change while copying the entry out simply retries.
+_MAGIC = b"PYCSHM01"
+_LAYOUT_VERSION = 2
+_HEADER_SIZE = 4096
+
+_LAYOUT = struct.Struct("<8sIIIIIIQ")
+_STATE = struct.Struct("<QQII")
+_STATE_OFFSET = 64
+_CLASSES_OFFSET = 128
+_CLASS = struct.Struct("<QQQQ")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+# seq, state, reference bit, size class, key hash, entry length, hash, chunk offset, expiry (0 = never)
+_SLOT = struct.Struct("<IBBBxIIQQd")
+_SLOT_BODY = struct.Struct("<BBBxIIQQd")
+_STATE_BYTE = 4
+_REF_BYTE = 5
+_ENTRY = struct.Struct("<II")
+
+_EMPTY_SLOT = 0
+_USED = 1
+_TOMBSTONE = 2
+# Held by a writer between freeing the old chunk and publishing the new one, so that concurrent
+# evictions neither reclaim the slot nor turn it into an empty one
+_RESERVED = 3
+
+_MIN_CHUNK_SHIFT = 6
+_MAX_PROBE = 32
+_READ_RETRIES = 8
+_EVICT_BATCH = 8
+_REBALANCE_EVERY = 16
+_MOVE_ATTEMPTS = 4
+
+# fcntl byte-range lock offsets
+_INIT_LOCK = 0
+_ALLOCATOR_LOCK = 1
+_STRIPE_LOCKS = 2
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(size: t.Union[int, str]) -> int:
+    if isinstance(size, int):
+        return size
+    if (match := re.fullmatch(r"\s*(\d+)\s*([KMGT]?)(?:I?B)?\s*", size.upper())) is None:
+        raise ValueError(f"Invalid size {size!r}. Expected a number of bytes optionally suffixed with KB, MB or GB")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
+def _default_directory() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+class SharedMemoryCacheImpl(abc.Cache):
+    # Attaching to an existing segment always uses the layout it was created with, the size options
+    # only apply to the process that creates it. All instances in a process must be closed together:
+    # closing any descriptor of the file releases every fcntl lock the process holds on it.
+    def __init__(
+        self,
+        name: str,
+        size: t.Union[int, str] = "64MB",
+        buckets: t.Optional[int] = None,
+        stripes: int = 64,
+        directory: t.Optional[str] = None,
+        serde_format: serde.FormatT = "json",
+        codec: t.Optional[str] = None,
+        compress_threshold: int = 1024,
+    ) -> None:
+        if not name or os.sep in name:
+            raise ValueError(f"Invalid shared memory cache name {name!r}")
+
+        self._path = os.path.join(directory or _default_directory(), f"pycaching-{name}")
+        self._serde = (
+            serde.default_serde
+            if serde_format == "json" and codec is None
+            else serde.Serde(serde_format, codec, compress_threshold)
+        )
+
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _INIT_LOCK)
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    self._create(parse_size(size), buckets, stripes)
+                else:
+                    self._mm = mmap.mmap(self._fd, 0)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _INIT_LOCK)
+            self._attach()
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+        self._thread_locks = [threading.Lock() for _ in range(self._stripes + 1)]
+
+    def _create(self, size: int, buckets: t.Optional[int], stripes: int) -> None:
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
+
+        buckets_per_stripe = max(_MAX_PROBE * 4, -(-(buckets or size // 1024) // stripes))
+        table_size = stripes * buckets_per_stripe * _SLOT.size
+
+        # Pages must hold at least one chunk of the largest class, but small segments still need
+        # enough pages to give every size class some memory
+        page_size = 1 << 20
+        while page_size > 4096 and size // page_size < 256:
+            page_size //= 2
+        n_classes = page_size.bit_length() - _MIN_CHUNK_SHIFT
+
+        arena_offset = -(-(_HEADER_SIZE + table_size + size // page_size) // 4096) * 4096
+        n_pages = max(0, size - arena_offset) // page_size
+        if n_pages < n_classes:
+            raise ValueError(f"Shared memory cache size {size} is too small for {stripes * buckets_per_stripe} buckets")
+
+        file_size = arena_offset + n_pages * page_size
+        os.ftruncate(self._fd, file_size)
+        self._mm = mmap.mmap(self._fd, file_size)
+        _LAYOUT.pack_into(
+            self._mm, 0, _MAGIC, _LAYOUT_VERSION, stripes, buckets_per_stripe, page_size, n_pages, n_classes, file_size
+        )
+
+    def _attach(self) -> None:
+        magic, version, stripes, buckets_per_stripe, page_size, n_pages, n_classes, file_size = _LAYOUT.unpack_from(
+            self._mm, 0
+        )
+        if magic != _MAGIC or version != _LAYOUT_VERSION or len(self._mm) != file_size:
+            self._mm.close()
+            raise ValueError(f"{self._path} is not a compatible shared memory cache segment")
+
+        self._stripes = stripes
+        self._buckets_per_stripe = buckets_per_stripe
+        self._page_size = page_size
+        self._n_pages = n_pages
+        self._n_classes = n_classes
+        self._table = _HEADER_SIZE
+        self._pages = _HEADER_SIZE + stripes * buckets_per_stripe * _SLOT.size
+        self._arena = file_size - n_pages * page_size
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def close(self) -> None:
+        if self._fd < 0:
+            return
+        self._mm.close()
+        os.close(self._fd)
+        self._fd = -1
+
+    def unlink(self) -> None:
+        # Processes that are still attached keep using the old segment until they close it
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._path)
+
+    def _acquire(self, lock: int) -> None:
+        self._thread_locks[lock].acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _STRIPE_LOCKS + lock if lock < self._stripes else _ALLOCATOR_LOCK)
+        except BaseException:
+            self._thread_locks[lock].release()
+            raise
+
+    def _try_acquire(self, lock: int) -> bool:
+        if not self._thread_locks[lock].acquire(blocking=False):
+            return False
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, _STRIPE_LOCKS + lock)
+        except OSError:
+            self._thread_locks[lock].release()
+            return False
+        return True
+
+    def _release(self, lock: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _STRIPE_LOCKS + lock if lock < self._stripes else _ALLOCATOR_LOCK)
+        self._thread_locks[lock].release()
+
+    @contextlib.contextmanager
+    def _locked(self, lock: int) -> t.Iterator[None]:
+        self._acquire(lock)
+        try:
+            yield
+        finally:
+            self._release(lock)
+
+    def _allocator(self) -> t.ContextManager[None]:
+        return self._locked(self._stripes)
+
+    def _locate(self, key: bytes, at: bytes) -> t.Tuple[int, int, int, int]:
+        digest = int.from_bytes(hashlib.blake2b(key + b"\x00" + at, digest_size=8).digest(), "little")
+        stripe, home = divmod(digest % (self._stripes * self._buckets_per_stripe), self._buckets_per_stripe)
+        return digest, zlib.crc32(key), stripe, home
+
+    def _slot(self, stripe: int, position: int) -> int:
+        return self._table + (stripe * self._buckets_per_stripe + position % self._buckets_per_stripe) * _SLOT.size
+
+    def _entry_matches(self, offset: int, key: bytes, at: t.Optional[bytes]) -> bool:
+        key_length, at_length = _ENTRY.unpack_from(self._mm, offset)
+        start = offset + _ENTRY.size
+        if self._mm[start : start + key_length] != key:
+            return False
+        return at is None or self._mm[start + key_length : start + key_length + at_length] == at
+
+    def _size_class(self, length: int) -> t.Optional[int]:
+        size_class = max(0, (length - 1).bit_length() - _MIN_CHUNK_SHIFT)
+        return size_class if size_class < self._n_classes else None
+
+    def _begin_write(self, slot: int) -> int:
+        seq = _U32.unpack_from(self._mm, slot)[0]
+        _U32.pack_into(self._mm, slot, (seq + 1) & 0xFFFFFFFF)
+        return (seq + 2) & 0xFFFFFFFF
+
+    # Allocator - callers must hold the allocator lock
+
+    def _pop_chunk(self, size_class: int) -> t.Optional[int]:
+        mm, class_offset = self._mm, _CLASSES_OFFSET + size_class * _CLASS.size
+        head, bump, bump_end, evictions = _CLASS.unpack_from(mm, class_offset)
+        if head:
+            _CLASS.pack_into(mm, class_offset, _U64.unpack_from(mm, head)[0], bump, bump_end, evictions)
+            return head
+
+        chunk_size = 1 << (size_class + _MIN_CHUNK_SHIFT)
+        if bump >= bump_end:
+            generation, hand, next_page, page_hand = _STATE.unpack_from(mm, _STATE_OFFSET)
+            if next_page >= self._n_pages:
+                return None
+            mm[self._pages + next_page] = size_class + 1
+            bump = self._arena + next_page * self._page_size
+            bump_end = bump + self._page_size
+            _STATE.pack_into(mm, _STATE_OFFSET, generation, hand, next_page + 1, page_hand)
+
+        _CLASS.pack_into(mm, class_offset, head, bump + chunk_size, bump_end, evictions)
+        return bump
+
+    def _free(self, size_class: int, offset: int) -> None:
+        class_offset = _CLASSES_OFFSET + size_class * _CLASS.size
+        head, bump, bump_end, evictions = _CLASS.unpack_from(self._mm, class_offset)
+        _U64.pack_into(self._mm, offset, head)
+        _CLASS.pack_into(self._mm, class_offset, offset, bump, bump_end, evictions)
+
+    def _allocate(self, size_class: int, held_stripe: int) -> t.Optional[int]:
+        if (offset := self._pop_chunk(size_class)) is not None:
+            return offset
+
+        class_offset = _CLASSES_OFFSET + size_class * _CLASS.size
+        head, bump, bump_end, evictions = _CLASS.unpack_from(self._mm, class_offset)
+        _CLASS.pack_into(self._mm, class_offset, head, bump, bump_end, evictions + 1)
+
+        owners = self._mm[self._pages : self._pages + self._n_pages]
+        counts = [owners.count(c + 1) for c in range(self._n_classes)]
+        active = sum(1 for c, count in enumerate(counts) if count or c == size_class)
+        below_share = counts[size_class] * active < self._n_pages
+        if (below_share or evictions % _REBALANCE_EVERY == _REBALANCE_EVERY - 1) and self._move_page(
+            size_class, held_stripe, owners, counts
+        ):
+            if (offset := self._pop_chunk(size_class)) is not None:
+                return offset
+
+        if counts[size_class]:
+            self._evict_for(size_class, held_stripe)
+        return self._pop_chunk(size_class)
+
+    def _move_page(self, size_class: int, held_stripe: int, owners: bytes, counts: t.List[int]) -> bool:
+        # Takes a page from the class holding the most, as long as it holds more than this one
+        mm, pages, n_pages = self._mm, self._pages, self._n_pages
+        donor = max(range(self._n_classes), key=counts.__getitem__)
+        if donor == size_class or counts[donor] <= counts[size_class] + 1:
+            return False
+
+        generation, hand, next_page, page_hand = _STATE.unpack_from(mm, _STATE_OFFSET)
+        attempts = 0
+        for i in range(n_pages):
+            page = (page_hand + i) % n_pages
+            if owners[page] != donor + 1:
+                continue
+
+            _STATE.pack_into(mm, _STATE_OFFSET, generation, hand, next_page, (page + 1) % n_pages)
+            if self._clear_page(donor, page, held_stripe):
+                start = self._arena + page * self._page_size
+                mm[pages + page] = size_class + 1
+                class_offset = _CLASSES_OFFSET + size_class * _CLASS.size
+                head, _, _, evictions = _CLASS.unpack_from(mm, class_offset)
+                _CLASS.pack_into(mm, class_offset, head, start, start + self._page_size, evictions)
+                return True
+
+            attempts += 1
+            if attempts >= _MOVE_ATTEMPTS:
+                break
+        return False
+
+    def _clear_page(self, owner: int, page: int, held_stripe: int) -> bool:
+        # Every stripe may hold entries stored in the page, so all of them must be locked. One held by
+        # another writer may be about to write into the page, in which case the page is left alone.
+        mm, bps = self._mm, self._buckets_per_stripe
+        start = self._arena + page * self._page_size
+        end = start + self._page_size
+
+        acquired: t.List[int] = []
+        try:
+            for stripe in range(self._stripes):
+                if stripe != held_stripe:
+                    if not self._try_acquire(stripe):
+                        return False
+                    acquired.append(stripe)
+
+            table = mm[self._table : self._pages]
+            for index, (_, state, _, _, _, _, _, offset, _) in enumerate(_SLOT.iter_unpack(table)):
+                if state == _USED and start <= offset < end:
+                    stripe, position = divmod(index, bps)
+                    self._delete(stripe, position)
+
+            # The page's free chunks must not be handed out by the class that is losing it
+            class_offset = _CLASSES_OFFSET + owner * _CLASS.size
+            head, bump, bump_end, evictions = _CLASS.unpack_from(mm, class_offset)
+            kept: t.List[int] = []
+            while head:
+                if not start <= head < end:
+                    kept.append(head)
+                head = _U64.unpack_from(mm, head)[0]
+            for chunk, next_chunk in zip(kept, kept[1:] + [0]):
+                _U64.pack_into(mm, chunk, next_chunk)
+            if start <= bump < end or bump_end == end:
+                bump = bump_end = 0
+            _CLASS.pack_into(mm, class_offset, kept[0] if kept else 0, bump, bump_end, evictions)
+            return True
+        finally:
+            for stripe in acquired:
+                self._release(stripe)
+
+    def _evict_for(self, size_class: int, held_stripe: int) -> None:
+        # CLOCK over the whole table: entries of the wanted class that weren't read since the hand last
+        # passed are evicted, expired entries of any class are reclaimed on the way. Stripes locked by
+        # other writers are skipped rather than waited on, which would deadlock against their holder.
+        mm, bps = self._mm, self._buckets_per_stripe
+        total, now = self._stripes * bps, time.time()
+        generation, hand, next_page, page_hand = _STATE.unpack_from(mm, _STATE_OFFSET)
+        hand %= total
+
+        scanned = freed = 0
+        while scanned < 2 * total and freed < _EVICT_BATCH:
+            stripe, end = hand // bps, (hand // bps + 1) * bps
+            if stripe != held_stripe and not self._try_acquire(stripe):
+                scanned += end - hand
+                hand = end % total
+                continue
+
+            try:
+                while hand < end and scanned < 2 * total and freed < _EVICT_BATCH:
+                    slot = self._table + hand * _SLOT.size
+                    _, state, ref, slot_class, _, _, _, offset, expires = _SLOT.unpack_from(mm, slot)
+                    if state == _USED:
+                        if (expires and expires <= now) or (slot_class == size_class and not ref):
+                            self._delete(stripe, hand - stripe * bps)
+                            self._free(slot_class, offset)
+                            freed += slot_class == size_class
+                        elif slot_class == size_class:
+                            mm[slot + _REF_BYTE] = 0
+                    hand += 1
+                    scanned += 1
+            finally:
+                if stripe != held_stripe:
+                    self._release(stripe)
+            hand %= total
+
+        _STATE.pack_into(mm, _STATE_OFFSET, generation, hand, next_page, page_hand)
+
+    # Table - callers must hold the stripe lock
+
+    def _find(self, stripe: int, home: int, digest: int, key: bytes, at: bytes) -> t.Optional[int]:
+        for i in range(_MAX_PROBE):
+            slot = self._slot(stripe, home + i)
+            _, state, _, _, _, _, slot_digest, offset, _ = _SLOT.unpack_from(self._mm, slot)
+            if state == _EMPTY_SLOT:
+                return None
+            if state == _USED and slot_digest == digest and self._entry_matches(offset, key, at):
+                return slot
+        return None
+
+    def _find_for_write(self, stripe: int, home: int, digest: int, key: bytes, at: bytes) -> int:
+        free = victim = None
+        for i in range(_MAX_PROBE):
+            slot = self._slot(stripe, home + i)
+            _, state, ref, _, _, _, slot_digest, offset, _ = _SLOT.unpack_from(self._mm, slot)
+            if state == _EMPTY_SLOT:
+                return free if free is not None else slot
+            if state == _TOMBSTONE:
+                free = slot if free is None else free
+            elif slot_digest == digest and self._entry_matches(offset, key, at):
+                return slot
+            elif victim is None and not ref:
+                victim = slot
+
+        # The probe window is full, the new entry replaces an unreferenced one
+        if free is not None:
+            return free
+        return victim if victim is not None else self._slot(stripe, home)
+
+    def _delete(self, stripe: int, position: int) -> None:
+        mm, slot = self._mm, self._slot(stripe, position)
+        seq = self._begin_write(slot)
+        # A slot followed by an empty one ends every probe sequence passing through it, so it and any
+        # tombstones directly before it can become empty again
+        if mm[self._slot(stripe, position + 1) + _STATE_BYTE] != _EMPTY_SLOT:
+            mm[slot + _STATE_BYTE] = _TOMBSTONE
+            _U32.pack_into(mm, slot, seq)
+            return
+
+        mm[slot + _STATE_BYTE] = _EMPTY_SLOT
+        _U32.pack_into(mm, slot, seq)
+        for i in range(1, _MAX_PROBE):
+            previous = self._slot(stripe, position - i)
+            if mm[previous + _STATE_BYTE] != _TOMBSTONE:
+                break
+            mm[previous + _STATE_BYTE] = _EMPTY_SLOT
+
+    def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        key_b, at_b = key.encode(), at.encode()
+        entry = b"".join((_ENTRY.pack(len(key_b), len(at_b)), key_b, at_b, self._serde.serialize(value)))
+        digest, key_hash, stripe, home = self._locate(key_b, at_b)
+
+        if (size_class := self._size_class(len(entry))) is None:
+            # Too large to ever be stored, but an older value must not keep being served
+            return self.evict(key, at)
+
+        with self._locked(stripe):
+            mm, slot = self._mm, self._find_for_write(stripe, home, digest, key_b, at_b)
+            _, state, _, old_class, _, _, _, offset, _ = _SLOT.unpack_from(mm, slot)
+            seq = self._begin_write(slot)
+            try:
+                if state != _USED or old_class != size_class:
+                    with self._allocator():
+                        mm[slot + _STATE_BYTE] = _RESERVED
+                        if state == _USED:
+                            self._free(old_class, offset)
+                        offset = self._allocate(size_class, stripe)
+                    if offset is None:
+                        mm[slot + _STATE_BYTE] = _TOMBSTONE
+                        return
+
+                mm[offset : offset + len(entry)] = entry
+                expires = time.time() + ttl if ttl is not None else 0.0
+                _SLOT_BODY.pack_into(mm, slot + 4, _USED, 1, size_class, key_hash, len(entry), digest, offset, expires)
+            finally:
+                _U32.pack_into(mm, slot, seq)
+
+    def _read(self, stripe: int, home: int, digest: int, key: bytes, at: bytes) -> t.Optional[bytes]:
+        mm = self._mm
+        for _ in range(_READ_RETRIES):
+            generation = _U64.unpack_from(mm, _STATE_OFFSET)[0]
+            for i in range(_MAX_PROBE):
+                slot = self._slot(stripe, home + i)
+                seq, state, ref, _, _, length, slot_digest, offset, expires = _SLOT.unpack_from(mm, slot)
+                if state == _EMPTY_SLOT:
+                    return None
+                if state != _USED or slot_digest != digest:
+                    continue
+
+                entry = mm[offset : offset + length]
+                if (
+                    seq & 1
+                    or _U32.unpack_from(mm, slot)[0] != seq
+                    or _U64.unpack_from(mm, _STATE_OFFSET)[0] != generation
+                ):
+                    break
+
+                key_length, at_length = _ENTRY.unpack_from(entry)
+                start = _ENTRY.size + key_length + at_length
+                if entry[_ENTRY.size : _ENTRY.size + key_length] != key or entry[start - at_length : start] != at:
+                    continue
+                if expires and expires <= time.time():
+                    return None
+                if not ref:
+                    mm[slot + _REF_BYTE] = 1
+                return entry[start:]
+            else:
+                return None
+
+        # Constantly losing races against writers, wait for the stripe instead
+        with self._locked(stripe):
+            if (slot := self._find(stripe, home, digest, key, at)) is None:
+                return None
+            _, _, _, _, _, length, _, offset, expires = _SLOT.unpack_from(mm, slot)
+            if expires and expires <= time.time():
+                return None
+            mm[slot + _REF_BYTE] = 1
+            return mm[offset + _ENTRY.size + len(key) + len(at) : offset + length]
+
+    def get(self, key: str, at: str) -> t.Any:
+        key_b, at_b = key.encode(), at.encode()
+        digest, _, stripe, home = self._locate(key_b, at_b)
+        if (raw := self._read(stripe, home, digest, key_b, at_b)) is None:
+            return abc._EMPTY
+        return self._serde.deserialize(raw)
+
+    def _evict_slots(self, stripe: int, slots: t.List[int]) -> None:
+        mm = self._mm
+        with self._allocator():
+            for slot in slots:
+                _, _, _, size_class, _, _, _, offset, _ = _SLOT.unpack_from(mm, slot)
+                self._delete(stripe, (slot - self._slot(stripe, 0)) // _SLOT.size)
+                self._free(size_class, offset)
+
+    def evict(self, key: str, at: str, all: bool = False) -> None:
+        key_b, at_b = key.encode(), (at or "").encode()
+        digest, key_hash, stripe, home = self._locate(key_b, at_b)
+
+        if not all:
+            with self._locked(stripe):
+                if (slot := self._find(stripe, home, digest, key_b, at_b)) is not None:
+                    self._evict_slots(stripe, [slot])
+            return
+
+        # Entries are spread over every stripe, so this walks the whole table one stripe at a time
+        mm = self._mm
+        for stripe in range(self._stripes):
+            with self._locked(stripe):
+                slots = []
+                for position in range(self._buckets_per_stripe):
+                    slot = self._slot(stripe, position)
+                    _, state, _, _, slot_key_hash, _, _, offset, _ = _SLOT.unpack_from(mm, slot)
+                    if state == _USED and slot_key_hash == key_hash and self._entry_matches(offset, key_b, None):
+                        slots.append(slot)
+                if slots:
+                    self._evict_slots(stripe, slots)
+
+    def flush(self) -> None:
+        for stripe in range(self._stripes):
+            self._acquire(stripe)
+        try:
+            with self._allocator():
+                mm = self._mm
+                generation = _U64.unpack_from(mm, _STATE_OFFSET)[0]
+                _STATE.pack_into(mm, _STATE_OFFSET, generation + 1, 0, 0, 0)
+
+                zeros = bytes(1 << 20)
+                mm[_CLASSES_OFFSET:_HEADER_SIZE] = zeros[: _HEADER_SIZE - _CLASSES_OFFSET]
+                for start in range(self._table, self._arena, len(zeros)):
+                    end = min(start + len(zeros), self._arena)
+                    mm[start:end] = zeros[: end - start]
+
+                _STATE.pack_into(mm, _STATE_OFFSET, generation + 2, 0, 0, 0)
+        finally:
+            for stripe in reversed(range(self._stripes)):
+                self._release(stripe)
@@ -0,0 +1,276 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import sqlite3
+import threading
+import time
+import typing as t
+
+from cache import abc
+from cache import serde
+
+__all__ = ["SQLiteCacheImpl"]
+
+T = t.TypeVar("T")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pyc_0 (
+    key TEXT NOT NULL,
+    at TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires REAL,
+    PRIMARY KEY (key, at)
+);
+CREATE INDEX IF NOT EXISTS pyc_0_expires ON pyc_0 (expires) WHERE expires IS NOT NULL;
+CREATE TABLE IF NOT EXISTS pyc_0_tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    at TEXT NOT NULL,
+    PRIMARY KEY (tag, key, at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pyc_0_tags_entry ON pyc_0_tags (key, at);
+"""
+
+
+class SQLiteCacheImpl(abc.Cache):
+    # A single SQLite database in WAL mode, so any number of threads and processes can read while
+    # one writes, and reopening it after a restart costs the same regardless of how much is stored.
+    # Expiry uses the wall clock since entries outlive the process. Expired rows are skipped on read.
+    # Every `reclaim_every` writes, the writer also deletes a batch of expired rows and their tag rows.
+    # reclaim() deletes all of them, along with tag rows whose entry no longer exists, and also runs
+    # whenever the database is opened.
+    supports_tags = True
+    _BATCH_SIZE = 400
+    _RECLAIM_BATCH = 1000
+
+    def __init__(
+        self,
+        directory: str,
+        filename: str = "pycaching.sqlite3",
+        serde_format: serde.FormatT = "json",
+        codec: t.Optional[str] = None,
+        compress_threshold: int = 1024,
+        busy_timeout: float = 5.0,
+        synchronous: t.Literal["OFF", "NORMAL", "FULL"] = "NORMAL",
+        reclaim_every: t.Optional[int] = 1000,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, filename)
+        self._busy_timeout = busy_timeout
+        self._synchronous = synchronous
+        self._reclaim_every = reclaim_every
+        # Shared by every thread, a lost update only shifts when the next batch runs
+        self._writes = 0
+        self._serde = (
+            serde.default_serde
+            if serde_format == "json" and codec is None
+            else serde.Serde(serde_format, codec, compress_threshold)
+        )
+
+        # sqlite3 connections can't be shared between threads, each thread gets its own
+        self._local = threading.local()
+        self._connections: t.List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+        self.reclaim()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _connection(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, "connection", None)) is not None:
+            return connection
+
+        connection = sqlite3.connect(
+            self._path, timeout=self._busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={self._synchronous}")
+        self._local.connection = connection
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    async def _run(self, func: t.Callable[..., T], *args: t.Any) -> T:
+        # Disk I/O would otherwise block the event loop, run it on the loop's default executor
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+    def close(self) -> None:
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _reclaim(self, connection: sqlite3.Connection, now: float) -> int:
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                "SELECT rowid, key, at FROM pyc_0 WHERE expires <= ? LIMIT ?", (now, self._RECLAIM_BATCH)
+            ).fetchall()
+            connection.executemany("DELETE FROM pyc_0_tags WHERE key = ? AND at = ?", [row[1:] for row in rows])
+            connection.executemany("DELETE FROM pyc_0 WHERE rowid = ?", [row[:1] for row in rows])
+        return len(rows)
+
+    def _wrote(self, connection: sqlite3.Connection, n: int) -> None:
+        if self._reclaim_every is None:
+            return
+
+        self._writes += n
+        if self._writes >= self._reclaim_every:
+            self._writes = 0
+            self._reclaim(connection, time.time())
+
+    def reclaim(self) -> int:
+        connection, now, total = self._connection(), time.time(), 0
+        # Batches keep each write transaction short, so other writers aren't stalled by a large backlog
+        while (reclaimed := self._reclaim(connection, now)) == self._RECLAIM_BATCH:
+            total += reclaimed
+
+        with connection:
+            connection.execute(
+                "DELETE FROM pyc_0_tags WHERE NOT EXISTS "
+                "(SELECT 1 FROM pyc_0 WHERE pyc_0.key = pyc_0_tags.key AND pyc_0.at = pyc_0_tags.at)"
+            )
+        return total + reclaimed
+
+    def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        raw = self._serde.serialize(value)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO pyc_0 (key, at, value, expires) VALUES (?, ?, ?, ?)",
+                (key, at, raw, time.time() + ttl if ttl is not None else None),
+            )
+        self._wrote(connection, 1)
+
+    async def aput(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        await self._run(self.put, key, at, value, ttl)
+
+    def get(self, key: str, at: str) -> t.Any:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM pyc_0 WHERE key = ? AND at = ? AND (expires IS NULL OR expires > ?)",
+                (key, at, time.time()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return abc._EMPTY
+        return self._serde.deserialize(row[0])
+
+    async def aget(self, key: str, at: str) -> t.Any:
+        return await self._run(self.get, key, at)
+
+    def evict(self, key: str, at: str, all: bool = False) -> None:
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if all:
+                connection.execute("DELETE FROM pyc_0 WHERE key = ?", (key,))
+                connection.execute("DELETE FROM pyc_0_tags WHERE key = ?", (key,))
+            else:
+                connection.execute("DELETE FROM pyc_0 WHERE key = ? AND at = ?", (key, at))
+                connection.execute("DELETE FROM pyc_0_tags WHERE key = ? AND at = ?", (key, at))
+
+    async def aevict(self, key: str, at: str, all: bool = False) -> None:
+        await self._run(self.evict, key, at, all)
+
+    # Tag rows are removed along with their entry when it is evicted or reclaimed. Overwriting an entry
+    # keeps them, so a tag may cover an entry that was later stored again without it
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO pyc_0_tags (tag, key, at) VALUES (?, ?, ?)", [(tag, key, at) for tag in tags]
+            )
+
+    async def atag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        await self._run(self.tag, key, at, tags)
+
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        if not tags:
+            return
+        placeholders = ", ".join(["?"] * len(tags))
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                f"DELETE FROM pyc_0 WHERE (key, at) IN (SELECT key, at FROM pyc_0_tags WHERE tag IN ({placeholders}))",
+                tags,
+            )
+            connection.execute(f"DELETE FROM pyc_0_tags WHERE tag IN ({placeholders})", tags)
+
+    async def aevict_tags(self, tags: t.Sequence[str]) -> None:
+        await self._run(self.evict_tags, tags)
+
+    def flush(self) -> None:
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM pyc_0")
+            connection.execute("DELETE FROM pyc_0_tags")
+
+    async def aflush(self) -> None:
+        await self._run(self.flush)
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        connection, now = self._connection(), time.time()
+        found: t.Dict[t.Tuple[str, str], bytes] = {}
+        for i in range(0, len(items), self._BATCH_SIZE):
+            batch = items[i : i + self._BATCH_SIZE]
+            rows = connection.execute(
+                "SELECT key, at, value FROM pyc_0 WHERE (key, at) IN (VALUES "
+                + ", ".join(["(?, ?)"] * len(batch))
+                + ") AND (expires IS NULL OR expires > ?)",
+                [*(part for item in batch for part in item), now],
+            )
+            found.update(((key, at), value) for key, at, value in rows)
+
+        return [self._serde.deserialize(found[item]) if item in found else abc._EMPTY for item in items]
+
+    async def aget_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        return await self._run(self.get_many, items)
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        now = time.time()
+        rows = [
+            (key, at, self._serde.serialize(value), now + ttl if ttl is not None else None)
+            for key, at, value, ttl in items
+        ]
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("INSERT OR REPLACE INTO pyc_0 (key, at, value, expires) VALUES (?, ?, ?, ?)", rows)
+        self._wrote(connection, len(rows))
+
+    async def aput_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        await self._run(self.put_many, items)
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("DELETE FROM pyc_0 WHERE key = ? AND at = ?", items)
+            connection.executemany("DELETE FROM pyc_0_tags WHERE key = ? AND at = ?", items)
+
+    async def aevict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        await self._run(self.evict_many, items)
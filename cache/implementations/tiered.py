@@ -0,0 +1,250 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import asyncio
+import threading
+import typing as t
+import uuid
+
+import orjson
+
+from cache import abc
+from cache import eviction
+from cache.implementations import memory
+from cache.implementations import redis as redis_impl
+
+__all__ = ["TieredCacheImpl"]
+
+
+class TieredCacheImpl(abc.Cache):
+    # A bounded in-process L1 in front of redis. Every write, evict and flush is broadcast over
+    # redis pub/sub so that the L1 of every other process drops the affected entries. Messages can
+    # be missed while the subscriber is disconnected, so L1 entries are also capped at `l1_ttl`.
+    supports_tags = True
+
+    def __init__(
+        self,
+        l2: redis_impl.RedisCacheImpl,
+        max_entries: int = 10_000,
+        eviction_policy: t.Union[str, eviction.PolicyFactoryT] = "lru",
+        l1_ttl: t.Optional[int] = 60,
+        channel: t.Optional[str] = None,
+    ) -> None:
+        self._l1 = memory.InMemoryCacheImpl(max_entries, eviction_policy)
+        self._l2 = l2
+        self._l1_ttl = l1_ttl
+        self._channel = channel or f"pyc_{l2._VERSION}:invalidate"
+        self._origin = uuid.uuid4().hex
+
+        self._pubsub = l2._sync_connection().pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self._channel: self._on_message})
+        # The listener closes the pubsub itself once stopped, sleep_time bounds how long that takes
+        self._listener = self._pubsub.run_in_thread(sleep_time=0.25, daemon=True)
+
+    def _on_message(self, message: t.Dict[str, t.Any]) -> None:
+        origin, op, key, at = orjson.loads(message["data"])
+        if origin == self._origin:
+            return
+
+        if op == "evict":
+            self._l1.evict(key, at)
+        elif op == "evict_many":
+            self._l1.evict_many(key)
+        elif op == "evict_all":
+            self._l1.evict(key, at, all=True)
+        elif op == "flush":
+            self._l1.flush()
+
+    def _message(self, op: str, key: t.Any = None, at: t.Optional[str] = None) -> bytes:
+        return orjson.dumps([self._origin, op, key, at])
+
+    def _l1_put(self, key: str, at: str, value: t.Any, ttl: t.Optional[float]) -> None:
+        if ttl is None or (self._l1_ttl is not None and self._l1_ttl < ttl):
+            ttl = self._l1_ttl
+        if ttl is not None and ttl < 1:
+            # Rounding down would store it with a ttl of 0, an entry this close to expiry is left in L2
+            self._l1.evict(key, at)
+            return
+        # Round down so that the L1 copy never outlives the L2 entry
+        self._l1.put(key, at, value, int(ttl) if ttl is not None else None)
+
+    def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        self._l2.put(key, at, value, ttl)
+        self._l1_put(key, at, value, ttl)
+        self._l2._sync_connection().publish(self._channel, self._message("evict", key, at))
+
+    async def aput(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        await self._l2.aput(key, at, value, ttl)
+        self._l1_put(key, at, value, ttl)
+        await (await self._l2._async_connection()).publish(self._channel, self._message("evict", key, at))
+
+    def get(self, key: str, at: str) -> t.Any:
+        if (value := self._l1.get(key, at)) is not abc._EMPTY:
+            return value
+
+        value, ttl = self._l2.get_with_ttl(key, at)
+        if value is not abc._EMPTY:
+            self._l1_put(key, at, value, ttl)
+        return value
+
+    async def aget(self, key: str, at: str) -> t.Any:
+        if (value := self._l1.get(key, at)) is not abc._EMPTY:
+            return value
+
+        value, ttl = await self._l2.aget_with_ttl(key, at)
+        if value is not abc._EMPTY:
+            self._l1_put(key, at, value, ttl)
+        return value
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        values = self._l1.get_many(items)
+        if not (missing := [i for i, value in enumerate(values) if value is abc._EMPTY]):
+            return values
+
+        for i, (value, ttl) in zip(missing, self._l2.get_many_with_ttl([items[i] for i in missing])):
+            if value is not abc._EMPTY:
+                self._l1_put(*items[i], value, ttl)
+            values[i] = value
+        return values
+
+    async def aget_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        values = self._l1.get_many(items)
+        if not (missing := [i for i, value in enumerate(values) if value is abc._EMPTY]):
+            return values
+
+        for i, (value, ttl) in zip(missing, await self._l2.aget_many_with_ttl([items[i] for i in missing])):
+            if value is not abc._EMPTY:
+                self._l1_put(*items[i], value, ttl)
+            values[i] = value
+        return values
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        self._l2.put_many(items)
+        for key, at, value, ttl in items:
+            self._l1_put(key, at, value, ttl)
+        self._l2._sync_connection().publish(
+            self._channel, self._message("evict_many", [(key, at) for key, at, _, _ in items])
+        )
+
+    async def aput_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        await self._l2.aput_many(items)
+        for key, at, value, ttl in items:
+            self._l1_put(key, at, value, ttl)
+        await (await self._l2._async_connection()).publish(
+            self._channel, self._message("evict_many", [(key, at) for key, at, _, _ in items])
+        )
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        self._l2.evict_many(items)
+        self._l1.evict_many(items)
+        self._l2._sync_connection().publish(self._channel, self._message("evict_many", items))
+
+    async def aevict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        await self._l2.aevict_many(items)
+        self._l1.evict_many(items)
+        await (await self._l2._async_connection()).publish(self._channel, self._message("evict_many", items))
+
+    def evict(self, key: str, at: str, all: bool = False) -> None:
+        self._l2.evict(key, at, all)
+        self._l1.evict(key, at, all)
+        self._l2._sync_connection().publish(self._channel, self._message("evict_all" if all else "evict", key, at))
+
+    async def aevict(self, key: str, at: str, all: bool = False) -> None:
+        await self._l2.aevict(key, at, all)
+        self._l1.evict(key, at, all)
+        await (await self._l2._async_connection()).publish(
+            self._channel, self._message("evict_all" if all else "evict", key, at)
+        )
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        self._l2.tag(key, at, tags)
+        self._l1.tag(key, at, tags)
+
+    async def atag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        await self._l2.atag(key, at, tags)
+        self._l1.tag(key, at, tags)
+
+    def put_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        self._l2.put_tagged(key, at, value, ttl, tags)
+        self._l1_put(key, at, value, ttl)
+        self._l1.tag(key, at, tags)
+        self._l2._sync_connection().publish(self._channel, self._message("evict", key, at))
+
+    async def aput_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        await self._l2.aput_tagged(key, at, value, ttl, tags)
+        self._l1_put(key, at, value, ttl)
+        self._l1.tag(key, at, tags)
+        await (await self._l2._async_connection()).publish(self._channel, self._message("evict", key, at))
+
+    # Other processes' L1 copies were filled from L2 without their tags, so every entry removed from
+    # L2 is broadcast as a regular eviction
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        conn = self._l2._sync_connection()
+
+        def evicted(entries: t.List[t.Tuple[str, str]]) -> None:
+            self._l1.evict_many(entries)
+            conn.publish(self._channel, self._message("evict_many", entries))
+
+        self._l2.evict_tags(tags, evicted)
+        self._l1.evict_tags(tags)
+
+    async def aevict_tags(self, tags: t.Sequence[str]) -> None:
+        conn = await self._l2._async_connection()
+
+        async def evicted(entries: t.List[t.Tuple[str, str]]) -> None:
+            self._l1.evict_many(entries)
+            await conn.publish(self._channel, self._message("evict_many", entries))
+
+        await self._l2.aevict_tags(tags, evicted)
+        self._l1.evict_tags(tags)
+
+    def flush(self) -> None:
+        self._l2.flush()
+        self._l1.flush()
+        self._l2._sync_connection().publish(self._channel, self._message("flush"))
+
+    async def aflush(self) -> None:
+        await self._l2.aflush()
+        self._l1.flush()
+        await (await self._l2._async_connection()).publish(self._channel, self._message("flush"))
+
+    def lock(self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0) -> t.ContextManager[bool]:
+        return self._l2.lock(key, at, timeout, lease)
+
+    def alock(
+        self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0
+    ) -> t.AsyncContextManager[bool]:
+        return self._l2.alock(key, at, timeout, lease)
+
+    def _stop_listener(self) -> None:
+        self._listener.stop()
+        if self._listener is not threading.current_thread():
+            self._listener.join()
+
+    def close(self) -> None:
+        self._stop_listener()
+        self._l1.close()
+        self._l2.close()
+
+    async def aclose(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._stop_listener)
+        self._l1.close()
+        await self._l2.aclose()
@@ -0,0 +1,390 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import asyncio
+import atexit
+import collections
+import logging
+import math
+import threading
+import time
+import typing as t
+
+from cache import abc
+
+__all__ = ["WriteBehindCacheImpl"]
+
+OverflowT = t.Literal["block", "drop"]
+
+_LOGGER = logging.getLogger("cache")
+
+
+class _Pending:
+    __slots__ = ("value", "ttl", "tags", "queued_at")
+
+    def __init__(
+        self, value: t.Any, ttl: t.Optional[int], tags: t.Optional[t.FrozenSet[str]], queued_at: float
+    ) -> None:
+        self.value = value
+        self.ttl = ttl
+        self.tags = tags
+        self.queued_at = queued_at
+
+
+class WriteBehindCacheImpl(abc.Cache):
+    # Puts return as soon as they are queued and a background thread writes them to the wrapped cache
+    # in put_many batches. Queued entries are served from the pending map so callers always read their
+    # own writes, and a second put to a queued entry replaces it rather than queueing another write.
+    # Evictions, tag invalidation and flushes wait for any batch being written so that it can't land
+    # afterwards and bring back what was just removed.
+    def __init__(
+        self,
+        inner: abc.Cache,
+        max_pending: int = 10_000,
+        batch_size: int = 256,
+        overflow: OverflowT = "block",
+        block_timeout: t.Optional[float] = None,
+    ) -> None:
+        if overflow not in ("block", "drop"):
+            raise ValueError(f"Unknown overflow mode {overflow!r}. Expected 'block' or 'drop'")
+
+        self._inner = inner
+        self.supports_tags = inner.supports_tags
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        self._overflow = overflow
+        self._block_timeout = block_timeout
+
+        # Entries are identified by object so the writer can tell whether one was replaced mid-write
+        self._pending: t.Dict[t.Tuple[str, str], _Pending] = {}
+        # Items waiting to be picked up by the writer, each at most once. An item being written is in
+        # neither until a newer put queues it again.
+        self._queue: t.Deque[t.Tuple[str, str]] = collections.deque()
+        self._queued: t.Set[t.Tuple[str, str]] = set()
+        self._writing = False
+        # Batches taken and finished by the writer, so that waiters only wait for the batch in flight
+        self._started = 0
+        self._finished = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.expired = 0
+
+        self._writer = threading.Thread(target=self._run, name="pycaching-write-behind", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @property
+    def inner(self) -> abc.Cache:
+        return self._inner
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return
+
+                batch = []
+                while self._queue and len(batch) < self._batch_size:
+                    item = self._queue.popleft()
+                    self._queued.discard(item)
+                    if (entry := self._pending.get(item)) is not None:
+                        batch.append((item, entry))
+                self._writing = True
+                self._started += 1
+
+            self._write(batch)
+
+            with self._lock:
+                for item, entry in batch:
+                    if (current := self._pending.get(item)) is entry:
+                        del self._pending[item]
+                    elif current is not None and item not in self._queued:
+                        # Replaced while being written, the newer entry still needs writing
+                        self._queue.append(item)
+                        self._queued.add(item)
+                self._writing = False
+                self._finished += 1
+                self._not_full.notify_all()
+                self._idle.notify_all()
+
+    def _write(self, batch: t.List[t.Tuple[t.Tuple[str, str], _Pending]]) -> None:
+        # Time spent queued counts against the ttl, rounded up to whole seconds as the wrapped cache
+        # expects. Entries whose ttl ran out while queued aren't written, and any older value in the
+        # wrapped cache is evicted so that it doesn't reappear once the queued entry is gone.
+        now = time.monotonic()
+        expired: t.List[t.Tuple[str, str]] = []
+        items: t.List[t.Tuple[str, str, t.Any, t.Optional[int]]] = []
+        tagged: t.List[t.Tuple[str, str, t.Any, t.Optional[int], t.List[str]]] = []
+        for (key, at), entry in batch:
+            ttl = None
+            if entry.ttl is not None:
+                if (remaining := entry.ttl - (now - entry.queued_at)) <= 0:
+                    expired.append((key, at))
+                    continue
+                ttl = math.ceil(remaining)
+
+            if entry.tags:
+                tagged.append((key, at, entry.value, ttl, list(entry.tags)))
+            else:
+                items.append((key, at, entry.value, ttl))
+
+        try:
+            if expired:
+                self.expired += len(expired)
+                self._inner.evict_many(expired)
+            if items:
+                self._inner.put_many(items)
+            for item in tagged:
+                self._inner.put_tagged(*item)
+        except Exception:
+            self.failed += len(items) + len(tagged)
+            _LOGGER.exception("Write-behind of %d entries failed", len(items) + len(tagged))
+        else:
+            self.written += len(items) + len(tagged)
+
+    def _enqueue(self, key: str, at: str, entry: _Pending, block: bool) -> t.Optional[bool]:
+        # True once queued, False if the queue is full and block is False, None if the write was dropped
+        item = key, at
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind cache is closed")
+
+            if item not in self._pending:
+                if len(self._pending) >= self._max_pending:
+                    if self._overflow == "drop":
+                        self.dropped += 1
+                        return None
+                    if not block:
+                        return False
+                    if not self._not_full.wait_for(
+                        lambda: len(self._pending) < self._max_pending or self._closed, self._block_timeout
+                    ):
+                        self.dropped += 1
+                        return None
+                    if self._closed:
+                        raise RuntimeError("Write-behind cache is closed")
+
+            self._pending[item] = entry
+            if item not in self._queued:
+                self._queue.append(item)
+                self._queued.add(item)
+                self._not_empty.notify()
+            return True
+
+    def _settle(self, remove: t.Callable[[t.Tuple[str, str]], bool]) -> None:
+        # Drops matching queued entries and waits out the batch being written, which may contain them
+        with self._lock:
+            for item in [item for item in self._pending if remove(item)]:
+                del self._pending[item]
+            self._queue = collections.deque(item for item in self._queue if item in self._pending)
+            self._queued = set(self._queue)
+            # Later batches can't contain what was just removed, so don't wait for those
+            if self._writing:
+                started = self._started
+                self._idle.wait_for(lambda: self._finished >= started)
+            self._not_full.notify_all()
+
+    def drain(self, timeout: t.Optional[float] = None) -> bool:
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def close(self) -> None:
+        atexit.unregister(self.close)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._writer is not threading.current_thread():
+            self._writer.join()
+        self._inner.close()
+
+    async def aclose(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    # A dropped write still replaces what the caller wrote before, so the older value is evicted
+    # from the wrapped cache rather than being served again
+    def _put(self, key: str, at: str, entry: _Pending) -> None:
+        if self._enqueue(key, at, entry, True) is None:
+            self._inner.evict(key, at)
+
+    async def _aput(self, key: str, at: str, entry: _Pending) -> None:
+        if (queued := self._enqueue(key, at, entry, False)) is False:
+            # Apply backpressure without blocking the event loop
+            queued = await asyncio.get_running_loop().run_in_executor(None, self._enqueue, key, at, entry, True)
+        if queued is None:
+            await self._inner.aevict(key, at)
+
+    def put(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        self._put(key, at, _Pending(value, ttl, None, time.monotonic()))
+
+    async def aput(self, key: str, at: str, value: t.Any, ttl: t.Optional[int]) -> None:
+        await self._aput(key, at, _Pending(value, ttl, None, time.monotonic()))
+
+    def put_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        self._put(key, at, _Pending(value, ttl, frozenset(tags), time.monotonic()))
+
+    async def aput_tagged(self, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Sequence[str]) -> None:
+        await self._aput(key, at, _Pending(value, ttl, frozenset(tags), time.monotonic()))
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        now = time.monotonic()
+        dropped = [
+            (key, at)
+            for key, at, value, ttl in items
+            if self._enqueue(key, at, _Pending(value, ttl, None, now), True) is None
+        ]
+        if dropped:
+            self._inner.evict_many(dropped)
+
+    async def aput_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        for key, at, value, ttl in items:
+            await self.aput(key, at, value, ttl)
+
+    @staticmethod
+    def _value(entry: _Pending) -> t.Any:
+        # A queued entry that has already expired hides any older value in the wrapped cache
+        if entry.ttl is not None and time.monotonic() - entry.queued_at >= entry.ttl:
+            return abc._EMPTY
+        return entry.value
+
+    def get(self, key: str, at: str) -> t.Any:
+        if (entry := self._pending.get((key, at))) is not None:
+            return self._value(entry)
+        return self._inner.get(key, at)
+
+    async def aget(self, key: str, at: str) -> t.Any:
+        if (entry := self._pending.get((key, at))) is not None:
+            return self._value(entry)
+        return await self._inner.aget(key, at)
+
+    def _overlay(self, items: t.Sequence[t.Tuple[str, str]]) -> t.Tuple[t.List[t.Any], t.List[int]]:
+        values: t.List[t.Any] = []
+        missing: t.List[int] = []
+        for i, item in enumerate(items):
+            if (entry := self._pending.get(item)) is not None:
+                values.append(self._value(entry))
+            else:
+                values.append(abc._EMPTY)
+                missing.append(i)
+        return values, missing
+
+    def get_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        values, missing = self._overlay(items)
+        if missing:
+            for i, value in zip(missing, self._inner.get_many([items[i] for i in missing])):
+                values[i] = value
+        return values
+
+    async def aget_many(self, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+        values, missing = self._overlay(items)
+        if missing:
+            for i, value in zip(missing, await self._inner.aget_many([items[i] for i in missing])):
+                values[i] = value
+        return values
+
+    def _settle_evict(self, key: str, at: str, all: bool) -> None:
+        self._settle((lambda item: item[0] == key) if all else (lambda item: item == (key, at)))
+
+    def evict(self, key: str, at: str, all: bool = False) -> None:
+        self._settle_evict(key, at, all)
+        self._inner.evict(key, at, all)
+
+    async def aevict(self, key: str, at: str, all: bool = False) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._settle_evict, key, at, all)
+        await self._inner.aevict(key, at, all)
+
+    def evict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        removed = set(items)
+        self._settle(removed.__contains__)
+        self._inner.evict_many(items)
+
+    async def aevict_many(self, items: t.Sequence[t.Tuple[str, str]]) -> None:
+        removed = set(items)
+        await asyncio.get_running_loop().run_in_executor(None, self._settle, removed.__contains__)
+        await self._inner.aevict_many(items)
+
+    def _tag_pending(self, key: str, at: str, tags: t.Sequence[str]) -> bool:
+        with self._lock:
+            if (entry := self._pending.get((key, at))) is None:
+                return False
+            # Replacing the entry makes the writer requeue it if it is already being written
+            tagged = entry.tags.union(tags) if entry.tags is not None else frozenset(tags)
+            self._pending[(key, at)] = _Pending(entry.value, entry.ttl, tagged, entry.queued_at)
+            return True
+
+    def tag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        if not self._tag_pending(key, at, tags):
+            self._inner.tag(key, at, tags)
+
+    async def atag(self, key: str, at: str, tags: t.Sequence[str]) -> None:
+        if not self._tag_pending(key, at, tags):
+            await self._inner.atag(key, at, tags)
+
+    def _settle_tags(self, tags: t.Sequence[str]) -> None:
+        # Called with the lock held by _settle, so the pending map can be read directly
+        def tagged(item: t.Tuple[str, str]) -> bool:
+            entry_tags = self._pending[item].tags
+            return entry_tags is not None and not entry_tags.isdisjoint(tags)
+
+        self._settle(tagged)
+
+    def evict_tags(self, tags: t.Sequence[str]) -> None:
+        if not tags:
+            return
+        self._settle_tags(tags)
+        self._inner.evict_tags(tags)
+
+    async def aevict_tags(self, tags: t.Sequence[str]) -> None:
+        if not tags:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._settle_tags, tags)
+        await self._inner.aevict_tags(tags)
+
+    def flush(self) -> None:
+        self._settle(lambda item: True)
+        self._inner.flush()
+
+    async def aflush(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._settle, lambda item: True)
+        await self._inner.aflush()
+
+    def lock(self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0) -> t.ContextManager[bool]:
+        return self._inner.lock(key, at, timeout, lease)
+
+    def alock(
+        self, key: str, at: str, timeout: t.Optional[float] = None, lease: float = 30.0
+    ) -> t.AsyncContextManager[bool]:
+        return self._inner.alock(key, at, timeout, lease)
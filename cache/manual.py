@@ -19,34 +19,133 @@
 # SOFTWARE.
 import typing as t
 
-__all__ = ["put", "aput", "get", "aget", "evict", "aevict"]
+__all__ = [
+    "put",
+    "aput",
+    "get",
+    "aget",
+    "evict",
+    "aevict",
+    "flush",
+    "aflush",
+    "put_many",
+    "aput_many",
+    "get_many",
+    "aget_many",
+    "evict_many",
+    "aevict_many",
+    "evict_tags",
+    "aevict_tags",
+    "dump",
+    "load",
+]
+
+import time
 
 from cache import abc
 from cache import errors
+from cache import metrics
+from cache import scope
+
+
+def _check_tags(cache: abc.Cache) -> None:
+    # Checked before writing so that an untaggable backend doesn't store the value and then fail
+    if not cache.supports_tags:
+        raise errors.CacheConfigurationError(f"{type(cache).__name__} does not support tags")
+
 
+def _put(
+    cache: abc.Cache, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Optional[t.Sequence[str]]
+) -> None:
+    if tags:
+        _check_tags(cache)
+        cache.put_tagged(key, at, value, ttl, tags)
+    else:
+        cache.put(key, at, value, ttl)
 
-def put(key: str, at: str, value: t.Any, ttl: t.Optional[int] = None) -> None:
+
+def put(key: str, at: str, value: t.Any, ttl: t.Optional[int] = None, tags: t.Optional[t.Sequence[str]] = None) -> None:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
-    return cache.put(key, at, value, ttl)
+    if metrics.ENABLED:
+        start = time.perf_counter()
+        _put(cache, key, at, value, ttl, tags)
+        metrics.record_put(key, type(cache).__name__, time.perf_counter() - start)
+    else:
+        _put(cache, key, at, value, ttl, tags)
+
+    if (memo := scope.current()) is not None:
+        memo[(key, at)] = value
+
+
+async def _aput(
+    cache: abc.Cache, key: str, at: str, value: t.Any, ttl: t.Optional[int], tags: t.Optional[t.Sequence[str]]
+) -> None:
+    if tags:
+        _check_tags(cache)
+    store = cache.aput_tagged(key, at, value, ttl, tags) if tags else cache.aput(key, at, value, ttl)
+    if metrics.ENABLED:
+        start = time.perf_counter()
+        await store
+        metrics.record_put(key, type(cache).__name__, time.perf_counter() - start)
+    else:
+        await store
 
+    if (memo := scope.current()) is not None:
+        memo[(key, at)] = value
 
-def aput(key: str, at: str, value: t.Any, ttl: t.Optional[int] = None) -> t.Coroutine[None, None, None]:
+
+def aput(
+    key: str, at: str, value: t.Any, ttl: t.Optional[int] = None, tags: t.Optional[t.Sequence[str]] = None
+) -> t.Coroutine[None, None, None]:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
+    if metrics.ENABLED or tags or scope.current() is not None:
+        return _aput(cache, key, at, value, ttl, tags)
     return cache.aput(key, at, value, ttl)
 
 
 def get(key: str, at: str) -> t.Any:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
-    return cache.get(key, at)
+
+    # Values cached by a function with stale_ttl are returned without their envelope
+    memo = scope.current()
+    if memo is not None and (value := memo.get((key, at), abc._EMPTY)) is not abc._EMPTY:
+        return abc._unwrap_stale(value)
+
+    if metrics.ENABLED:
+        start = time.perf_counter()
+        value = cache.get(key, at)
+        metrics.record_get(key, type(cache).__name__, value is not abc._EMPTY, time.perf_counter() - start)
+    else:
+        value = cache.get(key, at)
+
+    if memo is not None and value is not abc._EMPTY:
+        memo[(key, at)] = value
+    return abc._unwrap_stale(value)
+
+
+async def _aget(cache: abc.Cache, key: str, at: str, memo: t.Optional[scope.MemoT]) -> t.Any:
+    if memo is not None and (value := memo.get((key, at), abc._EMPTY)) is not abc._EMPTY:
+        return abc._unwrap_stale(value)
+
+    if metrics.ENABLED:
+        start = time.perf_counter()
+        value = await cache.aget(key, at)
+        metrics.record_get(key, type(cache).__name__, value is not abc._EMPTY, time.perf_counter() - start)
+    else:
+        value = await cache.aget(key, at)
+
+    if memo is not None and value is not abc._EMPTY:
+        memo[(key, at)] = value
+    return abc._unwrap_stale(value)
 
 
 def aget(key: str, at: str) -> t.Coroutine[None, None, t.Any]:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
-    return cache.aget(key, at)
+    return _aget(cache, key, at, scope.current())
 
 
 @t.overload
@@ -62,6 +161,9 @@ def evict(key: str, *, all: t.Literal[True]) -> None:
 def evict(key: str, at: t.Optional[str] = None, *, all: bool = False):
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
+    if metrics.ENABLED:
+        metrics.record_evict(key, type(cache).__name__)
+    scope.forget(key, at, all)
     return cache.evict(key, at, all)
 
 
@@ -78,16 +180,95 @@ def aevict(key: str, *, all: t.Literal[True]) -> t.Coroutine[None, None, None]:
 def aevict(key: str, at: str, *, all: bool = False) -> t.Coroutine[None, None, None]:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
+    if metrics.ENABLED:
+        metrics.record_evict(key, type(cache).__name__)
+    scope.forget(key, at, all)
     return cache.aevict(key, at, all)
 
 
 def flush() -> None:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.clear()
     return cache.flush()
 
 
 def aflush() -> t.Coroutine[None, None, None]:
     if (cache := abc.Cache.get_instance()) is None:
         raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.clear()
     return cache.aflush()
+
+
+def put_many(items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.forget_many((key, at) for key, at, _, _ in items)
+    return cache.put_many(items)
+
+
+def aput_many(items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> t.Coroutine[None, None, None]:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.forget_many((key, at) for key, at, _, _ in items)
+    return cache.aput_many(items)
+
+
+def get_many(items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    return [abc._unwrap_stale(value) for value in cache.get_many(items)]
+
+
+async def _aget_many(cache: abc.Cache, items: t.Sequence[t.Tuple[str, str]]) -> t.List[t.Any]:
+    return [abc._unwrap_stale(value) for value in await cache.aget_many(items)]
+
+
+def aget_many(items: t.Sequence[t.Tuple[str, str]]) -> t.Coroutine[None, None, t.List[t.Any]]:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    return _aget_many(cache, items)
+
+
+def evict_many(items: t.Sequence[t.Tuple[str, str]]) -> None:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.forget_many(items)
+    return cache.evict_many(items)
+
+
+def aevict_many(items: t.Sequence[t.Tuple[str, str]]) -> t.Coroutine[None, None, None]:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.forget_many(items)
+    return cache.aevict_many(items)
+
+
+def evict_tags(tags: t.Sequence[str]) -> None:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.clear()
+    return cache.evict_tags(tags)
+
+
+def aevict_tags(tags: t.Sequence[str]) -> t.Coroutine[None, None, None]:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    scope.clear()
+    return cache.aevict_tags(tags)
+
+
+def dump(path: str) -> int:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    if (dump := getattr(cache, "dump", None)) is None:
+        raise NotImplementedError(f"{type(cache).__name__} does not support snapshots")
+    return dump(path)
+
+
+def load(path: str, timeout: t.Optional[float] = None) -> int:
+    if (cache := abc.Cache.get_instance()) is None:
+        raise errors.CacheNotSetUpError("Cache has not been initialised")
+    if (load := getattr(cache, "load", None)) is None:
+        raise NotImplementedError(f"{type(cache).__name__} does not support snapshots")
+    return load(path, timeout)
@@ -0,0 +1,197 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import bisect
+import threading
+import typing as t
+
+__all__ = ["enable", "disable", "enabled", "stats", "reset", "add_hook", "remove_hook", "to_prometheus"]
+
+LabelsT = t.Tuple[t.Tuple[str, str], ...]
+HookT = t.Callable[[str, t.Dict[str, str], float], None]
+
+# Checked by every instrumented call site before doing any work, so disabled metrics cost a
+# single global lookup.
+ENABLED = False
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_DESCRIPTIONS = {
+    "cache_hits_total": ("counter", "Lookups that found a cached value"),
+    "cache_misses_total": ("counter", "Lookups that found no cached value"),
+    "cache_puts_total": ("counter", "Values written to the cache"),
+    "cache_evictions_total": ("counter", "Explicit evictions"),
+    "cache_get_seconds": ("histogram", "Backend get latency"),
+    "cache_put_seconds": ("histogram", "Backend put latency"),
+    "serde_serialize_seconds": ("histogram", "Time spent serializing values"),
+    "serde_deserialize_seconds": ("histogram", "Time spent deserializing values"),
+    "serde_payload_bytes": ("histogram", "Size of serialized payloads"),
+}
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: t.Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        if (i := bisect.bisect_left(self.buckets, value)) < len(self.buckets):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_counters: t.Dict[t.Tuple[str, LabelsT], int] = {}
+_histograms: t.Dict[t.Tuple[str, LabelsT], _Histogram] = {}
+_hooks: t.List[HookT] = []
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+def enabled() -> bool:
+    return ENABLED
+
+
+def add_hook(hook: HookT) -> None:
+    _hooks.append(hook)
+
+
+def remove_hook(hook: HookT) -> None:
+    _hooks.remove(hook)
+
+
+def _emit(name: str, labels: LabelsT, value: float) -> None:
+    for hook in _hooks:
+        try:
+            hook(name, dict(labels), value)
+        except Exception:
+            # logging is only imported on failure, it's one of the slower stdlib modules to load
+            import logging
+
+            logging.getLogger("cache").exception("Metrics hook %r failed", hook)
+
+
+def incr(name: str, labels: LabelsT, amount: int = 1) -> None:
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + amount
+    if _hooks:
+        _emit(name, labels, amount)
+
+
+def observe(name: str, labels: LabelsT, value: float, buckets: t.Sequence[float] = BUCKETS) -> None:
+    with _lock:
+        if (histogram := _histograms.get((name, labels))) is None:
+            histogram = _histograms[(name, labels)] = _Histogram(buckets)
+        histogram.observe(value)
+    if _hooks:
+        _emit(name, labels, value)
+
+
+def record_get(key: str, backend: str, hit: bool, seconds: float) -> None:
+    labels = (("backend", backend), ("key", key))
+    incr("cache_hits_total" if hit else "cache_misses_total", labels)
+    observe("cache_get_seconds", labels, seconds)
+
+
+def record_put(key: str, backend: str, seconds: float) -> None:
+    labels = (("backend", backend), ("key", key))
+    incr("cache_puts_total", labels)
+    observe("cache_put_seconds", labels, seconds)
+
+
+def record_evict(key: str, backend: str) -> None:
+    incr("cache_evictions_total", (("backend", backend), ("key", key)))
+
+
+def record_serde(operation: str, format: str, seconds: float, size: int) -> None:
+    labels = (("format", format),)
+    observe(f"serde_{operation}_seconds", labels, seconds)
+    observe("serde_payload_bytes", labels + (("operation", operation),), size, SIZE_BUCKETS)
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def stats() -> t.Dict[str, t.List[t.Dict[str, t.Any]]]:
+    out: t.Dict[str, t.List[t.Dict[str, t.Any]]] = {}
+    with _lock:
+        for (name, labels), value in _counters.items():
+            out.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), histogram in _histograms.items():
+            out.setdefault(name, []).append(
+                {
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": dict(zip(histogram.buckets, histogram.counts)),
+                }
+            )
+    return out
+
+
+def _escape(value: t.Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: t.Dict[str, t.Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def to_prometheus(prefix: str = "pycaching_") -> str:
+    lines: t.List[str] = []
+    for name, samples in sorted(stats().items()):
+        kind, description = _DESCRIPTIONS.get(name, ("untyped", name))
+        lines.append(f"# HELP {prefix}{name} {description}")
+        lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        for sample in samples:
+            labels = sample["labels"]
+            if "value" in sample:
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {sample['value']}")
+                continue
+
+            cumulative = 0
+            for bound, count in sample["buckets"].items():
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{prefix}{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {sample['count']}")
+            lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {sample['sum']}")
+            lines.append(f"{prefix}{name}_count{_format_labels(labels)} {sample['count']}")
+    return "\n".join(lines) + "\n"
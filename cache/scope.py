@@ -0,0 +1,126 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import typing as t
+
+__all__ = ["request_scope", "ASGIMiddleware", "WSGIMiddleware"]
+
+MemoT = t.Dict[t.Tuple[str, str], t.Any]
+
+# Values looked up or stored during the current scope, None outside of one. Tasks and threads
+# started from inside a scope copy the context and so share the memo of the request that started
+# them, while concurrent requests each set their own.
+_memo: contextvars.ContextVar[t.Optional[MemoT]] = contextvars.ContextVar("pycaching_memo", default=None)
+
+
+def current() -> t.Optional[MemoT]:
+    return _memo.get()
+
+
+@contextlib.contextmanager
+def request_scope() -> t.Iterator[None]:
+    # Memoizes cache lookups until the block exits. Every lookup of an entry returns the same object,
+    # so values must not be mutated in place. Nested scopes share the outermost memo.
+    if _memo.get() is not None:
+        yield
+        return
+
+    token = _memo.set({})
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+def forget(key: str, at: t.Optional[str], all: bool = False) -> None:
+    if (memo := _memo.get()) is None:
+        return
+
+    if all:
+        for item in [item for item in memo if item[0] == key]:
+            del memo[item]
+    else:
+        memo.pop((key, t.cast(str, at)), None)
+
+
+def forget_many(items: t.Iterable[t.Tuple[str, str]]) -> None:
+    if (memo := _memo.get()) is None:
+        return
+
+    for key, at in items:
+        memo.pop((key, at), None)
+
+
+def clear() -> None:
+    if (memo := _memo.get()) is not None:
+        memo.clear()
+
+
+class ASGIMiddleware:
+    __slots__ = ("app",)
+
+    def __init__(self, app: t.Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: t.Dict[str, t.Any], receive: t.Any, send: t.Any) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        with request_scope():
+            await self.app(scope, receive, send)
+
+
+class _ScopedBody:
+    __slots__ = ("_context", "_body", "_iterator")
+
+    def __init__(self, context: contextvars.Context, body: t.Iterable[bytes]) -> None:
+        self._context = context
+        self._body = body
+        self._iterator: t.Optional[t.Iterator[bytes]] = None
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        return self
+
+    def __next__(self) -> bytes:
+        if self._iterator is None:
+            self._iterator = self._context.run(iter, self._body)
+        return self._context.run(next, self._iterator)
+
+    def close(self) -> None:
+        if (close := getattr(self._body, "close", None)) is not None:
+            self._context.run(close)
+
+
+class WSGIMiddleware:
+    # Response bodies are often generators that only run once the server iterates them, after the app
+    # has returned, so the whole request including iteration runs in its own copy of the context
+    __slots__ = ("app",)
+
+    def __init__(self, app: t.Any) -> None:
+        self.app = app
+
+    def __call__(self, environ: t.Dict[str, t.Any], start_response: t.Any) -> t.Iterable[bytes]:
+        context = contextvars.copy_context()
+        if context.run(_memo.get) is None:
+            context.run(_memo.set, {})
+        return _ScopedBody(context, context.run(self.app, environ, start_response))
@@ -18,24 +18,160 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import binascii
+import lzma
 import pickle
+import struct
+import time
 import typing as t
+import zlib
 
 import orjson
 
 from cache import abc
+from cache import metrics
 
-__all__ = ["Serde"]
+__all__ = ["Serde", "Codec", "register_codec"]
+
+FormatT = t.Literal["json", "binary"]
 
 
 VERSION = "0"
 
+# Payloads containing custom or pickled objects are written as MARKED + JSON list of paths to each
+# marker object + b"\n" + the JSON body, so that reads only need to visit those paths. Anything else
+# is plain JSON and is returned straight from orjson.loads. orjson never emits a raw newline, so the
+# first one always terminates the path list.
+#
+# The paths are found by walking the original object in Python and matching the objects orjson passed
+# to `default` by identity, which is paid once per write instead of on every read. The walk stops at
+# the last marker, so its cost grows with how far into the payload that marker sits: a custom object
+# at the end of 10k records makes serializing several times slower than plain JSON, one at the start
+# costs almost nothing (see the serde benchmarks). Large payloads holding custom objects are better
+# stored with the binary format.
+_MARKED = b"\x01"
+_LEGACY_MARKER = b'"_cls":'
+
+# Binary payloads are BINARY + format version + u32 buffer count + u64 pickle length + one u64 length
+# per out-of-band buffer, followed by the pickle stream and then the raw buffers back to back. Buffers
+# are handed to pickle.loads as memoryview slices of the payload so large arrays are never copied.
+_BINARY = b"\x02"
+BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct("<BIQ")
+_BUFFER_LENGTH = struct.Struct("<Q")
+
+# Compressed payloads are COMPRESSED + codec id + the codec's output for any of the other formats
+_COMPRESSED = b"\x03"
+
+_MARKER_FIELDS = frozenset(("raw", "_cls", "ver", "type"))
+
+PathT = t.List[t.Union[str, int]]
+
+# Values that orjson writes as JSON scalars and so can never hold a marker. Subclasses are left to
+# _find_marked since orjson hands some of them, such as float subclasses, to `default`.
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+class _Unmapped(Exception):
+    # Raised when the original object holds a type whose JSON structure can't be predicted
+    __slots__ = ()
+
+
+def _is_marker(item: t.Dict[str, t.Any]) -> bool:
+    return "_cls" in item and _MARKER_FIELDS.issubset(item)
+
+
+# Both walks return True once `expected` markers have been found, which ends them early. Objects
+# nested inside another marker's raw value are never found, in which case everything is walked.
+def _find_marked(item: t.Any, marked: t.Set[int], path: PathT, paths: t.List[PathT], expected: int) -> bool:
+    if id(item) in marked:
+        paths.append(path.copy())
+        return len(paths) == expected
+
+    if isinstance(item, dict):
+        entries: t.Iterable[t.Tuple[t.Union[str, int], t.Any]] = item.items()
+    elif isinstance(item, list) or type(item) is tuple:
+        entries = enumerate(item)
+    elif isinstance(item, (str, int)):
+        return False
+    else:
+        # Dataclasses and the like are written as objects, but their fields aren't worth mirroring here
+        raise _Unmapped
+
+    for key, value in entries:
+        if type(value) not in _SCALARS:
+            path.append(key)
+            if _find_marked(value, marked, path, paths, expected):
+                return True
+            path.pop()
+    return False
+
+
+def _find_markers(item: t.Any, path: PathT, paths: t.List[PathT], expected: int) -> bool:
+    if isinstance(item, dict):
+        if _is_marker(item):
+            paths.append(path.copy())
+            return len(paths) == expected
+
+        for key, value in item.items():
+            if isinstance(value, (list, dict)):
+                path.append(key)
+                if _find_markers(value, path, paths, expected):
+                    return True
+                path.pop()
+        return False
+
+    for i, element in enumerate(item):
+        if isinstance(element, (list, dict)):
+            path.append(i)
+            if _find_markers(element, path, paths, expected):
+                return True
+            path.pop()
+    return False
+
+
+class Codec:
+    __slots__ = ("name", "id", "compress", "decompress")
+
+    def __init__(
+        self, name: str, id: int, compress: t.Callable[[bytes], bytes], decompress: t.Callable[[bytes], bytes]
+    ) -> None:
+        self.name = name
+        self.id = id
+        self.compress = compress
+        self.decompress = decompress
+
+
+_codecs: t.Dict[str, Codec] = {}
+_codecs_by_id: t.Dict[int, Codec] = {}
+
+
+def register_codec(codec: Codec) -> Codec:
+    if not 0 < codec.id < 256:
+        raise ValueError("Codec ids must fit in a single byte and 0 is reserved")
+    if (existing := _codecs_by_id.get(codec.id)) is not None and existing.name != codec.name:
+        raise ValueError(f"Codec id {codec.id} is already registered to {existing.name!r}")
+
+    _codecs[codec.name] = _codecs_by_id[codec.id] = codec
+    return codec
+
+
+register_codec(Codec("zlib", 1, zlib.compress, zlib.decompress))
+register_codec(Codec("lzma", 2, lzma.compress, lzma.decompress))
+
 
 class Serde:
-    __slots__ = ("_class_cache",)
+    __slots__ = ("_class_cache", "_format", "_codec", "_compress_threshold")
+
+    def __init__(self, format: FormatT = "json", codec: t.Optional[str] = None, compress_threshold: int = 1024) -> None:
+        if format not in ("json", "binary"):
+            raise ValueError(f"Unknown serde format {format!r}. Expected 'json' or 'binary'")
+        if codec is not None and codec not in _codecs:
+            raise ValueError(f"Unknown codec {codec!r}. Expected one of {', '.join(_codecs)}")
 
-    def __init__(self) -> None:
         self._class_cache: t.Dict[str, t.Type[abc.Serializable]] = {}
+        self._format = format
+        self._codec = _codecs[codec] if codec is not None else None
+        self._compress_threshold = compress_threshold
 
     def get_cls_name(self, obj: abc.Serializable) -> str:
         name = obj.__class__.__module__ + "." + obj.__class__.__name__
@@ -52,27 +188,113 @@ class Serde:
             }
         return {"raw": obj.to_json(), "_cls": self.get_cls_name(obj), "ver": VERSION, "type": "json"}
 
+    def serialize_binary(self, obj: t.Any) -> bytes:
+        buffers: t.List[memoryview] = []
+
+        def buffer_callback(buffer: pickle.PickleBuffer) -> bool:
+            try:
+                buffers.append(buffer.raw())
+            except BufferError:
+                # Non-contiguous buffers can't be sent out-of-band, have pickle copy them in-band instead
+                return True
+            return False
+
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+        return b"".join(
+            [
+                _BINARY,
+                _BINARY_HEADER.pack(BINARY_VERSION, len(buffers), len(data)),
+                *(_BUFFER_LENGTH.pack(buffer.nbytes) for buffer in buffers),
+                data,
+                *buffers,
+            ]
+        )
+
+    def deserialize_binary(self, raw: bytes) -> t.Any:
+        view = memoryview(raw)
+        version, n_buffers, data_length = _BINARY_HEADER.unpack_from(view, 1)
+        if version != BINARY_VERSION:
+            raise TypeError(f"Serde binary version mismatch. Expected {BINARY_VERSION!r}, actual {version!r}")
+
+        offset = 1 + _BINARY_HEADER.size
+        lengths = [_BUFFER_LENGTH.unpack_from(view, offset + i * _BUFFER_LENGTH.size)[0] for i in range(n_buffers)]
+        offset += n_buffers * _BUFFER_LENGTH.size
+
+        data = view[offset : offset + data_length]
+        offset += data_length
+
+        buffers = []
+        for length in lengths:
+            buffers.append(view[offset : offset + length])
+            offset += length
+
+        return pickle.loads(data, buffers=buffers)
+
+    def compress(self, raw: bytes) -> bytes:
+        if self._codec is None or len(raw) < self._compress_threshold:
+            return raw
+
+        compressed = self._codec.compress(raw)
+        # Incompressible payloads are stored as-is rather than paying for decompression on every read
+        if len(compressed) + 2 >= len(raw):
+            return raw
+        return _COMPRESSED + bytes((self._codec.id,)) + compressed
+
     def serialize(self, obj: t.Any) -> bytes:
-        return orjson.dumps(obj, default=self.serialize_default)
+        if metrics.ENABLED:
+            start = time.perf_counter()
+            raw = self.compress(self._serialize(obj))
+            metrics.record_serde("serialize", self._format, time.perf_counter() - start, len(raw))
+            return raw
+
+        if self._codec is not None:
+            return self.compress(self._serialize(obj))
+        return self._serialize(obj)
+
+    def _serialize(self, obj: t.Any) -> bytes:
+        if self._format == "binary":
+            return self.serialize_binary(obj)
+
+        # Holding on to every object passed to default keeps their ids unique until the walk is done
+        marked: t.List[t.Any] = []
+
+        def default(o: t.Any) -> t.Dict[str, t.Any]:
+            marked.append(o)
+            return self.serialize_default(o)
+
+        raw = orjson.dumps(obj, default=default)
+        if not marked:
+            return raw
+
+        paths: t.List[PathT] = []
+        try:
+            _find_marked(obj, {id(o) for o in marked}, [], paths, len(marked))
+        except _Unmapped:
+            paths.clear()
+            _find_markers(orjson.loads(raw), [], paths, len(marked))
+        return _MARKED + orjson.dumps(paths) + b"\n" + raw
+
+    def deserialize_marker(self, item: t.Dict[str, t.Any]) -> t.Any:
+        if item["ver"] != VERSION:
+            raise TypeError(f"Serde version mismatch. Expected {VERSION!r}, actual {item['ver']!r}")
+
+        if item["type"] == "pickle":
+            return pickle.loads(binascii.a2b_base64(item["raw"]))
+
+        if (cls := item["_cls"]) not in self._class_cache:
+            return abc._EMPTY
+
+        return self._class_cache[cls].from_json(item["raw"])
 
     def deserialize_collection(self, item: t.Union[t.List[t.Any], t.Dict[str, t.Any]]) -> t.Any:
         if isinstance(item, dict):
-            if "_cls" not in item:
+            if not _is_marker(item):
                 new_dict = {}
                 for key, value in item.items():
                     new_dict[key] = self.deserialize_collection(value) if isinstance(value, (list, dict)) else value
                 return new_dict
 
-            if item["ver"] != VERSION:
-                raise TypeError(f"Serde version mismatch. Expected {VERSION!r}, actual {item['ver']!r}")
-
-            if item["type"] == "pickle":
-                return pickle.loads(binascii.a2b_base64(item["raw"]))
-
-            if (cls := item["_cls"]) not in self._class_cache:
-                return abc._EMPTY
-
-            return self._class_cache[cls].from_json(item["raw"])
+            return self.deserialize_marker(item)
 
         new_list = []
         for element in item:
@@ -80,14 +302,47 @@ class Serde:
         return new_list
 
     def deserialize(self, raw: bytes) -> t.Any:
+        if metrics.ENABLED:
+            start = time.perf_counter()
+            value = self._deserialize(raw)
+            metrics.record_serde("deserialize", self._format, time.perf_counter() - start, len(raw))
+            return value
+        return self._deserialize(raw)
+
+    def _deserialize(self, raw: bytes) -> t.Any:
+        # Every format is always readable, regardless of which one this instance writes
+        if raw[:1] == _COMPRESSED:
+            if (codec := _codecs_by_id.get(raw[1])) is None:
+                raise TypeError(f"Payload was compressed with unknown codec id {raw[1]}")
+            return self._deserialize(codec.decompress(memoryview(raw)[2:]))
+
+        if raw[:1] == _BINARY:
+            return self.deserialize_binary(raw)
+
+        if raw[:1] == _MARKED:
+            view, end = memoryview(raw), raw.index(b"\n")
+            paths, data = orjson.loads(view[1:end]), orjson.loads(view[end + 1 :])
+
+            for path in paths:
+                if not path:
+                    return self.deserialize_marker(data)
+
+                parent = data
+                for part in path[:-1]:
+                    parent = parent[part]
+                parent[path[-1]] = self.deserialize_marker(parent[path[-1]])
+            return data
+
         json = orjson.loads(raw)
 
-        if isinstance(json, (list, dict)):
+        # Payloads written before the marked envelope existed embed markers without listing them
+        if isinstance(json, (list, dict)) and _LEGACY_MARKER in raw:
             return self.deserialize_collection(json)
 
         return json
 
 
 default_serde = Serde()
+binary_serde = Serde("binary")
 serialize = default_serde.serialize
 deserialize = default_serde.deserialize
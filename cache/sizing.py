@@ -0,0 +1,81 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import annotations
+
+import sys
+import typing as t
+
+__all__ = ["deep_getsizeof", "serialized_size", "SIZERS", "create_sizer"]
+
+SizerT = t.Callable[[t.Any], int]
+
+# Shared, immortal objects that shouldn't be charged to every entry that references them
+_SKIP = (type, type(None), bool)
+
+
+def deep_getsizeof(obj: t.Any) -> int:
+    # Approximate retained size: sys.getsizeof summed over the object graph reachable through
+    # containers, instance __dict__s and __slots__, counting each object once
+    seen: t.Set[int] = set()
+    stack, total = [obj], 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SKIP):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+
+        if isinstance(item, (str, bytes, bytearray, int, float, complex)):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            if (attributes := getattr(item, "__dict__", None)) is not None:
+                stack.append(attributes)
+            for cls in type(item).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    if slot not in ("__dict__", "__weakref__") and (value := getattr(item, slot, None)) is not None:
+                        stack.append(value)
+    return total
+
+
+def serialized_size(obj: t.Any) -> int:
+    from cache import serde
+
+    return len(serde.binary_serde.serialize(obj))
+
+
+SIZERS: t.Dict[str, SizerT] = {
+    "getsizeof": sys.getsizeof,
+    "deep": deep_getsizeof,
+    "serialized": serialized_size,
+}
+
+
+def create_sizer(sizer: t.Union[str, SizerT]) -> SizerT:
+    if isinstance(sizer, str):
+        if (func := SIZERS.get(sizer.lower())) is None:
+            raise ValueError(f"Unknown sizer {sizer!r}. Expected one of {', '.join(SIZERS)}")
+        return func
+    return sizer
@@ -0,0 +1,356 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import inspect
+import os
+import threading
+import time
+import typing as t
+
+import pytest
+
+import cache
+from cache import abc
+from cache import cacheable
+from cache import manual
+from cache.implementations import memory
+from cache.implementations import shm
+from cache.implementations import write_behind
+
+
+@pytest.fixture(autouse=True)
+def reset_instance() -> t.Iterator[None]:
+    yield
+    abc.Cache._instance = None
+
+
+@pytest.fixture()
+def segment(tmp_path: t.Any) -> t.Iterator[shm.SharedMemoryCacheImpl]:
+    instance = shm.SharedMemoryCacheImpl(f"test-{os.getpid()}", size="1MB", directory=str(tmp_path))
+    yield instance
+    instance.close()
+    instance.unlink()
+
+
+def test_tags_on_an_untaggable_backend_fail_before_computing(segment: shm.SharedMemoryCacheImpl) -> None:
+    calls = []
+
+    @cache.enable("k", "a", tags="t")
+    def func() -> int:
+        calls.append(1)
+        return 1
+
+    abc.Cache.set_instance(segment)
+    with pytest.raises(cache.CacheConfigurationError):
+        func()
+    assert calls == []
+
+    # Decorating once the backend is known fails straight away
+    with pytest.raises(cache.CacheConfigurationError):
+        cache.enable("k", "a", tags="t")(lambda: 1)
+
+
+def test_manual_tags_on_an_untaggable_backend_store_nothing(segment: shm.SharedMemoryCacheImpl) -> None:
+    abc.Cache.set_instance(segment)
+    with pytest.raises(cache.CacheConfigurationError):
+        manual.put("k", "a", 1, tags=["t"])
+    assert segment.get("k", "a") is abc._EMPTY
+
+
+def test_wrappers_report_their_inner_backend(segment: shm.SharedMemoryCacheImpl) -> None:
+    assert memory.InMemoryCacheImpl().supports_tags
+    wrapped = write_behind.WriteBehindCacheImpl(segment)
+    assert not wrapped.supports_tags
+    wrapped.close()
+
+
+def test_stale_mode_leaves_plain_lists_alone() -> None:
+    backend = abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    backend.put("k", "a", [1, 2, 3], None)
+
+    @cache.enable("k", "a", ttl=60, stale_ttl=60)
+    def func() -> t.List[int]:
+        return [4, 5, 6]
+
+    assert func() == [1, 2, 3]
+
+
+def test_manual_reads_unwrap_stale_entries() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+
+    @cache.enable("k", "a", ttl=60, stale_ttl=60)
+    def func() -> t.List[int]:
+        return [4, 5, 6]
+
+    assert func() == [4, 5, 6]
+    assert manual.get("k", "a") == [4, 5, 6]
+    assert manual.get_many([("k", "a")]) == [[4, 5, 6]]
+    assert asyncio.run(manual.aget("k", "a")) == [4, 5, 6]
+    assert asyncio.run(manual.aget_many([("k", "a")])) == [[4, 5, 6]]
+
+    # Turning stale mode off again still reads the enveloped entry
+    @cache.enable("k", "a", ttl=60)
+    def plain() -> t.List[int]:
+        return [7]
+
+    assert plain() == [4, 5, 6]
+
+
+def _argument_order(func: t.Callable[..., t.Any]) -> t.Dict[str, t.Tuple[t.Any, t.Any]]:
+    return {name: (param.default, param.kind) for name, param in inspect.signature(func).parameters.items()}
+
+
+def test_binder_mixes_positional_and_keyword_arguments() -> None:
+    def func(a: int, b: int, c: int = 3) -> None:
+        ...
+
+    bind = cacheable.compile_binder(_argument_order(func))
+    assert bind((1, 2), {}) == {"a": 1, "b": 2, "c": 3}
+    # The old binder checked the original args rather than what was left of them, so this raised
+    assert bind((1,), {"b": 2}) == {"a": 1, "b": 2, "c": 3}
+    assert bind((), {"a": 1, "b": 2, "c": 4}) == {"a": 1, "b": 2, "c": 4}
+
+
+def test_binder_collects_variadic_and_keyword_only_arguments() -> None:
+    def func(a: int, *args: int, b: int, c: int = 3, **kwargs: int) -> None:
+        ...
+
+    bind = cacheable.compile_binder(_argument_order(func))
+    assert bind((1, 2, 3), {"b": 4, "d": 5}) == {"a": 1, "args": [2, 3], "b": 4, "c": 3, "kwargs": {"d": 5}}
+    empty = inspect.Parameter.empty
+    assert bind((), {"a": 1, "b": 2}) == {"a": 1, "args": empty, "b": 2, "c": 3, "kwargs": empty}
+
+
+def test_expression_keys_use_bound_arguments() -> None:
+    backend = abc.Cache.set_instance(memory.InMemoryCacheImpl())
+
+    @cache.enable(cache.Ex("str(a)"), cache.Ex("str(b)"), ttl=cache.Ex("c"))
+    def func(a: int, b: int, c: int = 60) -> int:
+        return a + b
+
+    assert func(1, b=2) == 3
+    assert func(1, b=2, c=5) == 3
+    assert backend.get("1", "2") == 3
+    assert func(3, 4) == 7
+    assert backend.get("3", "4") == 7
+
+
+def test_constant_keys_still_pass_arguments_through() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+
+    @cache.enable("k", "a")
+    def func(a: int, *, b: int) -> int:
+        return a + b
+
+    assert func(1, b=2) == 3
+    # A constant key maps every call to the same entry
+    assert func(5, b=5) == 3
+
+
+def test_coalesced_threads_share_one_computation() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    entered, release, calls = threading.Event(), threading.Event(), []
+
+    @cache.enable("k", "a", coalesce=True)
+    def func() -> int:
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return 42
+
+    results: t.List[int] = []
+    threads = [threading.Thread(target=lambda: results.append(func())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert entered.wait(5)
+    # Threads that miss after this point find the value cached instead
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [42] * 8
+
+
+def test_coalesced_threads_share_the_error() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    entered, release, calls = threading.Event(), threading.Event(), []
+
+    @cache.enable("k", "a", coalesce=True)
+    def func() -> int:
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    errors: t.List[BaseException] = []
+
+    def call() -> None:
+        try:
+            func()
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    assert entered.wait(5)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+    assert calls == [1]
+    # Nothing was cached, so the next call computes again
+    with pytest.raises(ValueError):
+        func()
+    assert calls == [1, 1]
+
+
+def test_coalesced_tasks_share_one_computation() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    calls = []
+
+    @cache.enable("k", "a", coalesce=True)
+    async def func() -> int:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def main() -> t.List[int]:
+        return await asyncio.gather(*(func() for _ in range(10)))
+
+    assert asyncio.run(main()) == [42] * 10
+    assert calls == [1]
+
+
+def test_cancelled_leader_hands_over_to_a_follower() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    calls = []
+
+    @cache.enable("k", "a", coalesce=True)
+    async def func() -> int:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def main() -> int:
+        leader = asyncio.ensure_future(func())
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(func())
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == 42
+    assert calls == [1, 1]
+
+
+def _wait_for(condition: t.Callable[[], bool]) -> None:
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture()
+def clock(monkeypatch: pytest.MonkeyPatch) -> t.List[float]:
+    # Freshness is tracked in wall clock time, the memory backend's own expiry isn't affected
+    offset, real = [0.0], time.time
+    monkeypatch.setattr(cacheable.time, "time", lambda: real() + offset[0])
+    return offset
+
+
+def test_stale_values_are_served_while_one_refresh_runs(clock: t.List[float]) -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    release, calls = threading.Event(), []
+
+    @cache.enable("k", "a", ttl=10, stale_ttl=60)
+    def func() -> int:
+        calls.append(1)
+        if len(calls) > 1:
+            release.wait(5)
+        return len(calls)
+
+    assert func() == 1
+    clock[0] = 20
+    # Stale, so the old value comes straight back and a single refresh is started
+    assert [func() for _ in range(5)] == [1] * 5
+    release.set()
+    _wait_for(lambda: func() == 2)
+    assert len(calls) == 2
+
+
+def test_stale_async_values_refresh_in_a_task(clock: t.List[float]) -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    calls = []
+
+    @cache.enable("k", "a", ttl=10, stale_ttl=60)
+    async def func() -> int:
+        calls.append(1)
+        return len(calls)
+
+    async def main() -> t.List[int]:
+        first = await func()
+        clock[0] = 20
+        stale = await func()
+        # Let the refresh task run
+        await asyncio.sleep(0.01)
+        return [first, stale, await func()]
+
+    assert asyncio.run(main()) == [1, 1, 2]
+
+
+def test_failed_refresh_keeps_serving_the_stale_value(clock: t.List[float]) -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    calls = []
+
+    @cache.enable("k", "a", ttl=10, stale_ttl=60)
+    def func() -> int:
+        calls.append(1)
+        if len(calls) == 2:
+            raise ValueError("boom")
+        return len(calls)
+
+    assert func() == 1
+    clock[0] = 20
+    assert func() == 1
+    _wait_for(lambda: len(calls) == 2 and not func._refreshing)
+    # The failed refresh is forgotten, so the next stale read starts another
+    assert func() == 1
+    _wait_for(lambda: func() == 3)
+
+
+def test_refresh_ahead_recomputes_before_expiry() -> None:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    calls = []
+
+    @cache.enable("k", "a", ttl=60, refresh_ahead=1e9)
+    def func() -> int:
+        calls.append(1)
+        time.sleep(0.001)
+        return len(calls)
+
+    assert func() == 1
+    # Still fresh, but expensive enough relative to the time left that a refresh is all but certain
+    assert func() == 1
+    _wait_for(lambda: func() > 1)
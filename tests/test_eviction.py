@@ -0,0 +1,146 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import typing as t
+
+import pytest
+
+from cache import eviction
+
+
+def test_sketch_counters_saturate_and_halve() -> None:
+    sketch = eviction._FrequencySketch(1024)
+    for _ in range(20):
+        sketch.increment("hot")
+    sketch.increment("cold")
+    assert sketch.frequency("hot") == 15
+    assert sketch.frequency("cold") >= 1
+
+    sketch._reset()
+    assert sketch.frequency("hot") == 7
+    assert sketch.frequency("cold") <= sketch.frequency("hot")
+
+    sketch.clear()
+    assert sketch.frequency("hot") == 0
+
+
+def test_sketch_ages_after_its_sample_size() -> None:
+    sketch = eviction._FrequencySketch(16)
+    for _ in range(15):
+        sketch.increment("hot")
+    # A sketch of width 16 halves every 160 additions
+    for i in range(160 - 15):
+        sketch.increment(i)
+    assert sketch.frequency("hot") <= 7
+
+
+def test_lru_evicts_least_recently_used() -> None:
+    policy = eviction.LRUPolicy(3)
+    for item in "abc":
+        assert policy.add(item) == []
+    policy.access("a")
+    assert policy.add("d") == ["b"]
+    assert policy.pop_victim() == "c"
+    policy.remove("a")
+    assert len(policy) == 1
+    assert policy.pop_victim() == "d"
+    assert policy.pop_victim() is None
+
+
+def test_lfu_evicts_least_frequently_used_then_oldest() -> None:
+    policy = eviction.LFUPolicy(3)
+    for item in "abc":
+        policy.add(item)
+    policy.access("a")
+    policy.access("a")
+    policy.access("c")
+    assert policy.add("d") == ["b"]
+    # d and c are tied on frequency after this, c was used first
+    policy.access("d")
+    assert policy.add("e") == ["c"]
+
+
+def test_lfu_pop_victim_after_remove_empties_the_lowest_bucket() -> None:
+    policy = eviction.LFUPolicy(3)
+    policy.add("a")
+    policy.add("b")
+    policy.access("b")
+    policy.remove("a")
+    assert policy.pop_victim() == "b"
+    assert policy.pop_victim() is None
+
+
+def test_tinylfu_keeps_the_hot_set_through_a_scan() -> None:
+    # Integer keys hash the same in every run, so sketch collisions are deterministic
+    policy = eviction.TinyLFUPolicy(1000)
+    hot = list(range(50))
+    for item in hot:
+        policy.add(item)
+    for _ in range(10):
+        for item in hot:
+            policy.access(item)
+
+    evicted = []
+    for i in range(10_000, 12_000):
+        evicted.extend(policy.add(i))
+    assert not set(hot) & set(evicted)
+    assert len(policy) == 1000
+
+
+def test_tinylfu_pop_victim_drains_probation_first() -> None:
+    policy = eviction.TinyLFUPolicy(10)
+    for i in range(10):
+        policy.add(i)
+    assert len(policy) == 10
+    victims = [policy.pop_victim() for _ in range(10)]
+    assert sorted(victims) == list(range(10))
+    assert policy.pop_victim() is None
+
+
+@pytest.mark.parametrize("name", ["lru", "LFU", "tinylfu"])
+def test_create_policy_by_name(name: str) -> None:
+    assert isinstance(eviction.create_policy(name, 10), eviction.POLICIES[name.lower()])
+
+
+def test_create_policy_rejects_unknown_names() -> None:
+    with pytest.raises(ValueError):
+        eviction.create_policy("fifo", 10)
+    with pytest.raises(ValueError):
+        eviction.create_policy("lru", 0)
+
+
+def test_custom_policies_must_pick_victims() -> None:
+    class NoVictims(eviction.EvictionPolicy):
+        def access(self, item: t.Hashable) -> None:
+            ...
+
+        def add(self, item: t.Hashable) -> t.List[t.Hashable]:
+            return []
+
+        def remove(self, item: t.Hashable) -> None:
+            ...
+
+        def clear(self) -> None:
+            ...
+
+        def __len__(self) -> int:
+            return 0
+
+    with pytest.raises(TypeError):
+        eviction.create_policy(NoVictims, 10)
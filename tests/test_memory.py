@@ -0,0 +1,142 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import pathlib
+import random
+import threading
+import time
+import typing as t
+
+from cache import abc
+from cache.implementations import memory
+
+_SIZE = 1000 + memory._ENTRY_OVERHEAD
+
+
+def _sizer(value: bytes) -> int:
+    return len(value)
+
+
+def test_sharded_max_bytes_is_shared_by_every_shard() -> None:
+    cache = memory.ShardedInMemoryCacheImpl(shards=8, max_bytes=4 * _SIZE, sizer=_sizer)
+    # Larger than max_bytes / shards, which the shards used to reject
+    cache.put("big", "a", b"x" * 1000, None)
+    assert cache.get("big", "a") == b"x" * 1000
+
+    for i in range(50):
+        cache.put("k", str(i), b"x" * 1000, None)
+        assert cache.bytes_used <= 4 * _SIZE
+    assert cache.bytes_used == 4 * _SIZE
+    assert cache.get("k", "49") == b"x" * 1000
+
+
+def test_sharded_rejects_values_larger_than_max_bytes() -> None:
+    cache = memory.ShardedInMemoryCacheImpl(shards=8, max_bytes=_SIZE, sizer=_sizer)
+    cache.put("k", "a", b"x" * 2000, None)
+    assert cache.get("k", "a") is abc._EMPTY
+    assert cache.bytes_used == 0
+
+
+def test_sharded_quotas_are_shared_by_every_shard() -> None:
+    cache = memory.ShardedInMemoryCacheImpl(shards=8, quotas={"k": 3 * _SIZE}, sizer=_sizer)
+    cache.put_many([("k", str(i), b"x" * 1000, None) for i in range(20)])
+    cache.put_many([("other", str(i), b"x" * 1000, None) for i in range(20)])
+    assert cache.key_bytes_used("k") == 3 * _SIZE
+    assert cache.key_bytes_used("other") == 20 * _SIZE
+
+
+def _sweepers() -> int:
+    return sum(thread.name == "pycaching-sweeper" for thread in threading.enumerate())
+
+
+def test_sharded_uses_a_single_sweeper() -> None:
+    before = _sweepers()
+    cache = memory.ShardedInMemoryCacheImpl(shards=8, sweep_interval=0.05)
+    try:
+        assert _sweepers() == before + 1
+        cache.put_many([("k", str(i), i, 1) for i in range(32)])
+
+        deadline = time.monotonic() + 5
+        while any(shard._store for shard in cache._shards) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not any(shard._store for shard in cache._shards)
+    finally:
+        cache.close()
+    assert _sweepers() == before
+
+
+def test_dump_round_trips_tags(tmp_path: pathlib.Path) -> None:
+    cache = memory.InMemoryCacheImpl()
+    cache.put_tagged("k", "a", 1, None, ["t1", "t2"])
+    cache.put("k", "b", 2, 60)
+    assert cache.dump(str(tmp_path / "snap")) == 2
+
+    restored = memory.ShardedInMemoryCacheImpl(shards=4)
+    assert restored.load(str(tmp_path / "snap")) == 2
+    restored.evict_tags(["t2"])
+    assert restored.get("k", "a") is abc._EMPTY
+    assert restored.get("k", "b") == 2
+
+
+def test_dump_snapshots_tags_under_the_lock() -> None:
+    cache = memory.InMemoryCacheImpl()
+    cache.put_tagged("k", "a", 1, None, ["t1"])
+    entries = cache._entries()
+    # Tagging after the snapshot was taken must not change what gets written
+    cache.tag("k", "a", [f"t{i}" for i in range(2, 100)])
+    assert entries == [("k", "a", 1, None, ("t1",))]
+
+
+def test_sharded_stays_consistent_under_concurrent_use() -> None:
+    cache = memory.ShardedInMemoryCacheImpl(shards=4, max_bytes=200 * _SIZE, quotas={"k0": 20 * _SIZE}, sizer=_sizer)
+    errors: t.List[BaseException] = []
+
+    def work(seed: int) -> None:
+        rng = random.Random(seed)
+        try:
+            for _ in range(5_000):
+                key, at, roll = f"k{rng.randrange(4)}", str(rng.randrange(300)), rng.random()
+                if roll < 0.5:
+                    value = cache.get(key, at)
+                    assert value is abc._EMPTY or value[: len(key) + len(at) + 1] == f"{key}:{at}".encode()
+                elif roll < 0.9:
+                    cache.put(key, at, f"{key}:{at}".encode().ljust(rng.randrange(500, 1000), b"x"), None)
+                elif roll < 0.99:
+                    cache.evict(key, at)
+                else:
+                    cache.evict(key, at, all=True)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    assert cache.bytes_used <= 200 * _SIZE
+    assert cache.key_bytes_used("k0") <= 20 * _SIZE
+    for shard in cache._shards:
+        entries = [obj for inner in shard._store.values() for obj in inner.values()]
+        assert shard.bytes_used == sum(obj.size for obj in entries)
+        assert shard._policy is not None and len(shard._policy) == len(entries)
+        for key in shard._store:
+            assert shard.key_bytes_used(key) == sum(obj.size for obj in shard._store[key].values())
+        assert all(obj.size == len(obj.value) + memory._ENTRY_OVERHEAD for obj in entries)
@@ -0,0 +1,132 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import typing as t
+
+import pytest
+
+import cache
+from cache import abc
+from cache import manual
+from cache import metrics
+from cache import serde
+from cache.implementations import memory
+
+
+@pytest.fixture(autouse=True)
+def enabled() -> t.Iterator[None]:
+    abc.Cache.set_instance(memory.InMemoryCacheImpl())
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+    abc.Cache._instance = None
+
+
+def _value(name: str, **labels: str) -> t.Any:
+    for sample in metrics.stats().get(name, []):
+        if sample["labels"] == labels:
+            return sample.get("value", sample.get("count"))
+    return None
+
+
+def test_decorated_hits_and_misses() -> None:
+    @cache.enable("users", cache.Ex("str(id)"))
+    def func(id: int) -> int:
+        return id
+
+    for id in (1, 1, 1, 2):
+        func(id)
+
+    labels = {"backend": "InMemoryCacheImpl", "key": "users"}
+    assert _value("cache_hits_total", **labels) == 2
+    assert _value("cache_misses_total", **labels) == 2
+    assert _value("cache_puts_total", **labels) == 2
+    assert _value("cache_get_seconds", **labels) == 4
+    assert _value("cache_put_seconds", **labels) == 2
+
+
+def test_manual_operations() -> None:
+    manual.put("k", "a", 1)
+    manual.get("k", "a")
+    manual.get("k", "b")
+    manual.evict("k", "a")
+
+    labels = {"backend": "InMemoryCacheImpl", "key": "k"}
+    assert _value("cache_puts_total", **labels) == 1
+    assert _value("cache_hits_total", **labels) == 1
+    assert _value("cache_misses_total", **labels) == 1
+    assert _value("cache_evictions_total", **labels) == 1
+
+
+def test_serde_timings_and_sizes() -> None:
+    raw = serde.serialize({"a": 1})
+    serde.deserialize(raw)
+    assert _value("serde_serialize_seconds", format="json") == 1
+    assert _value("serde_deserialize_seconds", format="json") == 1
+    assert _value("serde_payload_bytes", format="json", operation="serialize") == 1
+
+
+def test_disabled_metrics_record_nothing() -> None:
+    metrics.disable()
+    manual.put("k", "a", 1)
+    manual.get("k", "a")
+    assert metrics.stats() == {}
+
+
+def test_hooks_see_every_event_and_failures_are_contained() -> None:
+    events: t.List[t.Tuple[str, t.Dict[str, str], float]] = []
+
+    def failing(name: str, labels: t.Dict[str, str], value: float) -> None:
+        raise RuntimeError("boom")
+
+    def record(name: str, labels: t.Dict[str, str], value: float) -> None:
+        events.append((name, labels, value))
+
+    metrics.add_hook(failing)
+    metrics.add_hook(record)
+    try:
+        manual.get("k", "a")
+    finally:
+        metrics.remove_hook(failing)
+        metrics.remove_hook(record)
+
+    assert [name for name, _, _ in events] == ["cache_misses_total", "cache_get_seconds"]
+    assert events[0][1:] == ({"backend": "InMemoryCacheImpl", "key": "k"}, 1)
+
+
+def test_prometheus_exposition() -> None:
+    metrics.incr("cache_hits_total", (("key", 'a"b\\c\nd'),), 3)
+    metrics.observe("cache_get_seconds", (("key", "k"),), 0.0003)
+    metrics.observe("cache_get_seconds", (("key", "k"),), 10.0)
+
+    lines = metrics.to_prometheus().splitlines()
+    assert "# HELP pycaching_cache_hits_total Lookups that found a cached value" in lines
+    assert "# TYPE pycaching_cache_hits_total counter" in lines
+    assert 'pycaching_cache_hits_total{key="a\\"b\\\\c\\nd"} 3' in lines
+
+    assert "# TYPE pycaching_cache_get_seconds histogram" in lines
+    # Buckets are cumulative, and values above the largest bound only show up in +Inf
+    assert 'pycaching_cache_get_seconds_bucket{key="k",le="0.00025"} 0' in lines
+    assert 'pycaching_cache_get_seconds_bucket{key="k",le="0.0005"} 1' in lines
+    assert 'pycaching_cache_get_seconds_bucket{key="k",le="5.0"} 1' in lines
+    assert 'pycaching_cache_get_seconds_bucket{key="k",le="+Inf"} 2' in lines
+    assert 'pycaching_cache_get_seconds_count{key="k"} 2' in lines
+    assert any(line.startswith('pycaching_cache_get_seconds_sum{key="k"} 10.0003') for line in lines)
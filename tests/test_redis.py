@@ -0,0 +1,329 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import os
+import threading
+import time
+import typing as t
+
+import pytest
+
+# These run against a real server and flush its database, so point REDIS_URL at a throwaway one.
+# REDIS_URL may list several comma separated servers for test_sharded_redis.py, these only use the first
+if "REDIS_URL" not in os.environ:
+    pytest.skip("set REDIS_URL to run the redis tests", allow_module_level=True)
+
+from cache import abc  # noqa: E402
+from cache.implementations import redis as redis_impl  # noqa: E402
+from cache.implementations import tiered  # noqa: E402
+
+
+def _wait_for(condition: t.Callable[[], bool]) -> None:
+    # Invalidations arrive on another instance's listener thread
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture()
+def cache() -> t.Iterator[redis_impl.RedisCacheImpl]:
+    cache = redis_impl.RedisCacheImpl(os.environ["REDIS_URL"].split(",")[0], layout="indexed")
+    cache._sync_connection().flushdb()
+    yield cache
+    cache.close()
+
+
+def test_indexed_writes_prune_expired_members(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+    cache.put("k", "short", 1, 1)
+    cache.put("k", "forever", 2, None)
+    time.sleep(1.1)
+    cache.put("k", "new", 3, 100)
+    assert sorted(conn.zrange(cache._index("k"), 0, -1)) == [b"forever", b"new"]
+
+
+def test_indexed_evict_all_keeps_entries_written_during_it(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+    cache.put_many([("k", str(i), i, None) for i in range(1000)])
+
+    scan = conn.zscan_iter
+
+    def zscan_iter(name: str, **kwargs: t.Any) -> t.Iterator[t.Any]:
+        # Simulates another client writing while the old index is being read
+        cache.put("k", "late", "v", None)
+        return scan(name, **kwargs)
+
+    conn.zscan_iter = zscan_iter  # type: ignore[method-assign]
+    cache.evict("k", "0", all=True)
+
+    assert cache.get("k", "0") is abc._EMPTY
+    assert cache.get("k", "late") == "v"
+    assert conn.zrange(cache._index("k"), 0, -1) == [b"late"]
+    assert conn.sismember(cache._keys_index, "k")
+
+    del conn.zscan_iter
+    cache.evict("k", "late", all=True)
+    assert not conn.exists(cache._index("k"))
+    assert not conn.sismember(cache._keys_index, "k")
+
+
+def test_flush_removes_every_index(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+    cache.put("k", "a", 1, None)
+    cache.put("j", "a", 1, 100)
+    cache.flush()
+    assert conn.keys("*") == []
+
+
+def test_tag_sets_follow_their_entries_expiry(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+    cache.put_tagged("k", "short", 1, 1, ["t"])
+    assert 0 < conn.pttl(cache._tag("t")) <= 1000
+
+    cache.put_tagged("k", "long", 2, 100, ["t"])
+    assert conn.pttl(cache._tag("t")) > 99_000
+
+    time.sleep(1.1)
+    cache.put("k", "forever", 3, None)
+    cache.tag("k", "forever", ["t"])
+    assert conn.pttl(cache._tag("t")) == -1
+    assert sorted(conn.zrange(cache._tag("t"), 0, -1)) == [b'["k","forever"]', b'["k","long"]']
+
+    # Entries that no longer exist aren't tagged
+    cache.tag("k", "missing", ["t"])
+    assert conn.zcard(cache._tag("t")) == 2
+
+
+def test_evict_tags_forgets_the_tag(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+    cache.put_tagged("k", "a", 1, None, ["t", "u"])
+    cache.put_tagged("k", "b", 2, None, ["u"])
+
+    cache.evict_tags(["t"])
+    assert cache.get("k", "a") is abc._EMPTY
+    assert cache.get("k", "b") == 2
+    assert conn.smembers(cache._tags_index) == {b"u"}
+    assert not conn.exists(cache._tag("t"))
+
+
+def test_loops_in_many_threads_share_the_client(cache: redis_impl.RedisCacheImpl) -> None:
+    errors: t.List[BaseException] = []
+
+    async def use(i: int) -> None:
+        await cache.aput("k", str(i), i, None)
+        assert await cache.aget("k", str(i)) == i
+
+    def run(i: int) -> None:
+        try:
+            for j in range(10):
+                asyncio.run(use(i * 10 + j))
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    # Every loop above has been closed, so a new one drops their clients
+    asyncio.run(use(1000))
+    assert len(cache._RedisCacheImpl__async_connections) == 1  # type: ignore[attr-defined]
+
+
+def test_tiered_close_stops_the_listener(cache: redis_impl.RedisCacheImpl) -> None:
+    near = tiered.TieredCacheImpl(cache)
+    near.close()
+    assert not near._listener.is_alive()
+
+
+def test_tiered_skips_l1_for_entries_about_to_expire(cache: redis_impl.RedisCacheImpl) -> None:
+    near = tiered.TieredCacheImpl(cache)
+    try:
+        cache.put("k", "a", 1, 1)
+        cache._sync_connection().pexpire(cache._name("k", "a"), 500)
+        assert near.get("k", "a") == 1
+        # Not even stored already expired
+        assert "a" not in near._l1._store.get("k", {})
+
+        cache.put("k", "b", 2, 60)
+        assert near.get("k", "b") == 2
+        assert near._l1.get("k", "b") == 2
+    finally:
+        near._stop_listener()
+
+
+def test_tiered_writes_invalidate_other_instances(cache: redis_impl.RedisCacheImpl) -> None:
+    first, second = tiered.TieredCacheImpl(cache), tiered.TieredCacheImpl(cache)
+    l1 = second._l1
+    try:
+        first.put("k", "a", 1, None)
+        first.put_many([("k", "b", 2, None), ("k", "c", 3, None)])
+        assert second.get_many([("k", "a"), ("k", "b"), ("k", "c")]) == [1, 2, 3]
+        assert l1.get("k", "a") == 1
+
+        first.put("k", "a", 10, None)
+        _wait_for(lambda: l1.get("k", "a") is abc._EMPTY)
+        assert second.get("k", "a") == 10
+
+        first.evict_many([("k", "b")])
+        _wait_for(lambda: l1.get("k", "b") is abc._EMPTY)
+        first.evict("k", "c", all=True)
+        _wait_for(lambda: l1.get("k", "a") is abc._EMPTY and l1.get("k", "c") is abc._EMPTY)
+        assert second.get_many([("k", "a"), ("k", "b"), ("k", "c")]) == [abc._EMPTY] * 3
+
+        # An instance doesn't drop its own L1 on the message it published
+        first.put("k", "d", 4, None)
+        assert first.get("k", "d") == 4
+        time.sleep(0.1)
+        assert first._l1.get("k", "d") == 4
+
+        second.get("k", "d")
+        first.flush()
+        _wait_for(lambda: l1.get("k", "d") is abc._EMPTY)
+    finally:
+        first._stop_listener()
+        second._stop_listener()
+
+
+def test_batch_operations(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+    cache.put_many([("k", "a", 1, None), ("k", "b", {"x": [2]}, 60), ("j", "a", "3", 1)])
+    assert cache.get_many([("k", "b"), ("k", "missing"), ("j", "a"), ("k", "a")]) == [{"x": [2]}, abc._EMPTY, "3", 1]
+
+    # Each item keeps its own ttl
+    assert conn.ttl(cache._name("k", "a")) == -1
+    assert 59 <= conn.ttl(cache._name("k", "b")) <= 60
+    assert conn.ttl(cache._name("j", "a")) == 1
+    assert [value for value, _ in cache.get_many_with_ttl([("k", "a"), ("k", "b")])] == [1, {"x": [2]}]
+    assert sorted(conn.zrange(cache._index("k"), 0, -1)) == [b"a", b"b"]
+
+    cache.evict_many([("k", "a"), ("j", "a"), ("k", "missing")])
+    assert cache.get_many([("k", "a"), ("k", "b"), ("j", "a")]) == [abc._EMPTY, {"x": [2]}, abc._EMPTY]
+    assert conn.zrange(cache._index("k"), 0, -1) == [b"b"]
+
+    assert cache.get_many([]) == []
+    cache.evict_many([])
+
+
+def test_async_batch_operations(cache: redis_impl.RedisCacheImpl) -> None:
+    conn = cache._sync_connection()
+
+    async def run() -> None:
+        await cache.aput_many([("k", str(i), i, 60 if i % 2 else None) for i in range(100)])
+        assert await cache.aget_many([("k", str(i)) for i in range(100)]) == list(range(100))
+        await cache.aevict_many([("k", str(i)) for i in range(50)])
+        assert await cache.aget_many([("k", "0"), ("k", "50")]) == [abc._EMPTY, 50]
+        assert await cache.aget_many([]) == []
+        await cache.aclose()
+
+    asyncio.run(run())
+    assert conn.ttl(cache._name("k", "50")) == -1
+    assert 59 <= conn.ttl(cache._name("k", "51")) <= 60
+    assert conn.zcard(cache._index("k")) == 50
+
+
+@pytest.fixture()
+def batched() -> t.Iterator[redis_impl.RedisCacheImpl]:
+    cache = redis_impl.RedisCacheImpl(os.environ["REDIS_URL"].split(",")[0], auto_batch=True, max_batch_size=8)
+    cache._sync_connection().flushdb()
+    yield cache
+    cache.close()
+
+
+async def _count_pipelines(cache: redis_impl.RedisCacheImpl) -> t.List[int]:
+    # Records the size of every pipeline the batcher sends
+    connection, sizes = await cache._async_connection(), []
+    pipeline = connection.pipeline
+
+    def counting(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            sizes.append(len(pipe.command_stack))
+            return await execute(*args, **kwargs)
+
+        pipe.execute = counted
+        return pipe
+
+    connection.pipeline = counting
+    return sizes
+
+
+def test_auto_batch_sends_concurrent_commands_together(batched: redis_impl.RedisCacheImpl) -> None:
+    async def run() -> t.List[t.Any]:
+        sizes = await _count_pipelines(batched)
+        await asyncio.gather(*(batched.aput("k", str(i), i, None) for i in range(4)))
+        values = await asyncio.gather(*(batched.aget("k", str(i)) for i in range(5)))
+        assert sizes == [4, 5]
+
+        # Reaching max_batch_size sends the batch without waiting for the loop to come round
+        sizes.clear()
+        await asyncio.gather(*(batched.aget("k", str(i)) for i in range(20)))
+        assert sizes == [8, 8, 4]
+        await batched.aclose()
+        return values
+
+    assert asyncio.run(run()) == [0, 1, 2, 3, abc._EMPTY]
+
+
+def test_auto_batch_errors_only_fail_their_own_command(batched: redis_impl.RedisCacheImpl) -> None:
+    batched._sync_connection().sadd(batched._name("k", "set"), "x")
+    batched.put("k", "a", 1, None)
+
+    async def run() -> t.List[t.Any]:
+        results = await asyncio.gather(batched.aget("k", "set"), batched.aget("k", "a"), return_exceptions=True)
+        await batched.aclose()
+        return results
+
+    error, value = asyncio.run(run())
+    assert isinstance(error, Exception) and "WRONGTYPE" in str(error)
+    assert value == 1
+
+
+def test_auto_batch_connection_errors_fail_every_waiter(batched: redis_impl.RedisCacheImpl) -> None:
+    async def run() -> t.List[t.Any]:
+        connection = await batched._async_connection()
+        pipeline = connection.pipeline
+
+        def failing(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            pipe = pipeline(*args, **kwargs)
+
+            async def execute(*args: t.Any, **kwargs: t.Any) -> t.Any:
+                raise ConnectionError("lost")
+
+            pipe.execute = execute
+            return pipe
+
+        connection.pipeline = failing
+        results = await asyncio.gather(*(batched.aget("k", str(i)) for i in range(3)), return_exceptions=True)
+        connection.pipeline = pipeline
+        # The batcher is still usable once the connection recovers
+        await batched.aput("k", "a", 1, None)
+        results.append(await batched.aget("k", "a"))
+        await batched.aclose()
+        return results
+
+    *errors, value = asyncio.run(run())
+    assert [str(error) for error in errors] == ["lost"] * 3
+    assert value == 1
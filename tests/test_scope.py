@@ -0,0 +1,166 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import threading
+import typing as t
+
+import pytest
+
+import cache
+from cache import abc
+from cache import manual
+from cache import scope
+from cache.implementations import memory
+
+
+class CountingCache(memory.InMemoryCacheImpl):
+    def __init__(self) -> None:
+        super().__init__()
+        self.gets = 0
+
+    def get(self, key: str, at: str) -> t.Any:
+        self.gets += 1
+        return super().get(key, at)
+
+
+@pytest.fixture()
+def backend() -> t.Iterator[CountingCache]:
+    instance = CountingCache()
+    abc.Cache.set_instance(instance)
+    yield instance
+    abc.Cache._instance = None
+
+
+def test_lookups_are_memoized_for_the_scope(backend: CountingCache) -> None:
+    @cache.enable("k", cache.Ex("str(id)"))
+    def func(id: int) -> t.Dict[str, int]:
+        return {"id": id}
+
+    func(1)
+    with cache.request_scope():
+        first = func(1)
+        assert func(1) is first
+        assert manual.get("k", "1") is first
+    assert backend.gets == 2
+
+    # Outside the scope every call goes to the backend again
+    func(1)
+    assert backend.gets == 3
+    assert scope.current() is None
+
+
+def test_writes_and_evictions_update_the_memo(backend: CountingCache) -> None:
+    with cache.request_scope():
+        manual.put("k", "a", 1)
+        assert manual.get("k", "a") == 1
+        assert backend.gets == 0
+
+        manual.evict("k", "a")
+        assert manual.get("k", "a") is abc._EMPTY
+
+        manual.put("k", "b", 2)
+        manual.evict("k", all=True)
+        assert manual.get("k", "b") is abc._EMPTY
+
+
+def test_nested_scopes_share_the_outer_memo(backend: CountingCache) -> None:
+    backend.put("k", "a", 1, None)
+    with cache.request_scope():
+        manual.get("k", "a")
+        with cache.request_scope():
+            manual.get("k", "a")
+        manual.get("k", "a")
+    assert backend.gets == 1
+
+
+def test_concurrent_tasks_have_their_own_scope(backend: CountingCache) -> None:
+    backend.put("k", "a", 1, None)
+    first_read, changed = asyncio.Event(), asyncio.Event()
+
+    async def reader() -> t.List[t.Any]:
+        with cache.request_scope():
+            values = [await manual.aget("k", "a")]
+            first_read.set()
+            await changed.wait()
+            values.append(await manual.aget("k", "a"))
+            return values
+
+    async def writer() -> t.Any:
+        await first_read.wait()
+        with cache.request_scope():
+            backend.put("k", "a", 2, None)
+            value = await manual.aget("k", "a")
+        changed.set()
+        return value
+
+    async def main() -> t.List[t.Any]:
+        return list(await asyncio.gather(reader(), writer()))
+
+    # The reader keeps the value it memoized, the writer's scope never saw it
+    assert asyncio.run(main()) == [[1, 1], 2]
+
+
+def test_threads_have_their_own_scope(backend: CountingCache) -> None:
+    memos: t.List[t.Any] = []
+
+    def run() -> None:
+        with cache.request_scope():
+            memos.append(scope.current())
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(memo) for memo in memos}) == 4
+
+
+def test_asgi_middleware_scopes_each_request(backend: CountingCache) -> None:
+    seen: t.List[t.Any] = []
+
+    async def app(request: t.Dict[str, t.Any], receive: t.Any, send: t.Any) -> None:
+        seen.append(scope.current())
+
+    middleware = scope.ASGIMiddleware(app)
+    asyncio.run(middleware({"type": "http"}, None, None))
+    asyncio.run(middleware({"type": "http"}, None, None))
+    asyncio.run(middleware({"type": "lifespan"}, None, None))
+
+    assert seen[0] == {} and seen[1] == {}
+    assert seen[0] is not seen[1]
+    assert seen[2] is None
+
+
+def test_wsgi_middleware_covers_the_response_body(backend: CountingCache) -> None:
+    backend.put("k", "a", 1, None)
+
+    def app(environ: t.Dict[str, t.Any], start_response: t.Any) -> t.Iterator[bytes]:
+        def body() -> t.Iterator[bytes]:
+            # Runs only once the server iterates the response, after app has returned
+            yield str(manual.get("k", "a")).encode()
+            yield str(manual.get("k", "a")).encode()
+
+        manual.get("k", "a")
+        return body()
+
+    response = scope.WSGIMiddleware(app)({}, None)
+    assert list(response) == [b"1", b"1"]
+    assert backend.gets == 1
+    assert scope.current() is None
@@ -0,0 +1,146 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import dataclasses
+import datetime
+import typing as t
+
+import orjson
+import pytest
+
+from cache import abc
+from cache import serde
+
+
+class Custom:
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Custom) and other.value == self.value
+
+
+class Float(float):
+    pass
+
+
+@dataclasses.dataclass
+class Holder:
+    value: t.Any
+
+
+shared = Custom(3)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (Custom(1), Custom(1)),
+        ([Custom(1), {"a": Custom(2)}], [Custom(1), {"a": Custom(2)}]),
+        ({"k": (1, Custom(2), [shared, shared])}, {"k": [1, Custom(2), [shared, shared]]}),
+        ([Float(1.5)], [1.5]),
+        ([*range(1000), Custom(1)], [*range(1000), Custom(1)]),
+        # Types whose JSON structure isn't mirrored fall back to walking the encoded body
+        (
+            {"when": datetime.datetime(2020, 1, 1), "custom": Custom(1)},
+            {"when": "2020-01-01T00:00:00", "custom": Custom(1)},
+        ),
+        (Holder(Custom(1)), {"value": Custom(1)}),
+    ],
+)
+def test_marked_round_trip(value: t.Any, expected: t.Any) -> None:
+    assert serde.deserialize(serde.serialize(value)) == expected
+
+
+def test_marker_paths_match_the_body() -> None:
+    raw = serde.serialize({"a": [1, Custom(1)], "b": {"c": Custom(2)}})
+    assert raw.startswith(b'\x01[["a",1],["b","c"]]\n')
+
+
+class Point(abc.Serializable):
+    def __init__(self, x: int, y: int) -> None:
+        self.x, self.y = x, y
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Point) and (other.x, other.y) == (self.x, self.y)
+
+    def to_json(self) -> abc.JsonT:
+        return [self.x, self.y]
+
+    @classmethod
+    def from_json(cls, payload: abc.JsonT) -> "Point":
+        x, y = t.cast(t.List[int], payload)
+        return cls(x, y)
+
+
+@pytest.mark.parametrize("value", [None, 1, "a", [1, 2.5], {"a": {"b": [True, None]}}])
+def test_plain_json_round_trip(value: t.Any) -> None:
+    raw = serde.serialize(value)
+    assert raw[:1] not in (b"\x01", b"\x02", b"\x03")
+    assert serde.deserialize(raw) == value
+
+
+def test_serializable_round_trip() -> None:
+    impl = serde.Serde()
+    assert impl.deserialize(impl.serialize({"p": Point(1, 2)})) == {"p": Point(1, 2)}
+
+
+@pytest.mark.parametrize("value", [{"a": [1, Custom(2)]}, bytearray(b"x" * 4096), [bytearray(b"a"), b"b", Custom(1)]])
+def test_binary_round_trip(value: t.Any) -> None:
+    impl = serde.Serde("binary")
+    raw = impl.serialize(value)
+    assert raw[:1] == b"\x02"
+    assert impl.deserialize(raw) == value
+    # Payloads of either format are readable by any instance
+    assert serde.deserialize(raw) == value
+
+
+def test_binary_version_mismatch() -> None:
+    raw = bytearray(serde.Serde("binary").serialize([1]))
+    raw[1] = serde.BINARY_VERSION + 1
+    with pytest.raises(TypeError):
+        serde.deserialize(bytes(raw))
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_compressed_round_trip(codec: str) -> None:
+    impl = serde.Serde(codec=codec, compress_threshold=16)
+    value = {"a": ["x" * 100] * 10, "b": Custom(1)}
+    raw = impl.serialize(value)
+    assert raw[:1] == b"\x03"
+    assert serde.deserialize(raw) == value
+
+
+def test_compression_skips_small_payloads() -> None:
+    raw = serde.Serde(codec="zlib", compress_threshold=1024).serialize([1, 2, 3])
+    assert serde.deserialize(raw) == [1, 2, 3]
+    assert raw[:1] != b"\x03"
+
+
+def test_legacy_payload() -> None:
+    impl = serde.Serde()
+    impl.get_cls_name(Point(0, 0))
+    raw = orjson.dumps({"a": [1, impl.serialize_default(Custom(1))], "p": impl.serialize_default(Point(1, 2))})
+    assert impl.deserialize(raw) == {"a": [1, Custom(1)], "p": Point(1, 2)}
+
+
+def test_legacy_payload_version_mismatch() -> None:
+    marker = {**serde.default_serde.serialize_default(Custom(1)), "ver": "legacy"}
+    with pytest.raises(TypeError):
+        serde.deserialize(orjson.dumps([marker]))
@@ -0,0 +1,138 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import os
+import typing as t
+
+import pytest
+
+try:
+    from cache import abc
+    from cache.implementations import sharded_redis
+except Exception:
+    # aioredis fails with a TypeError rather than an ImportError on some Python versions
+    pytest.skip("the redis extras can't be imported", allow_module_level=True)
+
+URLS = [url for url in os.environ.get("REDIS_URL", "").split(",") if url]
+NODES = [f"redis://node-{i}" for i in range(4)]
+KEYS = [f"key-{i}" for i in range(20_000)]
+
+# Each url must point at a different throwaway server, every one of them is flushed
+needs_servers = pytest.mark.skipif(len(URLS) < 2, reason="set REDIS_URL to two or more comma separated urls")
+
+
+def _assign(nodes: t.Sequence[str]) -> t.Dict[str, str]:
+    ring = sharded_redis.HashRing(nodes)
+    return {key: nodes[ring.node(key)] for key in KEYS}
+
+
+def test_ring_needs_a_node() -> None:
+    with pytest.raises(ValueError):
+        sharded_redis.HashRing([])
+
+
+def test_ring_spreads_keys_evenly() -> None:
+    counts = {node: 0 for node in NODES}
+    for node in _assign(NODES).values():
+        counts[node] += 1
+    expected = len(KEYS) / len(NODES)
+    assert all(abs(count - expected) < expected * 0.2 for count in counts.values()), counts
+
+
+def test_adding_a_node_only_moves_keys_onto_it() -> None:
+    before, after = _assign(NODES), _assign([*NODES, "redis://node-4"])
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == "redis://node-4" for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+
+def test_removing_a_node_only_moves_its_keys() -> None:
+    before, after = _assign(NODES), _assign([node for node in NODES if node != "redis://node-1"])
+    moved = {key for key in KEYS if before[key] != after[key]}
+    assert moved == {key for key in KEYS if before[key] == "redis://node-1"}
+
+
+@pytest.fixture()
+def cache() -> t.Iterator[sharded_redis.ShardedRedisCacheImpl]:
+    cache = sharded_redis.ShardedRedisCacheImpl(URLS)
+    cache.flush()
+    yield cache
+    cache.close()
+
+
+@needs_servers
+def test_entries_are_stored_on_their_shard(cache: sharded_redis.ShardedRedisCacheImpl) -> None:
+    items = [("k", str(i)) for i in range(200)]
+    cache.put_many([(key, at, int(at), None) for key, at in items])
+
+    assert cache.get_many(items) == list(range(200))
+    for key, at in items:
+        assert [shard.get(key, at) is not abc._EMPTY for shard in cache.shards].count(True) == 1
+        assert cache.shard_for(key, at).get(key, at) == int(at)
+    assert all(shard.get_many(items).count(abc._EMPTY) < len(items) for shard in cache.shards)
+
+    cache.evict_many(items[:100])
+    assert cache.get_many(items) == [abc._EMPTY] * 100 + list(range(100, 200))
+
+
+@needs_servers
+def test_async_batches_are_reassembled_in_order(cache: sharded_redis.ShardedRedisCacheImpl) -> None:
+    items = [("k", str(i)) for i in range(200)]
+
+    async def run() -> t.List[t.Any]:
+        await cache.aput_many([(key, at, int(at), None) for key, at in items])
+        await cache.aevict_many(items[::2])
+        values = await cache.aget_many(items)
+        await cache.aclose()
+        return values
+
+    assert asyncio.run(run()) == [abc._EMPTY if i % 2 == 0 else i for i in range(200)]
+
+
+@needs_servers
+def test_evict_all_and_tags_reach_every_shard(cache: sharded_redis.ShardedRedisCacheImpl) -> None:
+    cache.put_many([("k", str(i), i, None) for i in range(50)])
+    cache.put_many([("j", str(i), i, None) for i in range(50)])
+    for i in range(50):
+        cache.tag("j", str(i), ["t"])
+
+    cache.evict("k", all=True)
+    assert cache.get_many([("k", str(i)) for i in range(50)]) == [abc._EMPTY] * 50
+
+    cache.evict_tags(["t"])
+    assert cache.get_many([("j", str(i)) for i in range(50)]) == [abc._EMPTY] * 50
+
+
+@needs_servers
+def test_routing_on_key_keeps_a_key_on_one_shard() -> None:
+    cache = sharded_redis.ShardedRedisCacheImpl(URLS, route_on="key")
+    cache.flush()
+    try:
+        cache.put_many([(f"k{j}", str(i), i, None) for j in range(10) for i in range(20)])
+        for j in range(10):
+            holding = [shard for shard in cache.shards if shard.get(f"k{j}", "0") is not abc._EMPTY]
+            assert holding == [cache.shard_for(f"k{j}", "")]
+            assert all(holding[0].get(f"k{j}", str(i)) == i for i in range(20))
+
+        cache.evict("k0", all=True)
+        assert cache.get_many([("k0", str(i)) for i in range(20)]) == [abc._EMPTY] * 20
+        assert cache.get("k1", "0") == 0
+    finally:
+        cache.close()
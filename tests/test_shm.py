@@ -0,0 +1,75 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import typing as t
+
+import pytest
+
+from cache import abc
+from cache.implementations import shm
+
+
+@pytest.fixture()
+def segment(tmp_path: t.Any) -> t.Iterator[shm.SharedMemoryCacheImpl]:
+    # Enough buckets that the arena, not the table, is what fills up
+    instance = shm.SharedMemoryCacheImpl(f"test-{os.getpid()}", size="8MB", buckets=1 << 16, directory=str(tmp_path))
+    yield instance
+    instance.close()
+    instance.unlink()
+
+
+def test_round_trip(segment: shm.SharedMemoryCacheImpl) -> None:
+    segment.put("k", "a", {"id": 1}, None)
+    segment.put("k", "b", [1, 2], None)
+    assert segment.get("k", "a") == {"id": 1}
+    segment.evict("k", "a")
+    assert segment.get("k", "a") is abc._EMPTY
+    segment.evict("k", None, all=True)  # type: ignore[arg-type]
+    assert segment.get("k", "b") is abc._EMPTY
+
+
+def test_pages_move_to_the_sizes_being_written(segment: shm.SharedMemoryCacheImpl) -> None:
+    # Fill every page with one size class, then switch to values of a much larger class
+    for i in range(50_000):
+        segment.put("small", str(i), "x" * 400, None)
+    assert segment.get("small", "49999") == "x" * 400
+
+    for i in range(50):
+        segment.put("large", str(i), "y" * 3000, None)
+    assert sum(segment.get("large", str(i)) == "y" * 3000 for i in range(50)) == 50
+
+    # Both sizes keep working once memory has been shared out
+    for round in range(3):
+        for i in range(2_000):
+            segment.put("small", f"{round}-{i}", "x" * 400, None)
+            if i % 10 == 0:
+                segment.put("large", f"{round}-{i}", "y" * 3000, None)
+        assert segment.get("small", f"{round}-1999") == "x" * 400
+        assert segment.get("large", f"{round}-1990") == "y" * 3000
+
+
+def test_flush_resets_the_allocator(segment: shm.SharedMemoryCacheImpl) -> None:
+    for i in range(50_000):
+        segment.put("small", str(i), "x" * 400, None)
+    segment.flush()
+    assert segment.get("small", "49999") is abc._EMPTY
+    for i in range(100):
+        segment.put("large", str(i), "y" * 3000, None)
+    assert all(segment.get("large", str(i)) == "y" * 3000 for i in range(100))
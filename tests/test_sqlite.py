@@ -0,0 +1,111 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import pathlib
+import sqlite3
+import time
+import typing as t
+
+import pytest
+
+from cache import abc
+from cache.implementations import sqlite
+
+
+def _count(cache: sqlite.SQLiteCacheImpl, table: str) -> int:
+    with sqlite3.connect(cache.path) as connection:
+        return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+@pytest.fixture()
+def clock(monkeypatch: pytest.MonkeyPatch) -> t.List[float]:
+    now = [time.time()]
+    monkeypatch.setattr(sqlite.time, "time", lambda: now[0])
+    return now
+
+
+def test_writes_reclaim_expired_rows(tmp_path: pathlib.Path, clock: t.List[float]) -> None:
+    cache = sqlite.SQLiteCacheImpl(str(tmp_path), reclaim_every=10)
+    for i in range(5):
+        cache.put("k", str(i), i, 1)
+        cache.tag("k", str(i), ["t"])
+    clock[0] += 2
+
+    for i in range(4):
+        cache.put("other", str(i), i, None)
+    assert _count(cache, "pyc_0") == 9
+    # The tenth write runs a batch
+    cache.put("other", "4", 4, None)
+    assert _count(cache, "pyc_0") == 5
+    assert _count(cache, "pyc_0_tags") == 0
+    cache.close()
+
+
+def test_reclaim_every_none_leaves_rows_to_reclaim(tmp_path: pathlib.Path, clock: t.List[float]) -> None:
+    cache = sqlite.SQLiteCacheImpl(str(tmp_path), reclaim_every=None)
+    cache.put_many([("k", str(i), i, 1) for i in range(20)])
+    clock[0] += 2
+    cache.put_many([("k", str(i), i, None) for i in range(20, 40)])
+    assert _count(cache, "pyc_0") == 40
+    assert cache.reclaim() == 20
+    assert _count(cache, "pyc_0") == 20
+    cache.close()
+
+
+def test_evicting_removes_tag_rows(tmp_path: pathlib.Path) -> None:
+    cache = sqlite.SQLiteCacheImpl(str(tmp_path))
+    for at in "abc":
+        cache.put("k", at, at, None)
+        cache.tag("k", at, ["t", "u"])
+    cache.put("j", "a", 1, None)
+    cache.tag("j", "a", ["t"])
+
+    cache.evict("k", "a")
+    assert _count(cache, "pyc_0_tags") == 5
+    cache.evict_many([("k", "b")])
+    assert _count(cache, "pyc_0_tags") == 3
+    cache.evict("k", "c", all=True)
+    assert _count(cache, "pyc_0_tags") == 1
+
+    cache.evict_tags(["t"])
+    assert cache.get("j", "a") is abc._EMPTY
+    assert _count(cache, "pyc_0_tags") == 0
+    cache.close()
+
+
+def test_reclaim_removes_orphaned_tag_rows(tmp_path: pathlib.Path) -> None:
+    cache = sqlite.SQLiteCacheImpl(str(tmp_path))
+    cache.put("k", "a", 1, None)
+    cache.tag("k", "a", ["t"])
+    # Left behind by versions that kept tag rows after eviction
+    with sqlite3.connect(cache.path) as connection:
+        connection.execute("INSERT INTO pyc_0_tags (tag, key, at) VALUES ('t', 'gone', 'a')")
+    cache.close()
+
+    cache = sqlite.SQLiteCacheImpl(str(tmp_path))
+    assert _count(cache, "pyc_0_tags") == 1
+    cache.close()
+
+
+def test_evict_no_tags(tmp_path: pathlib.Path) -> None:
+    cache = sqlite.SQLiteCacheImpl(str(tmp_path))
+    cache.put_tagged("k", "a", 1, None, ["t"])
+    cache.evict_tags([])
+    assert cache.get("k", "a") == 1
+    cache.close()
@@ -0,0 +1,217 @@
+# Copyright (c) 2022-present tandemdude
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+import time
+import typing as t
+
+import pytest
+
+from cache import abc
+from cache.implementations import memory
+from cache.implementations import write_behind
+
+
+class GatedCache(memory.InMemoryCacheImpl):
+    # Blocks every put_many until released, so tests can act while a batch is being written
+    def __init__(self) -> None:
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def put_many(self, items: t.Sequence[t.Tuple[str, str, t.Any, t.Optional[int]]]) -> None:
+        self.entered.set()
+        self.release.wait(5)
+        super().put_many(items)
+
+
+def _wait_for(condition: t.Callable[[], bool]) -> None:
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture()
+def inner() -> GatedCache:
+    return GatedCache()
+
+
+def test_reads_see_queued_writes(inner: GatedCache) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner)
+    cache.put("k", "a", 1, None)
+    assert cache.get("k", "a") == 1
+    assert cache.get_many([("k", "a"), ("k", "b")]) == [1, abc._EMPTY]
+
+    inner.release.set()
+    assert cache.drain(5)
+    assert inner.get("k", "a") == 1
+    cache.close()
+
+
+def test_last_write_wins(inner: GatedCache) -> None:
+    inner.release.set()
+    cache = write_behind.WriteBehindCacheImpl(inner, batch_size=4)
+    for i in range(100):
+        cache.put("k", str(i % 7), i, None)
+    assert cache.drain(5)
+    assert [inner.get("k", str(r)) for r in range(7)] == [max(i for i in range(100) if i % 7 == r) for r in range(7)]
+    cache.close()
+
+
+def test_evict_waits_for_the_batch_being_written(inner: GatedCache) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner, batch_size=1)
+    cache.put("k", "a", 1, None)
+    assert inner.entered.wait(5)
+
+    evicting = threading.Thread(target=cache.evict, args=("k", "a"))
+    evicting.start()
+    inner.release.set()
+    evicting.join(5)
+
+    assert cache.get("k", "a") is abc._EMPTY
+    assert inner.get("k", "a") is abc._EMPTY
+    cache.close()
+
+
+def test_put_during_evict_of_an_entry_being_rewritten(inner: GatedCache) -> None:
+    # put, overwrite while the first write is in flight, evict, then put again - the item must only
+    # be queued once or the writer thread dies on the duplicate
+    cache = write_behind.WriteBehindCacheImpl(inner, batch_size=1)
+    cache.put("k", "a", 1, None)
+    assert inner.entered.wait(5)
+    cache.put("k", "a", 2, None)
+
+    evicting = threading.Thread(target=cache.evict, args=("k", "a"))
+    evicting.start()
+    _wait_for(lambda: cache.pending == 0)
+    cache.put("k", "a", 3, None)
+
+    inner.release.set()
+    evicting.join(5)
+    assert cache.drain(5)
+    # The last put raced the evict, either order is fine as long as both layers agree
+    assert cache.get("k", "a") == inner.get("k", "a")
+    assert inner.get("k", "a") in (3, abc._EMPTY)
+
+    cache.put("k", "b", 4, None)
+    assert cache.drain(5)
+    assert inner.get("k", "b") == 4
+    assert cache._writer.is_alive()
+    cache.close()
+
+
+def test_drop_overflow(inner: GatedCache) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner, max_pending=2, batch_size=1, overflow="drop")
+    cache.put("k", "0", 0, None)
+    assert inner.entered.wait(5)
+    for i in range(1, 10):
+        cache.put("k", str(i), i, None)
+    assert cache.dropped == 8
+
+    inner.release.set()
+    cache.close()
+    assert inner.get("k", "1") == 1
+
+
+def test_close_writes_everything_queued(inner: GatedCache) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner)
+    cache.put_many([("k", str(i), i, None) for i in range(50)])
+    inner.release.set()
+    cache.close()
+    assert inner.get_many([("k", str(i)) for i in range(50)]) == list(range(50))
+
+
+def test_tagged_writes_keep_their_tags(inner: GatedCache) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner)
+    cache.put_tagged("k", "a", 1, None, ["t"])
+    cache.put("k", "b", 2, None)
+    cache.tag("k", "b", ["u"])
+    inner.release.set()
+
+    cache.evict_tags(["t", "u"])
+    assert inner.get_many([("k", "a"), ("k", "b")]) == [abc._EMPTY, abc._EMPTY]
+    cache.close()
+
+
+def test_entries_expired_while_queued_are_not_written(inner: GatedCache, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner, batch_size=1)
+    cache.put("k", "block", 0, None)
+    assert inner.entered.wait(5)
+    cache.put("k", "a", 1, 1)
+    cache.put("k", "b", 2, 60)
+
+    now = time.monotonic()
+    monkeypatch.setattr(write_behind.time, "monotonic", lambda: now + 1.5)
+    assert cache.get("k", "a") is abc._EMPTY
+    inner.release.set()
+    assert cache.drain(5)
+    monkeypatch.undo()
+
+    assert cache.expired == 1
+    assert inner.get("k", "a") is abc._EMPTY
+    assert inner.get("k", "b") == 2
+    cache.close()
+
+
+def test_short_ttls_survive_the_queue(inner: GatedCache) -> None:
+    inner.release.set()
+    cache = write_behind.WriteBehindCacheImpl(inner)
+    cache.put_many([("k", str(i), i, 1) for i in range(50)])
+    assert cache.drain(5)
+    assert (cache.written, cache.expired) == (50, 0)
+    assert inner.get_many([("k", str(i)) for i in range(50)]) == list(range(50))
+    cache.close()
+
+
+def test_dropped_writes_evict_the_older_value(inner: GatedCache) -> None:
+    inner.release.set()
+    cache = write_behind.WriteBehindCacheImpl(inner, max_pending=1, batch_size=1, overflow="drop")
+    cache.put("k", "a", 1, None)
+    assert cache.drain(5)
+
+    inner.release.clear()
+    cache.put("k", "block", 0, None)
+    assert inner.entered.wait(5)
+    cache.put("k", "a", 2, None)
+    assert cache.dropped == 1
+    assert cache.get("k", "a") is abc._EMPTY
+
+    inner.release.set()
+    cache.close()
+
+
+def test_evict_tags_does_not_wait_for_unrelated_writes(inner: GatedCache) -> None:
+    cache = write_behind.WriteBehindCacheImpl(inner, batch_size=1)
+    cache.put("k", "block", 0, None)
+    assert inner.entered.wait(5)
+    cache.put_tagged("k", "a", 1, None, ["t"])
+    cache.put("k", "b", 2, None)
+
+    # Only the batch in flight is waited for, the untagged queued write stays queued
+    evicting = threading.Thread(target=cache.evict_tags, args=(["t"],))
+    evicting.start()
+    _wait_for(lambda: cache.pending == 2)
+    inner.release.set()
+    evicting.join(5)
+    assert not evicting.is_alive()
+
+    assert cache.get("k", "a") is abc._EMPTY
+    assert cache.get("k", "b") == 2
+    cache.close()